@@ -5,16 +5,24 @@ import base64
 from src.manager.manager import GeminiManager, Mode
 from enum import Enum
 import os
+import json
 import base64
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Depends
-from fastapi.responses import RedirectResponse, JSONResponse, FileResponse
+from fastapi.responses import RedirectResponse, JSONResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 from authlib.integrations.starlette_client import OAuth
 import requests
 from src.manager.manager import GeminiManager
 import argparse
+from src.manager.resource_monitor import ResourceMonitor
+from src.manager.utils.request_context import bind_request_context
+from src.manager.utils.tracing import pop_trace
+from src.manager.job_queue import JobQueue
+from src.manager.utils.fair_scheduler import get_scheduler_status, PRIORITIES
+from src.manager.utils.metrics import Gauge, render_metrics
+from src.manager.budget_manager import BudgetManager
 
 # 1. Load environment --------------------------------------------------
 load_dotenv()
@@ -133,6 +141,58 @@ async def api_login_status(request: Request):
         return {"status": "Logged out"}
 
 
+@app.get("/api/resources")
+async def api_resources(seconds: float = 300):
+    monitor = ResourceMonitor()
+    return {
+        "latest": monitor.latest(),
+        "series": monitor.get_time_series(seconds),
+        "attribution": monitor.get_attribution(),
+    }
+
+
+@app.get("/api/scheduler")
+async def api_scheduler():
+    return {
+        "scheduler": get_scheduler_status(),
+        "jobs": JobQueue().get_counts(),
+    }
+
+
+def _budget_remaining():
+    budget_manager = BudgetManager()
+    return {("resource",): budget_manager.get_current_remaining_resource_budget(),
+            ("expense",): budget_manager.get_current_remaining_expense_budget()}
+
+
+def _scheduler_depths(field):
+    return {(pool, priority): count
+            for pool, status in get_scheduler_status().items()
+            for priority, count in status[field].items()}
+
+
+def _job_counts():
+    return {(status, priority): count
+            for status, counts in JobQueue().get_counts().items()
+            for priority, count in counts.items()}
+
+
+# Read when /metrics is scraped
+Gauge("hashiru_budget_remaining", "Remaining resource and expense budget",
+      ["budget"]).set_function(_budget_remaining)
+Gauge("hashiru_scheduler_queued", "Calls waiting for a scheduler slot",
+      ["stage", "priority"]).set_function(lambda: _scheduler_depths("queued"))
+Gauge("hashiru_scheduler_in_flight", "Calls holding a scheduler slot",
+      ["stage", "priority"]).set_function(lambda: _scheduler_depths("in_flight"))
+Gauge("hashiru_jobs", "Queued and running jobs",
+      ["status", "priority"]).set_function(_job_counts)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 _header_html = f"""
 <div style="
     display: flex;
@@ -153,7 +213,22 @@ css = """
 """
 
 
-def run_model(message, history):
+def _request_user(request: gr.Request = None) -> str:
+    try:
+        user_info = request.session.get("user") or {}
+    except Exception:
+        # No request, or running without the session middleware (--no-auth)
+        user_info = {}
+    user = user_info.get("email", user_info.get("name"))
+    if user:
+        return user
+    # Callers without a login are told apart by session, so the scheduler's
+    # per-user limits do not make them all wait on each other
+    session_hash = getattr(request, "session_hash", None)
+    return f"anonymous-{session_hash}" if session_hash else "anonymous"
+
+
+def run_model(message, history, request: gr.Request = None):
     if 'text' in message:
         if message['text'].strip() != "":
             history.append({
@@ -167,7 +242,11 @@ def run_model(message, history):
                 "content": (file,)
             })
     yield "", history
-    for messages in model_manager.run(history):
+    session_id = request.session_hash if request is not None else "default"
+    user_id = _request_user(request)
+    # Usage recorded while answering is attributed to this user and session
+    for messages in bind_request_context(model_manager.run(history, session_id=session_id),
+                                         user_id, session_id):
         if messages[-1]["role"] == "assistant":
             yield messages[-1], messages
 
@@ -202,6 +281,60 @@ with gr.Blocks(title="HASHIRU AI", css=css, fill_width=True, fill_height=True) a
         print(f"Selected modes: {modes}")
         model_manager.set_modes(modes)
 
+    def get_trace(request: gr.Request) -> str:
+        """Spans recorded for this session since the last call, e.g. for one benchmark paper, as JSON"""
+        return json.dumps(pop_trace(request.session_hash))
+
+    gr.api(get_trace, api_name="get_trace")
+
+    def get_session_rounds(request: gr.Request) -> int:
+        """Tool rounds used by this session's latest turn, to spot runaway sessions"""
+        return model_manager.get_session_rounds(request.session_hash)
+
+    gr.api(get_session_rounds, api_name="get_session_rounds")
+
+    # Long reviews run as jobs, so they survive the client disconnecting
+    job_queue = JobQueue()
+    job_queue.start_workers(lambda messages, session_id: model_manager.run(messages, session_id=session_id))
+
+    def _job_json(job) -> str:
+        if job is None:
+            return json.dumps({"status": "not_found"})
+        job.pop("messages")
+        answers = [m["content"] for m in job.get("output") or []
+                   if m.get("role") == "assistant" and isinstance(m.get("content"), str)]
+        job["response"] = answers[-1] if answers else None
+        return json.dumps(job)
+
+    def submit_job(text: str, history: str = "[]", priority: str = "batch",
+                   request: gr.Request = None) -> str:
+        """
+        Queues a message after a JSON chat history and returns the job id.
+        Batch jobs yield to interactive chats, see /api/scheduler.
+        """
+        if priority not in PRIORITIES:
+            raise gr.Error(f"Priority must be one of {', '.join(PRIORITIES)}")
+        messages = json.loads(history or "[]")
+        messages.append({"role": "user", "content": text})
+        return job_queue.submit(messages, _request_user(request), priority)
+
+    def job_status(job_id: str) -> str:
+        """The job's status, the chat history so far and, once done, its trace, as JSON"""
+        return _job_json(job_queue.get(job_id))
+
+    def stream_job(job_id: str) -> str:
+        """Streams the job's status as JSON every time it changes, until it finishes"""
+        for job in job_queue.watch(job_id):
+            yield _job_json(job)
+
+    def cancel_job(job_id: str) -> str:
+        return json.dumps({"cancelled": job_queue.cancel(job_id)})
+
+    gr.api(submit_job, api_name="submit_job")
+    gr.api(job_status, api_name="job_status")
+    gr.api(stream_job, api_name="stream_job")
+    gr.api(cancel_job, api_name="cancel_job")
+
     with gr.Column(scale=1):
         with gr.Row(scale=0):
             with gr.Column(scale=0):
@@ -239,7 +372,9 @@ with gr.Blocks(title="HASHIRU AI", css=css, fill_width=True, fill_height=True) a
                              save_history=True,
                              editable=True,
                              multimodal=True,
-                             show_progress="full")
+                             show_progress="full",
+                             # Chats answered at the same time, e.g. by parallel benchmark workers
+                             concurrency_limit=int(os.getenv("HASHIRU_CHAT_CONCURRENCY", "1")))
 
 app = gr.mount_gradio_app(app, demo, path="/hashiru", auth_dependency=get_user, ssr_mode=False,)
 
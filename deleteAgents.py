@@ -1,15 +1,13 @@
-import json
 import ollama
+from src.manager.agent_registry import AgentRegistry
 from src.manager.utils.streamlit_interface import output_assistant_response
 
-with open("./src/models/models.json", "r", encoding="utf8") as f:
-    models = f.read()
-models = json.loads(models)
-for agent in models:
+registry = AgentRegistry()
+for agent, config in registry.all().items():
     output_assistant_response(f"Deleting agent: {agent}")
     try:
-        ollama.delete(agent)
+        # Local models are named by their unique model_id, older entries by the agent name
+        ollama.delete(config.get("model_id") or agent)
     except Exception as e:
         output_assistant_response(f"Error deleting agent {agent}: {e}")
-    with open("./src/models/models.json", "w", encoding="utf8") as f:
-        f.write(json.dumps({}, indent=4))
\ No newline at end of file
+    registry.remove(agent)
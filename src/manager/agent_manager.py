@@ -1,21 +1,37 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Type, Any, Optional, Tuple
+from typing import Dict, List, Type, Any, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import as_completed
+from contextlib import contextmanager, nullcontext
+import asyncio
+import hashlib
+import threading
+import time
 import os
 import json
-import ollama
-from openai import OpenAI
+import uuid
 from src.manager.utils.singleton import singleton
 from src.manager.utils.streamlit_interface import output_assistant_response
-from google import genai
+from src.manager.utils.async_runner import run_async, submit_async
+from src.manager.replay import requires_api_keys
+from src.manager.utils.provider_clients import (get_gemini_client, get_groq_client,
+                                                get_ollama_client, get_openai_client)
+from src.manager.utils.rate_limiter import (call_with_rate_limit, call_with_rate_limit_async,
+                                            stream_with_rate_limit)
 from google.genai import types
 from google.genai.types import *
-from groq import Groq
-import os
-from dotenv import load_dotenv
 from src.manager.budget_manager import BudgetManager
-
-MODEL_PATH = "./src/models/"
-MODEL_FILE_PATH = "./src/models/models.json"
+from src.manager.budget_ledger import BudgetExceeded
+from src.manager.agent_registry import AgentRegistry
+from src.manager.ollama_residency import OllamaResidencyManager
+from src.manager.resource_monitor import ResourceMonitor
+from src.manager.usage_ledger import UsageLedger
+from src.manager.model_router import ModelRouter
+from src.manager.response_cache import ResponseCache
+from src.manager.utils.tracing import span
+from src.manager.utils.fair_scheduler import get_scheduler
+from src.manager.utils.request_context import get_request_context
+from src.tools.default_tools.agent_cost_manager import AgentCostManager
 
 
 class Agent(ABC):
@@ -36,6 +52,11 @@ class Agent(ABC):
         self.create_expense_cost = create_expense_cost
         self.invoke_expense_cost = invoke_expense_cost
         self.output_expense_cost = output_expense_cost
+        self.last_usage = None
+        # None keeps the provider's default sampling
+        self.temperature: Optional[float] = None
+        # Set by the agent manager to charge calls the agent makes on its own
+        self.accounting = None
         self.create_model()
 
     @abstractmethod
@@ -44,10 +65,48 @@ class Agent(ABC):
         pass
 
     @abstractmethod
-    def ask_agent(self, prompt: str) -> str:
-        """ask agent a question"""
+    def ask_agent(self, prompt: str, conversation_id: Optional[str] = None) -> str:
+        """ask agent a question. Stateless agents ignore conversation_id"""
+        pass
+
+    async def ask_agent_async(self, prompt: str, conversation_id: Optional[str] = None) -> str:
+        """ask agent a question without blocking the event loop"""
+        return await asyncio.to_thread(self.ask_agent, prompt, conversation_id)
+
+    def stream_agent(self, prompt: str, conversation_id: Optional[str] = None):
+        """ask agent a question, yielding the answer in chunks as it is generated"""
+        yield self.ask_agent(prompt, conversation_id)
+
+    def reset_conversation(self, conversation_id: Optional[str] = None) -> None:
+        """forget one conversation, or all of them when conversation_id is None"""
         pass
 
+    def get_last_usage(self) -> Optional[dict]:
+        """token usage of the last call, if the agent reports it"""
+        return self.last_usage
+
+    def get_context_key(self, conversation_id: Optional[str] = None) -> str:
+        """identifies the conversation state a prompt is answered in. Stateless agents have none"""
+        return ""
+
+    def remember_turn(self, prompt: str, response: str,
+                      conversation_id: Optional[str] = None) -> None:
+        """add an answer served from the response cache to the conversation"""
+        pass
+
+    def _accounted_call(self, prompt: str):
+        """charges a call the agent makes on its own, yielding a dict for its response and status"""
+        if self.accounting is None:
+            return nullcontext({"response": "", "status": "error"})
+        return self.accounting(self, prompt)
+
+    def _temperature_kwargs(self) -> dict:
+        return {} if self.temperature is None else {"temperature": self.temperature}
+
+    def reset(self) -> None:
+        """clear conversation state so the agent can be reused for a new task"""
+        self.reset_conversation()
+
     @abstractmethod
     def delete_agent(self) -> None:
         """delete agent"""
@@ -71,26 +130,71 @@ class Agent(ABC):
 class OllamaAgent(Agent):
     type = "local"
 
+    def __init__(self, *args, model_id: Optional[str] = None):
+        # Unique per model, so neither a renamed agent from the warm pool nor a
+        # new agent under a released name ever replaces a model in use
+        self.model_id = model_id
+        super().__init__(*args)
+
     def create_model(self):
-        ollama_response = ollama.create(
-            model=self.agent_name,
+        self.residency = OllamaResidencyManager()
+        if self.model_id is None:
+            self.model_id = f"{self.agent_name}-{uuid.uuid4().hex[:12]}"
+        elif self.residency.model_exists(self.model_id):
+            # A stored agent loaded again, e.g. after a restart or by another worker
+            return
+        ollama_response = get_ollama_client().create(
+            model=self.model_id,
             from_=self.base_model,
             system=self.system_prompt,
             stream=False
         )
+        self.residency.invalidate(self.model_id)
 
-    def ask_agent(self, prompt):
+    def ask_agent(self, prompt, conversation_id=None):
         output_assistant_response(f"Asked Agent {self.agent_name} a question")
-        agent_response = ollama.chat(
-            model=self.agent_name,
-            messages=[{"role": "user", "content": prompt}],
-        )
+        with self.residency.slot(self.model_id):
+            agent_response = get_ollama_client().chat(
+                model=self.model_id,
+                messages=[{"role": "user", "content": prompt}],
+                keep_alive=self.residency.keep_alive_for(self.model_id),
+                options=self._temperature_kwargs() or None,
+            )
         output_assistant_response(
             f"Agent {self.agent_name} answered with {agent_response.message.content}")
         return agent_response.message.content
 
+    async def ask_agent_async(self, prompt, conversation_id=None):
+        output_assistant_response(f"Asked Agent {self.agent_name} a question")
+        async with self.residency.async_slot(self.model_id):
+            agent_response = await get_ollama_client(is_async=True).chat(
+                model=self.model_id,
+                messages=[{"role": "user", "content": prompt}],
+                keep_alive=self.residency.keep_alive_for(self.model_id),
+                options=self._temperature_kwargs() or None,
+            )
+        return agent_response.message.content
+
+    def stream_agent(self, prompt, conversation_id=None):
+        output_assistant_response(f"Asked Agent {self.agent_name} a question")
+        with self.residency.slot(self.model_id):
+            stream = get_ollama_client().chat(
+                model=self.model_id,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                keep_alive=self.residency.keep_alive_for(self.model_id),
+                options=self._temperature_kwargs() or None,
+            )
+            try:
+                for chunk in stream:
+                    if chunk.message.content:
+                        yield chunk.message.content
+            finally:
+                stream.close()
+
     def delete_agent(self):
-        ollama.delete(self.agent_name)
+        get_ollama_client().delete(self.model_id)
+        self.residency.invalidate(self.model_id)
 
     def get_type(self):
         return self.type
@@ -98,6 +202,12 @@ class OllamaAgent(Agent):
 
 class GeminiAgent(Agent):
     type = "cloud"
+    default_conversation_id = "default"
+    max_history_turns: int = int(os.getenv("HASHIRU_AGENT_HISTORY_TURNS", "10"))
+    summarize_old_turns: bool = os.getenv("HASHIRU_AGENT_SUMMARIZE", "0") == "1"
+    max_conversations: int = int(os.getenv("HASHIRU_AGENT_CONVERSATIONS", "8"))
+    # Conversation settings an agent config can override
+    conversation_settings = ("max_history_turns", "summarize_old_turns", "max_conversations")
 
     def __init__(self,
                  agent_name: str,
@@ -107,16 +217,20 @@ class GeminiAgent(Agent):
                  invoke_resource_cost: int,
                  create_expense_cost: int = 0,
                  invoke_expense_cost: int = 0,
-                 output_expense_cost: int = 0):
-        load_dotenv()
+                 output_expense_cost: int = 0,
+                 max_history_turns: Optional[int] = None,
+                 summarize_old_turns: Optional[bool] = None,
+                 max_conversations: Optional[int] = None):
         self.api_key = os.getenv("GEMINI_KEY")
-        if not self.api_key:
+        if not self.api_key and requires_api_keys():
             raise ValueError(
                 "Google API key is required for Gemini models. Set GOOGLE_API_KEY environment variable or pass api_key parameter.")
 
-        # Initialize the Gemini API
-        self.client = genai.Client(api_key=self.api_key)
-        self.chat = self.client.chats.create(model=base_model)
+        # The client is shared by every agent using the same key
+        self.client = get_gemini_client(self.api_key)
+        self.configure(max_history_turns=max_history_turns,
+                       summarize_old_turns=summarize_old_turns,
+                       max_conversations=max_conversations)
 
         # Call parent constructor after API setup
         super().__init__(agent_name,
@@ -128,20 +242,190 @@ class GeminiAgent(Agent):
                          invoke_expense_cost,
                          output_expense_cost)
 
+    def configure(self, **settings):
+        """Sets the conversation settings, settings that are None take the defaults"""
+        for key in self.conversation_settings:
+            value = settings.get(key)
+            setattr(self, key, getattr(type(self), key) if value is None else value)
+
     def create_model(self):
-        self.messages = []
+        # Conversations are kept here rather than in a client-bound chat
+        # session so the sync and async paths share the same history. Each
+        # task gets its own conversation, least recently used first.
+        self.conversations: OrderedDict = OrderedDict()
+        self.summaries: Dict[str, str] = {}
+        self.prompt_tokens: Dict[str, int] = {}
+
+    def _conversation_id(self, conversation_id):
+        return conversation_id or self.default_conversation_id
+
+    def _build_contents(self, prompt, conversation_id):
+        history = self.conversations.get(conversation_id, [])
+        return history + [types.Content(role="user",
+                                        parts=[types.Part.from_text(text=prompt)])]
+
+    def _store_history(self, conversation_id, history):
+        """Keeps the last max_history_turns turns and returns the turns that fell out"""
+        keep = 2 * self.max_history_turns
+        dropped = history[:-keep] if len(history) > keep else []
+        self.conversations[conversation_id] = history[len(dropped):]
+        self.conversations.move_to_end(conversation_id)
+        while len(self.conversations) > self.max_conversations:
+            oldest, _ = self.conversations.popitem(last=False)
+            self.summaries.pop(oldest, None)
+            self.prompt_tokens.pop(oldest, None)
+        return dropped
+
+    def _record_usage(self, conversation_id, usage_metadata):
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+        previous = self.prompt_tokens.get(conversation_id)
+        self.prompt_tokens[conversation_id] = prompt_tokens
+        self.last_usage = {
+            "conversation_id": conversation_id,
+            "history_turns": len(self.conversations.get(conversation_id, [])) // 2,
+            "prompt_tokens": prompt_tokens,
+            "prompt_token_growth": prompt_tokens - previous if previous is not None else 0,
+        }
 
-    def ask_agent(self, prompt):
-        response = self.chat.send_message(
-            message=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=self.system_prompt,
-            )
+    def _summary_request(self, conversation_id, dropped):
+        instruction = "Summarize the conversation above in a few sentences, keeping every fact and decision needed to continue it."
+        if self.summaries.get(conversation_id):
+            instruction += f" Merge it with this earlier summary: {self.summaries[conversation_id]}"
+        return dropped + [types.Content(role="user",
+                                        parts=[types.Part.from_text(text=instruction)])]
+
+    def _summary_prompt(self, contents):
+        return " ".join(part.text for content in contents
+                        for part in content.parts or [] if part.text)
+
+    def _record_turn(self, conversation_id, contents, model_content, usage_metadata):
+        dropped = self._store_history(conversation_id, contents + [model_content])
+        self._record_usage(conversation_id, usage_metadata)
+        return dropped
+
+    def _summarize(self, conversation_id, dropped):
+        if not dropped or not self.summarize_old_turns:
+            return
+        contents = self._summary_request(conversation_id, dropped)
+        try:
+            with self._accounted_call(self._summary_prompt(contents)) as usage:
+                response = call_with_rate_limit("gemini", self.base_model, lambda: self.client.models.generate_content(
+                    model=self.base_model,
+                    contents=contents,
+                ))
+                usage.update(response=response.text or "", status="success")
+        except BudgetExceeded:
+            # The old turns are dropped without a summary
+            return
+        self.summaries[conversation_id] = response.text
+
+    async def _summarize_async(self, conversation_id, dropped):
+        if not dropped or not self.summarize_old_turns:
+            return
+        contents = self._summary_request(conversation_id, dropped)
+        client = get_gemini_client(self.api_key, is_async=True)
+        try:
+            with self._accounted_call(self._summary_prompt(contents)) as usage:
+                response = await call_with_rate_limit_async("gemini", self.base_model, lambda: client.models.generate_content(
+                    model=self.base_model,
+                    contents=contents,
+                ))
+                usage.update(response=response.text or "", status="success")
+        except BudgetExceeded:
+            return
+        self.summaries[conversation_id] = response.text
+
+    def _get_config(self, conversation_id):
+        system_instruction = self.system_prompt
+        if self.summaries.get(conversation_id):
+            system_instruction += f"\n\nSummary of the earlier conversation:\n{self.summaries[conversation_id]}"
+        return types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            temperature=self.temperature,
         )
+
+    def _response_content(self, response):
+        if response.candidates and response.candidates[0].content:
+            return response.candidates[0].content
+        return types.Content(role="model", parts=[types.Part.from_text(text=response.text or "")])
+
+    def ask_agent(self, prompt, conversation_id=None):
+        conversation_id = self._conversation_id(conversation_id)
+        contents = self._build_contents(prompt, conversation_id)
+        response = call_with_rate_limit("gemini", self.base_model, lambda: self.client.models.generate_content(
+            model=self.base_model,
+            contents=contents,
+            config=self._get_config(conversation_id)
+        ))
+        dropped = self._record_turn(conversation_id, contents,
+                                    self._response_content(response), response.usage_metadata)
+        self._summarize(conversation_id, dropped)
         return response.text
 
+    async def ask_agent_async(self, prompt, conversation_id=None):
+        conversation_id = self._conversation_id(conversation_id)
+        contents = self._build_contents(prompt, conversation_id)
+        client = get_gemini_client(self.api_key, is_async=True)
+        response = await call_with_rate_limit_async("gemini", self.base_model, lambda: client.models.generate_content(
+            model=self.base_model,
+            contents=contents,
+            config=self._get_config(conversation_id)
+        ))
+        dropped = self._record_turn(conversation_id, contents,
+                                    self._response_content(response), response.usage_metadata)
+        await self._summarize_async(conversation_id, dropped)
+        return response.text
+
+    def stream_agent(self, prompt, conversation_id=None):
+        conversation_id = self._conversation_id(conversation_id)
+        contents = self._build_contents(prompt, conversation_id)
+        stream = stream_with_rate_limit("gemini", self.base_model, lambda: self.client.models.generate_content_stream(
+            model=self.base_model,
+            contents=contents,
+            config=self._get_config(conversation_id)
+        ))
+        text = ""
+        usage_metadata = None
+        try:
+            for chunk in stream:
+                usage_metadata = chunk.usage_metadata or usage_metadata
+                if chunk.text:
+                    text += chunk.text
+                    yield chunk.text
+        finally:
+            stream.close()
+        # Only completed answers become part of the conversation
+        dropped = self._record_turn(conversation_id, contents,
+                                    types.Content(role="model",
+                                                  parts=[types.Part.from_text(text=text)]),
+                                    usage_metadata)
+        self._summarize(conversation_id, dropped)
+
+    def get_context_key(self, conversation_id=None):
+        conversation_id = self._conversation_id(conversation_id)
+        history = [content.model_dump(mode="json", exclude_none=True)
+                   for content in self.conversations.get(conversation_id, [])]
+        return json.dumps([history, self.summaries.get(conversation_id)], sort_keys=True)
+
+    def remember_turn(self, prompt, response, conversation_id=None):
+        conversation_id = self._conversation_id(conversation_id)
+        contents = self._build_contents(prompt, conversation_id)
+        dropped = self._record_turn(conversation_id, contents,
+                                    types.Content(role="model",
+                                                  parts=[types.Part.from_text(text=response)]),
+                                    None)
+        self._summarize(conversation_id, dropped)
+
+    def reset_conversation(self, conversation_id=None):
+        if conversation_id is None:
+            self.create_model()
+            return
+        self.conversations.pop(conversation_id, None)
+        self.summaries.pop(conversation_id, None)
+        self.prompt_tokens.pop(conversation_id, None)
+
     def delete_agent(self):
-        self.messages = []
+        self.reset_conversation()
 
     def get_type(self):
         return self.type
@@ -168,10 +452,10 @@ class GroqAgent(Agent):
                          output_expense_cost)
 
         # Groq-specific API client setup
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
+        self.api_key = os.getenv("GROQ_API_KEY")
+        if not self.api_key and requires_api_keys():
             raise ValueError("GROQ_API_KEY environment variable not set. Please set it in your .env file or environment.")
-        self.client = Groq(api_key=api_key)
+        self.client = get_groq_client(self.api_key)
 
         if self.base_model and "groq-" in self.base_model:
             self.groq_api_model_name = self.base_model.split("groq-", 1)[1]
@@ -190,7 +474,7 @@ class GroqAgent(Agent):
         """
         pass
 
-    def ask_agent(self, prompt: str) -> str:
+    def ask_agent(self, prompt: str, conversation_id: Optional[str] = None) -> str:
         """Ask agent a question"""
         if not self.client:
             raise ConnectionError("Groq client not initialized. Check API key and constructor.")
@@ -202,10 +486,11 @@ class GroqAgent(Agent):
             {"role": "user", "content": prompt},
         ]
         try:
-            response = self.client.chat.completions.create(
+            response = call_with_rate_limit("groq", self.groq_api_model_name, lambda: self.client.chat.completions.create(
                 messages=messages,
                 model=self.groq_api_model_name, # Use the derived model name for Groq API
-            )
+                **self._temperature_kwargs(),
+            ))
             result = response.choices[0].message.content
             return result
         except Exception as e:
@@ -213,6 +498,43 @@ class GroqAgent(Agent):
             print(f"Error calling Groq API: {e}")
             raise  # Re-raise the exception or handle it as appropriate
 
+    async def ask_agent_async(self, prompt: str, conversation_id: Optional[str] = None) -> str:
+        """Ask agent a question over the shared async client"""
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        try:
+            client = get_groq_client(self.api_key, is_async=True)
+            response = await call_with_rate_limit_async("groq", self.groq_api_model_name, lambda: client.chat.completions.create(
+                messages=messages,
+                model=self.groq_api_model_name,
+                **self._temperature_kwargs(),
+            ))
+            return response.choices[0].message.content
+        except Exception as e:
+            print(f"Error calling Groq API: {e}")
+            raise
+
+    def stream_agent(self, prompt: str, conversation_id: Optional[str] = None):
+        """Ask agent a question, yielding the answer as it is generated"""
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        stream = stream_with_rate_limit("groq", self.groq_api_model_name, lambda: self.client.chat.completions.create(
+            messages=messages,
+            model=self.groq_api_model_name,
+            stream=True,
+            **self._temperature_kwargs(),
+        ))
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
     def delete_agent(self) -> None:
         """Delete agent"""
         pass
@@ -239,13 +561,10 @@ class LambdaAgent(Agent):
         self.api_key = api_key or os.getenv("LAMBDA_API_KEY")
 
         self.lambda_model = base_model.split("lambda-")[1] if base_model.startswith("lambda-") else base_model
-        if not self.api_key:
+        if not self.api_key and requires_api_keys():
             raise ValueError("Lambda API key must be provided or set in LAMBDA_API_KEY environment variable.")
         
-        self.client = client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.lambda_url,
-        )
+        self.client = get_openai_client(self.api_key, self.lambda_url)
 
         super().__init__(agent_name,
                          base_model,
@@ -259,21 +578,57 @@ class LambdaAgent(Agent):
     def create_model(self) -> None:
         pass  # Lambda already deployed
 
-    def ask_agent(self, prompt: str) -> str:
+    def ask_agent(self, prompt: str, conversation_id: Optional[str] = None) -> str:
         """Ask agent a question"""
         try:
-            response = self.client.chat.completions.create(
+            response = call_with_rate_limit("lambda", self.lambda_model, lambda: self.client.chat.completions.create(
                 model=self.lambda_model,
                 messages=[
                     {"role": "system", "content": self.system_prompt},
                     {"role": "user", "content": prompt}
                 ],
-            )
+                **self._temperature_kwargs(),
+            ))
+            return response.choices[0].message.content
+        except Exception as e:
+            output_assistant_response(f"Error asking agent: {e}")
+            raise
+
+    async def ask_agent_async(self, prompt: str, conversation_id: Optional[str] = None) -> str:
+        """Ask agent a question over the shared async client"""
+        try:
+            client = get_openai_client(self.api_key, self.lambda_url, is_async=True)
+            response = await call_with_rate_limit_async("lambda", self.lambda_model, lambda: client.chat.completions.create(
+                model=self.lambda_model,
+                messages=[
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                **self._temperature_kwargs(),
+            ))
             return response.choices[0].message.content
         except Exception as e:
             output_assistant_response(f"Error asking agent: {e}")
             raise
 
+    def stream_agent(self, prompt: str, conversation_id: Optional[str] = None):
+        """Ask agent a question, yielding the answer as it is generated"""
+        stream = stream_with_rate_limit("lambda", self.lambda_model, lambda: self.client.chat.completions.create(
+            model=self.lambda_model,
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            stream=True,
+            **self._temperature_kwargs(),
+        ))
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
     def delete_agent(self) -> None:
         pass
 
@@ -286,9 +641,32 @@ class AgentManager():
     is_creation_enabled: bool = True
     is_cloud_invocation_enabled: bool = True
     is_local_invocation_enabled: bool = True
+    is_hedging_enabled: bool = os.getenv("HASHIRU_HEDGE_REQUESTS", "0") == "1"
+    max_idle_agents: int = 6
+    # A hedge is only sent once the model's p95 is known from this many calls
+    hedge_min_samples: int = 5
+    # Expense that hedged requests may add on top of the primary calls, per session
+    max_hedge_expense: float = 1.0
+    max_hedge_sessions: int = 1000
 
     def __init__(self):
         self._agents: Dict[str, Agent] = {}
+        # Fired agents are kept warm, least recently used first, so that an
+        # identical agent created later skips model creation. The pool is per
+        # process; unique local model ids keep workers from touching each other's models
+        self._idle_agents: OrderedDict = OrderedDict()
+        self._pool_lock = threading.Lock()
+        # Stored agents live in the registry and are only built on first use
+        self._registry = AgentRegistry()
+        self._agents_lock = threading.Lock()
+        self.resource_monitor = ResourceMonitor()
+        self.usage_ledger = UsageLedger()
+        self.model_router = ModelRouter()
+        self.response_cache = ResponseCache()
+        # Copies of agents on equivalent models of other providers, built on first need
+        self._backup_agents: Dict[Tuple[str, str], Optional[Agent]] = {}
+        self._backup_lock = threading.Lock()
+        self._hedge_expense: OrderedDict = OrderedDict()  # session -> hedge expense
         self._agent_types = {
             "ollama": OllamaAgent,
             "gemini": GeminiAgent,
@@ -296,8 +674,6 @@ class AgentManager():
             "lambda": LambdaAgent,
         }
 
-        self._load_agents()
-
     def set_creation_mode(self, status: bool):
         self.is_creation_enabled = status
         if status:
@@ -319,6 +695,13 @@ class AgentManager():
         else:
             output_assistant_response("Local invocation mode is disabled.")
 
+    def set_hedging_mode(self, status: bool):
+        self.is_hedging_enabled = status
+        if status:
+            output_assistant_response("Request hedging is enabled.")
+        else:
+            output_assistant_response("Request hedging is disabled.")
+
     def create_agent(self, agent_name: str,
                      base_model: str, system_prompt: str,
                      description: str = "", create_resource_cost: float = 0,
@@ -333,22 +716,9 @@ class AgentManager():
         if agent_name in self._agents:
             raise ValueError(f"Agent {agent_name} already exists")
 
-        self._agents[agent_name] = self.create_agent_class(
-            agent_name,
-            base_model,
-            system_prompt,
-            description=description,
-            create_resource_cost=create_resource_cost,
-            invoke_resource_cost=invoke_resource_cost,
-            create_expense_cost=create_expense_cost,
-            invoke_expense_cost=invoke_expense_cost,
-            output_expense_cost=output_expense_cost,
-            **additional_params  # For any future parameters we might want to add
-        )
-
-        # save agent to file
-        self._save_agent(
-            agent_name,
+        # Claiming the name in the registry first makes concurrent creates of
+        # the same agent fail cleanly instead of overwriting each other
+        self._registry.add(agent_name, self._make_agent_config(
             base_model,
             system_prompt,
             description=description,
@@ -358,7 +728,24 @@ class AgentManager():
             invoke_expense_cost=invoke_expense_cost,
             output_expense_cost=output_expense_cost,
             **additional_params  # For any future parameters we might want to add
-        )
+        ))
+        try:
+            self._agents[agent_name] = self._acquire_agent(
+                agent_name,
+                base_model,
+                system_prompt,
+                description=description,
+                create_resource_cost=create_resource_cost,
+                invoke_resource_cost=invoke_resource_cost,
+                create_expense_cost=create_expense_cost,
+                invoke_expense_cost=invoke_expense_cost,
+                output_expense_cost=output_expense_cost,
+                **additional_params  # For any future parameters we might want to add
+            )
+        except Exception:
+            self._registry.remove(agent_name)
+            raise
+        self._store_model_id(agent_name, self._agents[agent_name])
         return (self._agents[agent_name],
                 self.budget_manager.get_current_remaining_resource_budget(),
                 self.budget_manager.get_current_remaining_expense_budget())
@@ -389,150 +776,708 @@ class AgentManager():
 
         if not agent_class:
             raise ValueError(f"Unsupported base model {base_model}")
-
-        created_agent = agent_class(agent_name,
-                                    base_model,
-                                    system_prompt,
-                                    create_resource_cost,
-                                    invoke_resource_cost,
-                                    create_expense_cost,
-                                    invoke_expense_cost,
-                                    output_expense_cost,
-                                    **additional_params)
-
+        if agent_class is OllamaAgent and additional_params.get("model_id") is None:
+            additional_params["model_id"] = self._new_model_id(agent_name)
+        if agent_class is not GeminiAgent:
+            for key in GeminiAgent.conversation_settings:
+                additional_params.pop(key, None)
+
+        # Check the budget before building anything that would need cleaning up,
+        # and hold it while building so concurrent creations cannot overshoot it
         self.validate_budget(create_resource_cost,
                              create_expense_cost)
+        resource = self.budget_manager.reserve_resource(create_resource_cost)
+        expense = None
+        try:
+            expense = self.budget_manager.reserve_expense(create_expense_cost)
+            created_agent = agent_class(agent_name,
+                                        base_model,
+                                        system_prompt,
+                                        create_resource_cost,
+                                        invoke_resource_cost,
+                                        create_expense_cost,
+                                        invoke_expense_cost,
+                                        output_expense_cost,
+                                        **additional_params)
+        except BaseException:
+            self.budget_manager.release_reservation(resource)
+            self.budget_manager.release_reservation(expense)
+            raise
+        created_agent.temperature = self.response_cache.get_temperature()
+        created_agent.accounting = self._accounting
 
-        self.budget_manager.add_to_resource_budget(create_resource_cost)
-        self.budget_manager.add_to_expense_budget(create_expense_cost)
+        self.budget_manager.commit_reservation(resource)
+        self.budget_manager.commit_reservation(expense)
         # create agent
         return created_agent
 
+    def _model_in_use(self, model_id: str, exclude: Optional[Agent] = None) -> bool:
+        """
+        Whether a live agent of this process, or any stored agent of any
+        worker, uses the local model. Idle agents in the warm pool are not live.
+        """
+        live = list(self._agents.values()) + \
+            [backup for backup in list(self._backup_agents.values()) if backup is not None]
+        if any(agent is not exclude and getattr(agent, "model_id", None) == model_id
+               for agent in live):
+            return True
+        return any(config.get("model_id") == model_id
+                   for config in self._registry.all().values())
+
+    def _new_model_id(self, agent_name: str) -> str:
+        while True:
+            model_id = f"{agent_name}-{uuid.uuid4().hex[:12]}"
+            if not self._model_in_use(model_id):
+                return model_id
+
+    def _store_model_id(self, agent_name: str, agent: Agent) -> None:
+        """Records the local model behind a stored agent, so other workers leave it alone"""
+        model_id = getattr(agent, "model_id", None)
+        if model_id is not None:
+            self._registry.update(agent_name, model_id=model_id)
+
+    def _delete_model(self, agent: Agent) -> None:
+        model_id = getattr(agent, "model_id", None)
+        if model_id is not None and self._model_in_use(model_id, exclude=agent):
+            output_assistant_response(
+                f"Keeping model {model_id} of {agent.agent_name}, another agent still uses it")
+            return
+        agent.delete_agent()
+
+    def _pool_key(self, base_model: str, system_prompt: str) -> Tuple[str, str]:
+        return (base_model, hashlib.sha256(system_prompt.encode("utf8")).hexdigest())
+
+    def _acquire_agent(self,
+                       agent_name: str,
+                       base_model: str,
+                       system_prompt: str,
+                       description: str = "",
+                       create_resource_cost: float = 0,
+                       invoke_resource_cost: float = 0,
+                       create_expense_cost: float = 0,
+                       invoke_expense_cost: float = 0,
+                       output_expense_cost: float = 0,
+                       **additional_params) -> Agent:
+        """
+        Reuse an idle agent with the same model and system prompt, or create
+        one. A stored agent whose local model is known keeps that model.
+        """
+        key = self._pool_key(base_model, system_prompt)
+        agent = None
+        if additional_params.get("model_id") is None:
+            with self._pool_lock:
+                for agent_id, (idle_key, idle_agent) in self._idle_agents.items():
+                    if idle_key == key:
+                        agent = idle_agent
+                        del self._idle_agents[agent_id]
+                        break
+        if agent is None:
+            return self.create_agent_class(
+                agent_name,
+                base_model,
+                system_prompt,
+                description=description,
+                create_resource_cost=create_resource_cost,
+                invoke_resource_cost=invoke_resource_cost,
+                create_expense_cost=create_expense_cost,
+                invoke_expense_cost=invoke_expense_cost,
+                output_expense_cost=output_expense_cost,
+                **additional_params
+            )
+
+        # The model already exists, so only the resource reservation is taken again
+        try:
+            self.validate_budget(create_resource_cost, 0)
+            self.budget_manager.add_to_resource_budget(create_resource_cost)
+        except Exception:
+            self._release_agent(agent)
+            raise
+        output_assistant_response(
+            f"Reusing warm agent {agent.agent_name} as {agent_name}")
+        agent.agent_name = agent_name
+        agent.create_resource_cost = create_resource_cost
+        agent.invoke_resource_cost = invoke_resource_cost
+        agent.create_expense_cost = create_expense_cost
+        agent.invoke_expense_cost = invoke_expense_cost
+        agent.output_expense_cost = output_expense_cost
+        if isinstance(agent, GeminiAgent):
+            agent.configure(**additional_params)
+        return agent
+
+    def _release_agent(self, agent: Agent) -> None:
+        """Return an agent to the warm pool, evicting the least recently used ones"""
+        agent.reset()
+        evicted = []
+        with self._pool_lock:
+            self._idle_agents[id(agent)] = (
+                self._pool_key(agent.base_model, agent.system_prompt), agent)
+            while len(self._idle_agents) > self.max_idle_agents:
+                _, (_, oldest) = self._idle_agents.popitem(last=False)
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                self._delete_model(oldest)
+            except Exception as e:
+                output_assistant_response(
+                    f"Error deleting idle agent {oldest.agent_name}: {e}")
+
     def get_agent(self, agent_name: str) -> Agent:
-        """Get existing agent by name"""
-        if agent_name not in self._agents:
-            raise ValueError(f"Agent {agent_name} does not exists")
-        return self._agents[agent_name]
+        """Get existing agent by name, building it on first use"""
+        agent = self._agents.get(agent_name)
+        if agent is not None:
+            data = self._registry.get(agent_name)
+            # Another worker may have deleted or replaced the agent since it was built here
+            if data is not None and data["base_model"] == agent.base_model \
+                    and data["system_prompt"] == agent.system_prompt:
+                return agent
+            with self._agents_lock:
+                released = self._agents.get(agent_name) is agent
+                if released:
+                    del self._agents[agent_name]
+            if released:
+                # Rebuilding the agent takes its creation cost again
+                self.budget_manager.remove_from_resource_expense(agent.create_resource_cost)
+                self._release_agent(agent)
+        with self._agents_lock:
+            if agent_name in self._agents:
+                return self._agents[agent_name]
+            data = self._registry.get(agent_name)
+            if data is None:
+                raise ValueError(f"Agent {agent_name} does not exists")
+            model_id = data.get("model_id")
+            if model_id is None and \
+                    self._agent_types.get(self._get_agent_type(data["base_model"])) is OllamaAgent:
+                # Stored before models had unique ids, the model is named after the agent
+                model_id = agent_name
+            self._agents[agent_name] = self._acquire_agent(
+                agent_name,
+                data["base_model"],
+                data["system_prompt"],
+                description=data.get("description", ""),
+                create_resource_cost=data.get("create_resource_cost", 0),
+                invoke_resource_cost=data.get("invoke_resource_cost", 0),
+                create_expense_cost=data.get("create_expense_cost", 0),
+                invoke_expense_cost=data.get("invoke_expense_cost", 0),
+                output_expense_cost=data.get("output_expense_cost", 0),
+                **data.get("additional_params", {}),
+                **{key: data[key] for key in GeminiAgent.conversation_settings if key in data},
+                **({"model_id": model_id} if model_id else {})
+            )
+            self._store_model_id(agent_name, self._agents[agent_name])
+            return self._agents[agent_name]
 
     def list_agents(self) -> dict:
         """Return agent information (name, description, costs)"""
         try:
-            if os.path.exists(MODEL_FILE_PATH):
-                with open(MODEL_FILE_PATH, "r", encoding="utf8") as f:
-                    full_models = json.loads(f.read())
-
-                # Create a simplified version with only the description and costs
-                simplified_agents = {}
-                for name, data in full_models.items():
-                    simplified_agents[name] = {
-                        "description": data.get("description", ""),
-                        "create_resource_cost": data.get("create_resource_cost", 0),
-                        "invoke_resource_cost": data.get("invoke_resource_cost", 0),
-                        "create_expense_cost": data.get("create_expense_cost", 0),
-                        "invoke_expense_cost": data.get("invoke_expense_cost", 0),
-                        "base_model": data.get("base_model", ""),
-                    }
-                return simplified_agents
-            else:
-                return {}
+            full_models = self._registry.all()
+
+            # Create a simplified version with only the description and costs
+            simplified_agents = {}
+            for name, data in full_models.items():
+                simplified_agents[name] = {
+                    "description": data.get("description", ""),
+                    "create_resource_cost": data.get("create_resource_cost", 0),
+                    "invoke_resource_cost": data.get("invoke_resource_cost", 0),
+                    "create_expense_cost": data.get("create_expense_cost", 0),
+                    "invoke_expense_cost": data.get("invoke_expense_cost", 0),
+                    "base_model": data.get("base_model", ""),
+                }
+            return simplified_agents
         except Exception as e:
             output_assistant_response(f"Error listing agents: {e}")
             return {}
 
     def delete_agent(self, agent_name: str) -> int:
-        agent: Agent = self.get_agent(agent_name)
-
-        self.budget_manager.remove_from_resource_expense(
-            agent.create_resource_cost)
-        agent.delete_agent()
-
-        del self._agents[agent_name]
-        try:
-            if os.path.exists(MODEL_FILE_PATH):
-                with open(MODEL_FILE_PATH, "r", encoding="utf8") as f:
-                    models = json.loads(f.read())
+        agent: Optional[Agent] = self._agents.pop(agent_name, None)
+        removed = self._registry.remove(agent_name)
+        if agent is None and not removed:
+            raise ValueError(f"Agent {agent_name} does not exists")
 
-                del models[agent_name]
-                with open(MODEL_FILE_PATH, "w", encoding="utf8") as f:
-                    f.write(json.dumps(models, indent=4))
-        except Exception as e:
-            output_assistant_response(f"Error deleting agent: {e}")
+        # An agent that was never used was never built or charged for
+        if agent is not None:
+            self.budget_manager.remove_from_resource_expense(
+                agent.create_resource_cost)
+            self._release_agent(agent)
+        with self._backup_lock:
+            backups = [self._backup_agents.pop(key) for key in list(self._backup_agents)
+                       if key[0] == agent_name]
+        for backup in backups:
+            if backup is not None:
+                self.budget_manager.remove_from_resource_expense(
+                    backup.create_resource_cost)
+                self._delete_model(backup)
         return (self.budget_manager.get_current_remaining_resource_budget(),
                 self.budget_manager.get_current_remaining_expense_budget())
 
-    def ask_agent(self, agent_name: str, prompt: str) -> Tuple[str, int]:
+    def _get_invocable_agent(self, agent_name: str,
+                             conversation_id: Optional[str] = None,
+                             reset_conversation: bool = False) -> Agent:
         agent: Agent = self.get_agent(agent_name)
-        print(agent.get_type())
-        print(agent_name)
-        print(self.is_local_invocation_enabled,
-              self.is_cloud_invocation_enabled)
         if not self.is_local_invocation_enabled and agent.get_type() == "local":
             raise ValueError("Local invocation mode is disabled.")
 
         if not self.is_cloud_invocation_enabled and agent.get_type() == "cloud":
             raise ValueError("Cloud invocation mode is disabled.")
 
+        if reset_conversation:
+            agent.reset_conversation(conversation_id)
+        return agent
+
+    def _get_input_expense(self, agent: Agent, prompt: str) -> float:
         n_tokens = len(prompt.split())/1000000
+        return agent.invoke_expense_cost*n_tokens
+
+    def _get_output_expense(self, agent: Agent, response: str) -> float:
+        n_tokens = len(response.split())/1000000
+        return agent.output_expense_cost*n_tokens
+
+    @contextmanager
+    def _invocation(self, agent: Agent, prompt: str, reserve_resources: bool = True):
+        """
+        Holds the agent's invoke resource cost for the duration of the call,
+        measures it and records it in the usage ledger. The caller stores the
+        response and final status in the yielded dict.
+
+        The input expense is reserved up front and the actual cost of input
+        and output is spent once the call has answered, so a failed call
+        costs nothing. Streaming callers extend usage["expense"] chunk by chunk.
+        """
+        self.resource_monitor.admit("agent", agent.agent_name,
+                                    agent.invoke_resource_cost)
+        input_expense = self._get_input_expense(agent, prompt)
+        expense = self.budget_manager.reserve_expense(input_expense)
+        reservation = None
+        usage = {"response": "", "status": "error", "expense": expense}
+        started = time.monotonic()
+        try:
+            if reserve_resources:
+                reservation = self.budget_manager.reserve_resource(
+                    agent.invoke_resource_cost)
+            with span("agent.call", agent=agent.agent_name, model=agent.base_model) as call_span, \
+                    self.resource_monitor.track("agent", agent.agent_name,
+                                                agent.invoke_resource_cost):
+                try:
+                    yield usage
+                    call_span.set(status=usage["status"])
+                finally:
+                    call_span.set(input_tokens=len(prompt.split()),
+                                  output_tokens=len(usage["response"].split()),
+                                  cost=input_expense + self._get_output_expense(agent, usage["response"]))
+        except asyncio.CancelledError:
+            # The losing side of a hedged request says nothing about the model
+            usage["status"] = "cancelled"
+            raise
+        finally:
+            self.budget_manager.release_reservation(reservation)
+            if usage["status"] == "success" or usage["response"]:
+                self.budget_manager.commit_reservation(
+                    expense, input_expense + self._get_output_expense(agent, usage["response"]))
+            else:
+                self.budget_manager.release_reservation(expense)
+            latency = time.monotonic() - started
+            output_tokens = len(usage["response"].split())
+            # Observed before recording, as the router seeds new models from the ledger.
+            # Truncated and cancelled calls did not measure the model's full answer.
+            if usage["status"] in ("success", "error"):
+                self.model_router.observe(agent.base_model, latency, output_tokens,
+                                          usage["status"] == "success")
+            self.usage_ledger.record(
+                agent=agent.agent_name,
+                model=agent.base_model,
+                input_tokens=len(prompt.split()),
+                output_tokens=output_tokens,
+                cost=input_expense + self._get_output_expense(agent, usage["response"]),
+                latency=latency,
+                status=usage["status"])
+
+    @contextmanager
+    def _accounting(self, agent: Agent, prompt: str):
+        """
+        Charges a call an agent makes on its own, like summarizing old turns,
+        to the expense budget and usage ledger. Its resources are held by the
+        invocation it runs in.
+        """
+        input_expense = self._get_input_expense(agent, prompt)
+        expense = self.budget_manager.reserve_expense(input_expense)
+        usage = {"response": "", "status": "error"}
+        started = time.monotonic()
+        try:
+            yield usage
+        finally:
+            cost = input_expense + self._get_output_expense(agent, usage["response"])
+            if usage["status"] == "success":
+                self.budget_manager.commit_reservation(expense, cost)
+            else:
+                self.budget_manager.release_reservation(expense)
+            self.usage_ledger.record(
+                agent=agent.agent_name,
+                model=agent.base_model,
+                input_tokens=len(prompt.split()),
+                output_tokens=len(usage["response"].split()),
+                cost=cost,
+                latency=time.monotonic() - started,
+                status=usage["status"])
+
+    def _invoke_agent(self, agent: Agent, prompt: str,
+                      conversation_id: Optional[str] = None) -> str:
+        with get_scheduler("agent").slot(), self._invocation(agent, prompt) as usage:
+            response = agent.ask_agent(prompt, conversation_id)
+            usage.update(response=response, status="success")
+        return response
+
+    async def _invoke_agent_async(self, agent: Agent, prompt: str,
+                                  conversation_id: Optional[str] = None,
+                                  reserve_resources: bool = True) -> str:
+        async with get_scheduler("agent").slot_async():
+            with self._invocation(agent, prompt, reserve_resources) as usage:
+                response = await agent.ask_agent_async(prompt, conversation_id)
+                usage.update(response=response, status="success")
+        return response
+
+    def _get_backup_models(self, agent: Agent) -> List[str]:
+        """Equivalent models of other providers, whose copies of the agent are built on first need"""
+        provider = self._get_agent_type(agent.base_model)
+        return [base_model for base_model in self.model_router.get_equivalent_models(agent.base_model)
+                if self._get_agent_type(base_model) != provider
+                and self._backup_agents.get((agent.agent_name, base_model), True) is not None]
+
+    def _get_backup_agent(self, agent: Agent, base_model: str,
+                          costs: dict) -> Optional[Agent]:
+        key = (agent.agent_name, base_model)
+        with self._backup_lock:
+            if key not in self._backup_agents:
+                try:
+                    self._backup_agents[key] = self.create_agent_class(
+                        f"{agent.agent_name}-{base_model}",
+                        base_model,
+                        agent.system_prompt,
+                        create_resource_cost=costs.get("create_resource_cost", 0),
+                        invoke_resource_cost=costs.get("invoke_resource_cost", 0),
+                        create_expense_cost=costs.get("create_expense_cost", 0),
+                        invoke_expense_cost=costs.get("invoke_expense_cost", 0),
+                        output_expense_cost=costs.get("output_expense_cost", 0))
+                except Exception as e:
+                    # e.g. no API key for that provider, so do not try again
+                    output_assistant_response(
+                        f"Cannot use {base_model} as a backup for {agent.agent_name}: {e}")
+                    self._backup_agents[key] = None
+            return self._backup_agents[key]
+
+    def _take_hedge_expense(self, estimate: float) -> bool:
+        """Counts a hedge against the session's cap, or returns False if it would exceed it"""
+        _, session_id = get_request_context()
+        with self._backup_lock:
+            spent = self._hedge_expense.get(session_id, 0)
+            if spent + estimate > self.max_hedge_expense:
+                return False
+            self._hedge_expense[session_id] = spent + estimate
+            self._hedge_expense.move_to_end(session_id)
+            while len(self._hedge_expense) > self.max_hedge_sessions:
+                self._hedge_expense.popitem(last=False)
+        return True
+
+    def _next_backup(self, agent: Agent, base_models: List[str], prompt: str,
+                     hedge: bool) -> Optional[Agent]:
+        """
+        Takes models off base_models until one is affordable and returns the
+        agent's backup on it, or None when there is none. Backups are only
+        created here, once a hedge or failover starts.
+        """
+        while base_models:
+            base_model = base_models.pop(0)
+            costs = AgentCostManager().get_costs().get(base_model, agent.get_costs())
+            input_expense = costs.get("invoke_expense_cost", 0) * len(prompt.split()) / 1000000
+            # Assume an answer of about a thousand tokens for the hedge cap
+            estimate = input_expense + costs.get("output_expense_cost", 0) * 1000 / 1000000
+            if not self.budget_manager.can_spend_expense(estimate) \
+                    or not self.budget_manager.can_spend_resource(costs.get("invoke_resource_cost", 0)):
+                continue
+            if hedge and not self._take_hedge_expense(estimate):
+                return None
+            backup = self._get_backup_agent(agent, base_model, costs)
+            if backup is None:
+                continue
+            output_assistant_response(
+                f"{'Hedging' if hedge else 'Failing over'} with {backup.agent_name}")
+            return backup
+        return None
+
+    def _start_backup(self, agent: Agent, base_models: List[str], prompt: str,
+                      conversation_id: Optional[str], hedge: bool):
+        """Starts the next affordable backup, or returns None when there is none"""
+        backup = self._next_backup(agent, base_models, prompt, hedge)
+        if backup is None:
+            return None
+        return asyncio.ensure_future(
+            self._invoke_agent_async(backup, prompt, conversation_id))
+
+    async def _invoke_resilient_async(self, agent: Agent, prompt: str,
+                                      conversation_id: Optional[str] = None,
+                                      reserve_resources: bool = True) -> str:
+        """
+        Calls the agent and fails over to an equivalent model on another provider
+        if it errors. With hedging enabled, a backup is also asked once the call
+        has run longer than the model's p95 latency, and the first answer wins.
+        Backups keep their own conversation history.
+        """
+        backup_models = self._get_backup_models(agent)
+        hedge_delay = None
+        if self.is_hedging_enabled and backup_models:
+            hedge_delay = self.model_router.get_p95_latency(agent.base_model,
+                                                            self.hedge_min_samples)
+        pending = {asyncio.ensure_future(self._invoke_agent_async(
+            agent, prompt, conversation_id, reserve_resources))}
+        errors = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        errors.append(asyncio.CancelledError())
+                    elif task.exception() is None:
+                        return task.result()
+                    else:
+                        errors.append(task.exception())
+                if not done:
+                    # Only one hedge per call
+                    hedge_delay = None
+                    hedge = self._start_backup(agent, backup_models, prompt,
+                                               conversation_id, hedge=True)
+                    if hedge is not None:
+                        pending.add(hedge)
+                elif not pending:
+                    failover = self._start_backup(agent, backup_models, prompt,
+                                                  conversation_id, hedge=False)
+                    if failover is not None:
+                        pending.add(failover)
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _invoke_resilient(self, agent: Agent, prompt: str,
+                          conversation_id: Optional[str] = None) -> str:
+        if not self._get_backup_models(agent):
+            return self._invoke_agent(agent, prompt, conversation_id)
+        return run_async(self._invoke_resilient_async(agent, prompt, conversation_id))
+
+    def _get_cached_response(self, agent: Agent, prompt: str,
+                             conversation_id: Optional[str] = None) -> Optional[str]:
+        """An answer from the response cache, which costs nothing, or None"""
+        started = time.monotonic()
+        response = self.response_cache.get_response(agent.base_model, agent.system_prompt, prompt,
+                                                     agent.get_context_key(conversation_id),
+                                                     agent.temperature)
+        if response is not None:
+            with span("ask_agent", agent=agent.agent_name, model=agent.base_model,
+                      cached=True, output_tokens=len(response.split())):
+                agent.remember_turn(prompt, response, conversation_id)
+            self.usage_ledger.record(agent=agent.agent_name,
+                                     model=agent.base_model,
+                                     input_tokens=len(prompt.split()),
+                                     output_tokens=len(response.split()),
+                                     latency=time.monotonic() - started,
+                                     status="cached")
+        return response
+
+    def _invoke_and_cache(self, agent: Agent, prompt: str,
+                          conversation_id: Optional[str] = None) -> str:
+        context = agent.get_context_key(conversation_id)
+        # Covers failover and hedging, each provider call is an agent.call span inside it
+        with span("ask_agent", agent=agent.agent_name, model=agent.base_model):
+            response = self._invoke_resilient(agent, prompt, conversation_id)
+        self.response_cache.put_response(agent.base_model, agent.system_prompt, prompt,
+                                         response, context, agent.temperature)
+        return response
+
+    async def _invoke_and_cache_async(self, agent: Agent, prompt: str,
+                                      conversation_id: Optional[str] = None,
+                                      reserve_resources: bool = True) -> str:
+        context = agent.get_context_key(conversation_id)
+        with span("ask_agent", agent=agent.agent_name, model=agent.base_model):
+            response = await self._invoke_resilient_async(agent, prompt, conversation_id,
+                                                          reserve_resources)
+        self.response_cache.put_response(agent.base_model, agent.system_prompt, prompt,
+                                         response, context, agent.temperature)
+        return response
+
+    def ask_agent(self, agent_name: str, prompt: str,
+                  conversation_id: Optional[str] = None,
+                  reset_conversation: bool = False) -> Tuple[str, int]:
+        agent: Agent = self._get_invocable_agent(agent_name,
+                                                 conversation_id,
+                                                 reset_conversation)
+        response = self._get_cached_response(agent, prompt, conversation_id)
+        if response is not None:
+            return (response,
+                    self.budget_manager.get_current_remaining_resource_budget(),
+                    self.budget_manager.get_current_remaining_expense_budget())
+        input_expense = self._get_input_expense(agent, prompt)
 
         self.validate_budget(agent.invoke_resource_cost,
-                             agent.invoke_expense_cost*n_tokens)
+                             input_expense)
 
-        self.budget_manager.add_to_expense_budget(
-            agent.invoke_expense_cost*n_tokens)
+        response = self._invoke_and_cache(agent, prompt, conversation_id)
+        return (response,
+                self.budget_manager.get_current_remaining_resource_budget(),
+                self.budget_manager.get_current_remaining_expense_budget())
 
-        response = agent.ask_agent(prompt)
-        n_tokens = len(response.split())/1000000
-        self.budget_manager.add_to_expense_budget(
-            agent.output_expense_cost*n_tokens)
+    async def ask_agent_async(self, agent_name: str, prompt: str,
+                              conversation_id: Optional[str] = None,
+                              reset_conversation: bool = False) -> Tuple[str, int]:
+        agent: Agent = self._get_invocable_agent(agent_name,
+                                                 conversation_id,
+                                                 reset_conversation)
+        response = self._get_cached_response(agent, prompt, conversation_id)
+        if response is not None:
+            return (response,
+                    self.budget_manager.get_current_remaining_resource_budget(),
+                    self.budget_manager.get_current_remaining_expense_budget())
+        input_expense = self._get_input_expense(agent, prompt)
+
+        self.validate_budget(agent.invoke_resource_cost,
+                             input_expense)
+
+        response = await self._invoke_and_cache_async(agent, prompt, conversation_id)
         return (response,
                 self.budget_manager.get_current_remaining_resource_budget(),
                 self.budget_manager.get_current_remaining_expense_budget())
 
-    def _save_agent(self,
-                    agent_name: str,
-                    base_model: str,
-                    system_prompt: str,
-                    description: str = "",
-                    create_resource_cost: float = 0,
-                    invoke_resource_cost: float = 0,
-                    create_expense_cost: float = 0,
-                    invoke_expense_cost: float = 0,
-                    output_expense_cost: float = 0,
-                    **additional_params) -> None:
-        """Save a single agent to the models.json file"""
-        try:
-            # Ensure the directory exists
-            os.makedirs(MODEL_PATH, exist_ok=True)
+    def _stream_agent(self, agent: Agent, prompt: str,
+                      conversation_id: Optional[str] = None):
+        response = ""
+        with get_scheduler("agent").slot(), self._invocation(agent, prompt) as usage:
+            stream = agent.stream_agent(prompt, conversation_id)
+            try:
+                for chunk in stream:
+                    chunk_expense = agent.output_expense_cost * \
+                        len(chunk.split())/1000000
+                    try:
+                        self.budget_manager.extend_reservation(usage["expense"], chunk_expense)
+                    except BudgetExceeded:
+                        usage["status"] = "truncated"
+                        yield response, True
+                        return
+                    response += chunk
+                    usage["response"] = response
+                    yield response, False
+                usage["status"] = "success"
+            finally:
+                stream.close()
+
+    def stream_ask_agent(self, agent_name: str, prompt: str,
+                         conversation_id: Optional[str] = None,
+                         reset_conversation: bool = False):
+        """
+        Stream an agent's answer, yielding (response_so_far, truncated). Output
+        is charged chunk by chunk and generation is cancelled as soon as the
+        expense budget cannot pay for the next chunk. If the stream fails
+        before its first chunk, the answer is streamed from a backup instead.
+        Cached answers are yielded whole, and complete answers are cached.
+        """
+        agent: Agent = self._get_invocable_agent(agent_name,
+                                                 conversation_id,
+                                                 reset_conversation)
+        response = self._get_cached_response(agent, prompt, conversation_id)
+        if response is not None:
+            yield response, False
+            return
+        context = agent.get_context_key(conversation_id)
+        input_expense = self._get_input_expense(agent, prompt)
 
-            # Read existing models file or create empty dict if it doesn't exist
+        self.validate_budget(agent.invoke_resource_cost,
+                             input_expense)
+
+        current = agent
+        backup_models = None
+        started = False
+        while True:
             try:
-                with open(MODEL_FILE_PATH, "r", encoding="utf8") as f:
-                    models = json.loads(f.read())
-            except (FileNotFoundError, json.JSONDecodeError):
-                models = {}
-
-            # Update the models dict with the new agent
-            models[agent_name] = {
-                "base_model": base_model,
-                "description": description,
-                "system_prompt": system_prompt,
-                "create_resource_cost": create_resource_cost,
-                "invoke_resource_cost": invoke_resource_cost,
-                "create_expense_cost": create_expense_cost,
-                "invoke_expense_cost": invoke_expense_cost,
-                "output_expense_cost": output_expense_cost,
-            }
-
-            # Add any additional parameters that were passed
-            for key, value in additional_params.items():
-                models[agent_name][key] = value
-
-            # Write the updated models back to the file
-            with open(MODEL_FILE_PATH, "w", encoding="utf8") as f:
-                f.write(json.dumps(models, indent=4))
+                for response, truncated in self._stream_agent(current, prompt, conversation_id):
+                    started = True
+                    yield response, truncated
+                    if truncated:
+                        return
+                break
+            except Exception:
+                if started:
+                    raise
+                if backup_models is None:
+                    backup_models = self._get_backup_models(agent)
+                current = self._next_backup(agent, backup_models, prompt, hedge=False)
+                if current is None:
+                    raise
+        if started:
+            self.response_cache.put_response(agent.base_model, agent.system_prompt, prompt,
+                                             response, context, agent.temperature)
+
+    def ask_agents(self, agent_prompts: List[Tuple[str, str]]):
+        """
+        Ask several agents concurrently. The combined cost of all the calls is
+        validated up front, then (agent_name, response, error) is yielded as
+        each agent finishes.
+        """
+        agent_names = [agent_name for agent_name, _ in agent_prompts]
+        if len(set(agent_names)) != len(agent_names):
+            raise ValueError("Each agent can only be asked once per batch.")
+
+        agents = [(self._get_invocable_agent(agent_name), prompt)
+                  for agent_name, prompt in agent_prompts]
+        cached = {}
+        for agent, prompt in agents:
+            response = self._get_cached_response(agent, prompt)
+            if response is not None:
+                cached[agent.agent_name] = response
+        agents = [(agent, prompt) for agent, prompt in agents
+                  if agent.agent_name not in cached]
+
+        input_expense = sum(self._get_input_expense(agent, prompt)
+                            for agent, prompt in agents)
+        # The agents run at the same time, so their resource costs add up
+        resource_cost = sum(agent.invoke_resource_cost for agent, _ in agents)
+        self.validate_budget(resource_cost, input_expense)
+        reservation = self.budget_manager.reserve_resource(resource_cost)
+        try:
+            # All calls share the background event loop and its pooled clients
+            futures = {submit_async(self._invoke_and_cache_async(agent, prompt,
+                                                                 reserve_resources=False)): agent.agent_name
+                       for agent, prompt in agents}
+            for agent_name, response in cached.items():
+                yield agent_name, response, None
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, str(e)
+        finally:
+            self.budget_manager.release_reservation(reservation)
+
+    def _make_agent_config(self,
+                           base_model: str,
+                           system_prompt: str,
+                           description: str = "",
+                           create_resource_cost: float = 0,
+                           invoke_resource_cost: float = 0,
+                           create_expense_cost: float = 0,
+                           invoke_expense_cost: float = 0,
+                           output_expense_cost: float = 0,
+                           **additional_params) -> dict:
+        config = {
+            "base_model": base_model,
+            "description": description,
+            "system_prompt": system_prompt,
+            "create_resource_cost": create_resource_cost,
+            "invoke_resource_cost": invoke_resource_cost,
+            "create_expense_cost": create_expense_cost,
+            "invoke_expense_cost": invoke_expense_cost,
+            "output_expense_cost": output_expense_cost,
+        }
 
-        except Exception as e:
-            output_assistant_response(f"Error saving agent {agent_name}: {e}")
+        # Add any additional parameters that were passed
+        for key, value in additional_params.items():
+            config[key] = value
+        return config
 
     def _get_agent_type(self, base_model) -> str:
         if base_model == "llama3.2":
@@ -549,53 +1494,3 @@ class AgentManager():
             return "lambda"
         else:
             return "unknown"
-
-
-    def _load_agents(self) -> None:
-        """Load agent configurations from disk"""
-        try:
-            if not os.path.exists(MODEL_FILE_PATH):
-                return
-
-            with open(MODEL_FILE_PATH, "r", encoding="utf8") as f:
-                models = json.loads(f.read())
-
-            for name, data in models.items():
-                if name in self._agents:
-                    continue
-                base_model = data["base_model"]
-                system_prompt = data["system_prompt"]
-                create_resource_cost = data.get("create_resource_cost", 0)
-                invoke_resource_cost = data.get("invoke_resource_cost", 0)
-                create_expense_cost = data.get("create_expense_cost", 0)
-                invoke_expense_cost = data.get("invoke_expense_cost", 0)
-                output_expense_cost = data.get("output_expense_cost", 0)
-                model_type = self._get_agent_type(base_model)
-                manager_class = self._agent_types.get(model_type)
-
-                if manager_class:
-                    # Create the agent with the appropriate manager class
-                    self._agents[name] = self.create_agent_class(
-                        name,
-                        base_model,
-                        system_prompt,
-                        description=data.get("description", ""),
-                        create_resource_cost=create_resource_cost,
-                        invoke_resource_cost=invoke_resource_cost,
-                        create_expense_cost=create_expense_cost,
-                        invoke_expense_cost=invoke_expense_cost,
-                        output_expense_cost=output_expense_cost,
-                        **data.get("additional_params", {})
-                    )
-                    self._agents[name] = manager_class(
-                        name,
-                        base_model,
-                        system_prompt,
-                        create_resource_cost,
-                        invoke_resource_cost,
-                        create_expense_cost,
-                        invoke_expense_cost,
-                        output_expense_cost
-                    )
-        except Exception as e:
-            output_assistant_response(f"Error loading agents: {e}")
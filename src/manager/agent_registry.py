@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+MODEL_PATH = "./src/models/"
+MODEL_FILE_PATH = "./src/models/models.json"
+REGISTRY_DB_PATH = "./src/models/agents.db"
+
+
+class AgentRegistry():
+    """
+    Stores agent definitions in SQLite (WAL mode) so that creates and deletes
+    are single-row transactions that are safe across threads and processes.
+    Reads go through an in-memory cache that is only refreshed when the
+    registry version, bumped by every write, changes.
+    """
+
+    def __init__(self, db_path: str = REGISTRY_DB_PATH,
+                 legacy_json_path: str = MODEL_FILE_PATH):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._cache: Dict[str, dict] = {}
+        self._cache_version = None
+        self._cache_lock = threading.Lock()
+        self._init_db()
+        self._migrate_json()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS agents ("
+                     "name TEXT PRIMARY KEY, config TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta ("
+                     "key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+
+    def _write(self, statement: str, params: tuple) -> int:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rowcount = conn.execute(statement, params).rowcount
+            if rowcount:
+                conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 "
+                             "WHERE key = 'version'")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rowcount
+
+    def _migrate_json(self):
+        """Imports models.json once, the first time the registry is opened"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migrated = conn.execute(
+                "SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone()
+            if migrated is None:
+                models = {}
+                if os.path.exists(self.legacy_json_path):
+                    try:
+                        with open(self.legacy_json_path, "r", encoding="utf8") as f:
+                            models = json.loads(f.read())
+                    except json.JSONDecodeError:
+                        models = {}
+                conn.executemany("INSERT OR IGNORE INTO agents (name, config) VALUES (?, ?)",
+                                 [(name, json.dumps(data)) for name, data in models.items()])
+                conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', '1')")
+                conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 "
+                             "WHERE key = 'version'")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _refresh(self) -> Dict[str, dict]:
+        conn = self._connect()
+        version = conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        with self._cache_lock:
+            if version != self._cache_version:
+                rows = conn.execute("SELECT name, config FROM agents").fetchall()
+                self._cache = {name: json.loads(config) for name, config in rows}
+                self._cache_version = version
+            return self._cache
+
+    def add(self, agent_name: str, config: dict) -> None:
+        try:
+            self._write("INSERT INTO agents (name, config) VALUES (?, ?)",
+                        (agent_name, json.dumps(config)))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Agent {agent_name} already exists")
+
+    def update(self, agent_name: str, **fields) -> bool:
+        """Sets fields of a stored agent's config, returns False if there is no such agent"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT config FROM agents WHERE name = ?",
+                               (agent_name,)).fetchone()
+            if row is not None:
+                config = json.loads(row[0])
+                config.update(fields)
+                conn.execute("UPDATE agents SET config = ? WHERE name = ?",
+                             (json.dumps(config), agent_name))
+                conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 "
+                             "WHERE key = 'version'")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    def remove(self, agent_name: str) -> bool:
+        return self._write("DELETE FROM agents WHERE name = ?", (agent_name,)) > 0
+
+    def get(self, agent_name: str) -> Optional[dict]:
+        return self._refresh().get(agent_name)
+
+    def contains(self, agent_name: str) -> bool:
+        return agent_name in self._refresh()
+
+    def all(self) -> Dict[str, dict]:
+        return dict(self._refresh())
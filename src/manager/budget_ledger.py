@@ -0,0 +1,232 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+import psutil
+
+BUDGET_DB_ENV = "HASHIRU_BUDGET_DB"
+
+RESOURCE = "resource"
+EXPENSE = "expense"
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class LocalBudgetLedger():
+    """
+    Budget ledger for a single process.
+
+    Every budget kind has a total, a committed amount and an amount held by
+    open reservations. Writers take a lock and swap in a new immutable state,
+    so readers never lock and always see a consistent snapshot.
+    """
+
+    def __init__(self, totals: Dict[str, float]):
+        self._lock = threading.Lock()
+        self._reservations: Dict[str, Tuple[str, float]] = {}
+        # kind -> (total, used, reserved)
+        self._state = {kind: (total, 0, 0) for kind, total in totals.items()}
+
+    def snapshot(self) -> Dict[str, Tuple[float, float, float]]:
+        return self._state
+
+    def set_total(self, kind: str, total: float) -> None:
+        with self._lock:
+            state = dict(self._state)
+            _, used, reserved = state.get(kind, (0, 0, 0))
+            state[kind] = (total, used, reserved)
+            self._state = state
+
+    def _update(self, kind: str, used_delta: float, reserved_delta: float, check: bool):
+        state = dict(self._state)
+        total, used, reserved = state[kind]
+        used += used_delta
+        reserved += reserved_delta
+        if check and used + reserved > total:
+            raise BudgetExceeded(f"No {kind} budget remaining")
+        if used < 0:
+            raise BudgetExceeded(f"Not enough {kind} budget to remove")
+        state[kind] = (total, used, max(reserved, 0))
+        self._state = state
+
+    def reserve(self, kind: str, amount: float, check: bool = True) -> str:
+        with self._lock:
+            self._update(kind, 0, amount, check)
+            reservation = uuid.uuid4().hex
+            self._reservations[reservation] = (kind, amount)
+            return reservation
+
+    def commit(self, reservation: str, actual: float = None) -> None:
+        """Turns a reservation into spending, of `actual` if given instead of the reserved amount"""
+        with self._lock:
+            kind, amount = self._reservations.pop(reservation)
+            self._update(kind, amount if actual is None else actual, -amount, False)
+
+    def extend(self, reservation: str, amount: float, check: bool = True) -> None:
+        """Adds to an open reservation, e.g. for every chunk of a streamed answer"""
+        with self._lock:
+            kind, held = self._reservations[reservation]
+            self._update(kind, 0, amount, check)
+            self._reservations[reservation] = (kind, held + amount)
+
+    def release(self, reservation: str) -> None:
+        with self._lock:
+            reserved = self._reservations.pop(reservation, None)
+            if reserved is not None:
+                kind, amount = reserved
+                self._update(kind, 0, -amount, False)
+
+    def charge(self, kind: str, amount: float, check: bool = True) -> None:
+        with self._lock:
+            self._update(kind, amount, 0, check)
+
+    def refund(self, kind: str, amount: float) -> None:
+        with self._lock:
+            self._update(kind, -amount, 0, False)
+
+
+class SQLiteBudgetLedger():
+    """
+    Budget ledger shared by every process that opens the same SQLite file,
+    e.g. several uvicorn workers. Each operation is one IMMEDIATE transaction,
+    and reads use WAL snapshots, so they do not wait for writers.
+
+    Reservations are tagged with the process that made them. Those of dead
+    processes are dropped when a ledger is opened, and the resource usage is
+    reset when no other process is alive, since only running processes hold
+    resources. Expense is kept across restarts.
+    """
+
+    def __init__(self, db_path: str, totals: Dict[str, float]):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS budgets ("
+                     "kind TEXT PRIMARY KEY, total REAL NOT NULL, used REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS reservations ("
+                     "id TEXT PRIMARY KEY, kind TEXT NOT NULL, amount REAL NOT NULL, "
+                     "pid INTEGER NOT NULL, created REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS processes (pid INTEGER PRIMARY KEY)")
+        with self._transaction() as conn:
+            pids = [row[0] for row in conn.execute("SELECT pid FROM processes")]
+            dead = [pid for pid in pids if pid != os.getpid() and not psutil.pid_exists(pid)]
+            for pid in dead:
+                conn.execute("DELETE FROM processes WHERE pid = ?", (pid,))
+                conn.execute("DELETE FROM reservations WHERE pid = ?", (pid,))
+            if len(dead) == len(pids):
+                conn.execute("UPDATE budgets SET used = 0 WHERE kind = ?", (RESOURCE,))
+            conn.execute("INSERT OR IGNORE INTO processes (pid) VALUES (?)", (os.getpid(),))
+            for kind, total in totals.items():
+                conn.execute("INSERT INTO budgets (kind, total, used) VALUES (?, ?, 0) "
+                             "ON CONFLICT(kind) DO UPDATE SET total = excluded.total",
+                             (kind, total))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _state(self, conn, kind: str) -> Tuple[float, float, float]:
+        total, used = conn.execute(
+            "SELECT total, used FROM budgets WHERE kind = ?", (kind,)).fetchone()
+        reserved = conn.execute(
+            "SELECT COALESCE(SUM(amount), 0) FROM reservations WHERE kind = ?",
+            (kind,)).fetchone()[0]
+        return total, used, reserved
+
+    def snapshot(self) -> Dict[str, Tuple[float, float, float]]:
+        conn = self._connect()
+        # One read transaction, so totals, spending and reservations come from the same state
+        conn.execute("BEGIN")
+        try:
+            kinds = [row[0] for row in conn.execute("SELECT kind FROM budgets")]
+            return {kind: self._state(conn, kind) for kind in kinds}
+        finally:
+            conn.execute("COMMIT")
+
+    def set_total(self, kind: str, total: float) -> None:
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO budgets (kind, total, used) VALUES (?, ?, 0) "
+                         "ON CONFLICT(kind) DO UPDATE SET total = excluded.total",
+                         (kind, total))
+
+    def reserve(self, kind: str, amount: float, check: bool = True) -> str:
+        with self._transaction() as conn:
+            total, used, reserved = self._state(conn, kind)
+            if check and used + reserved + amount > total:
+                raise BudgetExceeded(f"No {kind} budget remaining")
+            reservation = uuid.uuid4().hex
+            conn.execute("INSERT INTO reservations (id, kind, amount, pid, created) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (reservation, kind, amount, os.getpid(), time.time()))
+            return reservation
+
+    def commit(self, reservation: str, actual: float = None) -> None:
+        with self._transaction() as conn:
+            kind, amount = conn.execute(
+                "SELECT kind, amount FROM reservations WHERE id = ?",
+                (reservation,)).fetchone()
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation,))
+            conn.execute("UPDATE budgets SET used = used + ? WHERE kind = ?",
+                         (amount if actual is None else actual, kind))
+
+    def extend(self, reservation: str, amount: float, check: bool = True) -> None:
+        with self._transaction() as conn:
+            kind = conn.execute("SELECT kind FROM reservations WHERE id = ?",
+                                (reservation,)).fetchone()[0]
+            total, used, reserved = self._state(conn, kind)
+            if check and used + reserved + amount > total:
+                raise BudgetExceeded(f"No {kind} budget remaining")
+            conn.execute("UPDATE reservations SET amount = amount + ? WHERE id = ?",
+                         (amount, reservation))
+
+    def release(self, reservation: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation,))
+
+    def charge(self, kind: str, amount: float, check: bool = True) -> None:
+        with self._transaction() as conn:
+            total, used, reserved = self._state(conn, kind)
+            if check and used + reserved + amount > total:
+                raise BudgetExceeded(f"No {kind} budget remaining")
+            conn.execute("UPDATE budgets SET used = used + ? WHERE kind = ?",
+                         (amount, kind))
+
+    def refund(self, kind: str, amount: float) -> None:
+        with self._transaction() as conn:
+            _, used, _ = self._state(conn, kind)
+            if used - amount < 0:
+                raise BudgetExceeded(f"Not enough {kind} budget to remove")
+            conn.execute("UPDATE budgets SET used = used - ? WHERE kind = ?",
+                         (amount, kind))
+
+
+def create_budget_ledger(totals: Dict[str, float]):
+    """Uses the shared SQLite ledger when HASHIRU_BUDGET_DB points at a database file"""
+    db_path = os.getenv(BUDGET_DB_ENV)
+    if db_path:
+        return SQLiteBudgetLedger(db_path, totals)
+    return LocalBudgetLedger(totals)
@@ -1,13 +1,12 @@
 from src.manager.utils.singleton import singleton
+from src.manager.budget_ledger import RESOURCE, EXPENSE, create_budget_ledger
 import torch
 import psutil
 
 @singleton
 class BudgetManager():
     total_resource_budget = 100
-    current_resource_usage = 0
     total_expense_budget = 10000
-    current_expense = 0
     is_budget_initialized = False
     is_resource_budget_enabled = True
     is_expense_budget_enabled = True
@@ -15,6 +14,11 @@ class BudgetManager():
     def __init__(self):
         if not self.is_budget_initialized:
             self.total_resource_budget = self.calculate_total_budget()
+            # Spending goes through the ledger so concurrent calls cannot overshoot the limits
+            self.ledger = create_budget_ledger({
+                RESOURCE: self.total_resource_budget,
+                EXPENSE: self.total_expense_budget,
+            })
             self.is_budget_initialized = True
     
     def set_resource_budget_status(self, status: bool):
@@ -49,51 +53,76 @@ class BudgetManager():
         total_mem = gpu_mem + ram_mem
         return round((total_mem / 16) * 100)
 
+    def get_total_memory_gb(self) -> float:
+        """Memory behind the resource budget, which counts 100 units per 16 GB"""
+        return self.total_resource_budget * 16 / 100
+
     def get_total_resource_budget(self):
         return self.total_resource_budget
     
     def get_current_resource_usage(self):
-        return self.current_resource_usage
+        _, used, reserved = self.ledger.snapshot()[RESOURCE]
+        return used + reserved
     
     def get_current_remaining_resource_budget(self):
-        return self.total_resource_budget - self.current_resource_usage
+        return self.total_resource_budget - self.get_current_resource_usage()
     
     def can_spend_resource(self, cost):
         if not self.is_resource_budget_enabled:
             return True
-        return True if self.current_resource_usage + cost <= self.total_resource_budget else False
+        return True if self.get_current_resource_usage() + cost <= self.total_resource_budget else False
         
     def add_to_resource_budget(self, cost):
         if not self.is_resource_budget_enabled:
             return
-        if not self.can_spend_resource(cost):
-            raise Exception("No resource budget remaining")
-        self.current_resource_usage += cost
+        self.ledger.charge(RESOURCE, cost)
     
     def remove_from_resource_expense(self, cost):
         if not self.is_resource_budget_enabled:
             return
-        if self.current_resource_usage - cost < 0:
-            raise Exception("Not enough resource budget to remove")
-        self.current_resource_usage -= cost
+        self.ledger.refund(RESOURCE, cost)
     
     def get_total_expense_budget(self):
         return self.total_expense_budget
     
     def get_current_expense(self):
-        return self.current_expense
+        _, used, reserved = self.ledger.snapshot()[EXPENSE]
+        return used + reserved
     
     def get_current_remaining_expense_budget(self):
-        return self.total_expense_budget - self.current_expense
+        return self.total_expense_budget - self.get_current_expense()
     
     def can_spend_expense(self, cost):
         if not self.is_expense_budget_enabled:
             return True
-        return True if self.current_expense + cost <= self.total_expense_budget else False
+        return True if self.get_current_expense() + cost <= self.total_expense_budget else False
     
     def add_to_expense_budget(self, cost):
         if not self.is_expense_budget_enabled:
             return
-        if not self.can_spend_expense(cost):
-            raise Exception("No expense budget remaining")
-        self.current_expense += cost
\ No newline at end of file
+        self.ledger.charge(EXPENSE, cost)
+
+    def reserve_resource(self, cost):
+        """Holds resource budget until the reservation is released or committed"""
+        if not self.is_resource_budget_enabled:
+            return None
+        return self.ledger.reserve(RESOURCE, cost)
+
+    def reserve_expense(self, cost):
+        """Holds expense budget until the actual cost is known"""
+        if not self.is_expense_budget_enabled:
+            return None
+        return self.ledger.reserve(EXPENSE, cost)
+
+    def commit_reservation(self, reservation, actual_cost=None):
+        if reservation is not None:
+            self.ledger.commit(reservation, actual_cost)
+
+    def extend_reservation(self, reservation, cost):
+        """Holds more expense on a reservation, raises BudgetExceeded if the budget cannot cover it"""
+        if reservation is not None:
+            self.ledger.extend(reservation, cost)
+
+    def release_reservation(self, reservation):
+        if reservation is not None:
+            self.ledger.release(reservation)
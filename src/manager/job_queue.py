@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Iterator, List, Optional
+
+from src.manager.utils.fair_scheduler import BATCH, PRIORITIES
+from src.manager.utils.request_context import bind_request_context
+from src.manager.utils.singleton import singleton
+from src.manager.utils.tracing import pop_trace
+
+JOB_DB_PATH = os.getenv("HASHIRU_JOB_DB", "./src/models/jobs.db")
+JOB_WORKERS = int(os.getenv("HASHIRU_JOB_WORKERS", "2"))
+# Finished jobs are kept this long for clients to collect their results
+JOB_RETENTION_SECONDS = float(os.getenv("HASHIRU_JOB_RETENTION_DAYS", "7")) * 86400
+# Partial output is saved at most this often while a job runs
+OUTPUT_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 10.0
+# A running job whose process stopped sending heartbeats for this long is requeued
+STALE_SECONDS = 120.0
+MAX_ATTEMPTS = 3
+
+TERMINAL_STATUSES = ("done", "error", "cancelled")
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@singleton
+class JobQueue():
+    """
+    Persistent queue of chat turns, answered by a pool of worker threads
+    independently of the HTTP connection that submitted them. Jobs, their
+    partial output and their results live in SQLite, so several server
+    processes can share one queue and a restarted server picks up the jobs
+    a crashed one left behind.
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                     "id TEXT PRIMARY KEY, user_id TEXT, session_id TEXT, priority TEXT, "
+                     "status TEXT NOT NULL, messages TEXT NOT NULL, output TEXT, "
+                     "error TEXT, trace TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                     "cancel_requested INTEGER NOT NULL DEFAULT 0, owner TEXT, "
+                     "created REAL NOT NULL, started REAL, finished REAL, "
+                     "updated REAL NOT NULL, heartbeat REAL)")
+        # Queued jobs are claimed by priority class, then oldest first
+        conn.execute("DROP INDEX IF EXISTS jobs_status")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, messages: list, user_id: str = "anonymous", priority: str = "batch") -> str:
+        """
+        Queues a chat history to be answered and returns the job id. The
+        priority class applies to the job's manager rounds and agent calls.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        if priority not in PRIORITIES:
+            priority = BATCH
+        self._connect().execute(
+            "INSERT INTO jobs (id, user_id, session_id, priority, status, messages, created, updated) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, user_id, f"job-{job_id}", priority, json.dumps(messages), now, now))
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["messages"] = json.loads(job["messages"])
+        job["output"] = json.loads(job["output"]) if job["output"] else None
+        job["trace"] = json.loads(job["trace"]) if job["trace"] else []
+        if job["status"] == "queued":
+            # Jobs of a higher priority class go first, whenever they were submitted
+            priority = job["priority"] if job["priority"] in PRIORITIES else BATCH
+            ahead = PRIORITIES[:PRIORITIES.index(priority)]
+            placeholders = ", ".join("?" for _ in ahead) or "NULL"
+            job["position"] = self._connect().execute(
+                f"SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                f"(priority IN ({placeholders}) OR (priority = ? AND created < ?))",
+                (*ahead, priority, job["created"])).fetchone()[0]
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a queued job, or asks the worker running it to stop"""
+        now = time.time()
+        conn = self._connect()
+        if conn.execute("UPDATE jobs SET status = 'cancelled', finished = ?, updated = ? "
+                        "WHERE id = ? AND status = 'queued'", (now, now, job_id)).rowcount:
+            return True
+        return conn.execute("UPDATE jobs SET cancel_requested = 1, updated = ? "
+                            "WHERE id = ? AND status = 'running'", (now, job_id)).rowcount > 0
+
+    def watch(self, job_id: str, poll_interval: float = 0.5) -> Iterator[dict]:
+        """Yields the job every time it changes, until it has finished"""
+        updated = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job["updated"] != updated:
+                updated = job["updated"]
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            time.sleep(poll_interval)
+
+    def _claim(self) -> Optional[dict]:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs of a process that died mid-answer run again, up to MAX_ATTEMPTS times
+            conn.execute("UPDATE jobs SET status = 'error', error = 'Worker stopped too often', "
+                         "finished = ?, updated = ? WHERE status = 'running' AND heartbeat < ? "
+                         "AND attempts >= ?", (now, now, now - STALE_SECONDS, MAX_ATTEMPTS))
+            conn.execute("UPDATE jobs SET status = 'queued', owner = NULL, updated = ? "
+                         "WHERE status = 'running' AND heartbeat < ?", (now, now - STALE_SECONDS))
+            row = None
+            for priority in PRIORITIES:
+                row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' AND priority = ? "
+                                   "ORDER BY created LIMIT 1", (priority,)).fetchone()
+                if row is not None:
+                    break
+            else:
+                # Jobs stored without a known class go last
+                row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' "
+                                   "ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', owner = ?, started = ?, "
+                             "heartbeat = ?, updated = ?, attempts = attempts + 1 WHERE id = ?",
+                             (self.owner, now, now, now, row["id"]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(row) if row is not None else None
+
+    def _save_output(self, job_id: str, messages: list) -> None:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("UPDATE jobs SET output = ?, heartbeat = ?, updated = ? "
+                     "WHERE id = ? AND owner = ?", (json.dumps(messages), now, now, job_id, self.owner))
+        if conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?",
+                        (job_id,)).fetchone()[0]:
+            raise JobCancelled()
+
+    def _finish(self, job: dict, status: str, output: Optional[list], error: Optional[str] = None) -> None:
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, output = ?, error = ?, trace = ?, finished = ?, "
+            "updated = ? WHERE id = ? AND owner = ?",
+            (status, json.dumps(output) if output is not None else None, error,
+             json.dumps(pop_trace(job["session_id"])), now, now, job["id"], self.owner))
+
+    def _run_job(self, job: dict, handler: Callable) -> None:
+        messages = json.loads(job["messages"])
+        output = None
+        saved = 0.0
+        try:
+            for output in bind_request_context(handler(messages, job["session_id"]),
+                                               job["user_id"], job["session_id"],
+                                               job["priority"] or "batch"):
+                if time.monotonic() - saved >= OUTPUT_INTERVAL:
+                    self._save_output(job["id"], output)
+                    saved = time.monotonic()
+            self._finish(job, "done", output)
+        except JobCancelled:
+            self._finish(job, "cancelled", output)
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job["id"], e)
+            self._finish(job, "error", output, str(e))
+
+    def _work(self, handler: Callable) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.OperationalError as e:
+                logger.warning("Could not claim a job: %s", e)
+                job = None
+            if job is None:
+                # Woken at once by submits from this process, polls for the others
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            try:
+                self._run_job(job, handler)
+            except Exception:
+                # e.g. the database was locked while storing the result
+                logger.exception("Could not finish job %s", job["id"])
+                self._give_up(job)
+
+    def _give_up(self, job: dict) -> None:
+        """Hands a job this worker could not finish back to the queue, so the heartbeat does not keep it running"""
+        now = time.time()
+        try:
+            self._connect().execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'error' ELSE 'queued' END, "
+                "error = CASE WHEN attempts >= ? THEN 'Worker failed too often' ELSE error END, "
+                "owner = NULL, updated = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (MAX_ATTEMPTS, MAX_ATTEMPTS, now, job["id"], self.owner))
+        except sqlite3.OperationalError as e:
+            logger.warning("Could not release job %s: %s", job["id"], e)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self._connect().execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? "
+                                        "AND status = 'running'", (time.time(), self.owner))
+            except sqlite3.OperationalError as e:
+                logger.warning("Could not update the job heartbeat: %s", e)
+
+    def get_counts(self) -> dict:
+        """Queued and running jobs per priority class"""
+        rows = self._connect().execute(
+            "SELECT status, priority, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') "
+            "GROUP BY status, priority").fetchall()
+        counts = {"queued": {}, "running": {}}
+        for status, priority, count in rows:
+            counts[status][priority or "batch"] = count
+        return counts
+
+    def purge(self, older_than: float = JOB_RETENTION_SECONDS) -> int:
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        return self._connect().execute(
+            f"DELETE FROM jobs WHERE status IN ({placeholders}) AND finished < ?",
+            (*TERMINAL_STATUSES, time.time() - older_than)).rowcount
+
+    def start_workers(self, handler: Callable, count: int = JOB_WORKERS) -> None:
+        """
+        Starts `count` worker threads answering jobs with handler(messages,
+        session_id), a generator of the growing chat history like
+        GeminiManager.run.
+        """
+        if self._threads or count <= 0:
+            return
+        self.purge()
+        self._threads = [threading.Thread(target=self._work, args=(handler,),
+                                          name=f"job-worker-{i}", daemon=True)
+                         for i in range(count)]
+        self._threads.append(threading.Thread(target=self._heartbeat,
+                                              name="job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop_workers(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
@@ -7,6 +7,7 @@ from google.genai import types
 from mistralai import Mistral
 from groq import Groq
 from src.manager.utils.streamlit_interface import output_assistant_response
+from src.manager.ollama_residency import OllamaResidencyManager
 
 
 class AbstractModelManager(ABC):
@@ -33,8 +34,8 @@ class AbstractModelManager(ABC):
 
 class OllamaModelManager(AbstractModelManager):
     def is_model_loaded(self, model):
-        loaded_models = [m.model for m in ollama.list().models]
-        return model in loaded_models or f'{model}:latest' in loaded_models
+        # Cached listing instead of asking Ollama for every check
+        return OllamaResidencyManager().model_exists(model)
 
     def create_model(self, base_model, context_window=4096, temperature=0):
         with open(self.system_prompt_file, 'r') as f:
@@ -51,6 +52,7 @@ class OllamaModelManager(AbstractModelManager):
                     "temperature": temperature
                 }
             )
+            OllamaResidencyManager().invalidate(self.model_name)
 
     def request(self, prompt):
         response = ollama.chat(
@@ -1,6 +1,5 @@
 from enum import Enum, auto
 from typing import List
-from google import genai
 from google.genai import types
 from google.genai.types import *
 import os
@@ -10,23 +9,37 @@ from src.manager.agent_manager import AgentManager
 from src.manager.budget_manager import BudgetManager
 from src.manager.tool_manager import ToolManager
 from src.manager.utils.suppress_outputs import suppress_output
+from src.manager.utils.turn_scheduler import TurnScheduler, FORCE_FINAL_ANSWER_PROMPT
+from src.manager.utils.provider_clients import get_gemini_client
+from src.manager.utils.rate_limiter import call_with_rate_limit, stream_with_rate_limit
+from src.manager.usage_ledger import UsageLedger
+from src.manager.response_cache import ResponseCache
+from src.manager.utils.tracing import span, set_span_attributes, add_to_span
+from src.manager.utils.metrics import track_session
+from src.manager.utils.shared_state import get_state_store
+from src.manager.utils.fair_scheduler import get_scheduler
+from src.manager.utils.volatile import mask_volatile
 import logging
 import gradio as gr
 from sentence_transformers import SentenceTransformer
 import torch
 from src.tools.default_tools.memory_manager import MemoryManager
 from pathlib import Path
-from google.genai.errors import APIError
-import backoff
 import mimetypes
 import json
+import time
+import threading
 import traceback
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 handler = logging.StreamHandler(sys.stdout)
 # handler.setLevel(logging.DEBUG)
 logger.addHandler(handler)
 
+# Sessions whose round counts are kept, the least recently active are forgotten first
+MAX_TRACKED_SESSIONS = 1000
+
 
 class Mode(Enum):
     ENABLE_AGENT_CREATION = auto()
@@ -46,23 +59,37 @@ def format_tool_response(response, indent=2):
 class GeminiManager:
     def __init__(self, system_prompt_file="./src/models/acadHASHIRU-system.prompt",
                  gemini_model="gemini-2.5-pro-exp-03-25",
-                 modes: List[Mode] = []):
+                 modes: List[Mode] = [],
+                 max_rounds: int = 40,
+                 max_turn_seconds: float = 1800,
+                 max_turn_tokens: int = 3000000):
         self.input_tokens = 0
         self.output_tokens = 0
+        self.max_rounds = max_rounds
+        self.max_turn_seconds = max_turn_seconds
+        self.max_turn_tokens = max_turn_tokens
+        # Rounds of the latest turn of every session, for the most recent sessions
+        self.session_rounds = OrderedDict()
+        self._session_rounds_lock = threading.Lock()
         load_dotenv()
         self.budget_manager = BudgetManager()
+        self.usage_ledger = UsageLedger()
+        self.response_cache = ResponseCache()
+        self.temperature = self.response_cache.get_temperature(0.2)
 
         self.toolsLoader: ToolManager = ToolManager()
 
         self.agentManager: AgentManager = AgentManager()
 
         self.API_KEY = os.getenv("GEMINI_KEY")
-        self.client = genai.Client(api_key=self.API_KEY)
+        self.client = get_gemini_client(self.API_KEY)
         self.model_name = gemini_model
         self.memory_manager = MemoryManager()
         with open(system_prompt_file, 'r', encoding="utf8") as f:
             self.system_prompt = f.read()
         self.messages = []
+        # With several workers (start.py --workers) the modes chosen in one apply to all
+        self.share_modes = int(os.getenv("HASHIRU_WORKERS", "1")) > 1
         self.set_modes(modes)
         self.safety_settings = [
             {
@@ -87,6 +114,19 @@ class GeminiManager:
         return [mode.name for mode in self.modes]
 
     def set_modes(self, modes: List[Mode]):
+        self._apply_modes(modes)
+        if self.share_modes:
+            get_state_store().set("modes", [mode.name for mode in modes])
+
+    def sync_modes(self):
+        """Picks up modes another worker set"""
+        if not self.share_modes:
+            return
+        names = get_state_store().get("modes")
+        if names is not None and names != self.get_current_modes():
+            self._apply_modes([Mode[name] for name in names])
+
+    def _apply_modes(self, modes: List[Mode]):
         self.modes = modes
         self.budget_manager.set_resource_budget_status(
             self.check_mode(Mode.ENABLE_RESOURCE_BUDGET))
@@ -106,32 +146,38 @@ class GeminiManager:
     def check_mode(self, mode: Mode):
         return mode in self.modes
 
-    @backoff.on_exception(backoff.expo,
-                          APIError,
-                          max_tries=3,
-                          jitter=None)
-    def generate_response(self, messages):
-        tools = self.toolsLoader.getTools()
-        response = self.client.models.count_tokens(
+    def count_input_tokens(self, messages):
+        response = call_with_rate_limit("gemini", self.model_name, lambda: self.client.models.count_tokens(
             model=self.model_name,
             contents=messages,
-        )
+        ))
         self.budget_manager.add_to_expense_budget(
             response.total_tokens * 0.10/1000000  # Assuming $0.10 per million tokens
         )
         self.input_tokens += response.total_tokens
-        return self.client.models.generate_content_stream(
+        return response.total_tokens
+
+    def generate_response(self, messages, allow_tools=True):
+        tools = self.toolsLoader.getTools()
+        # Throttled requests are retried by the limiter shared with the agents
+        return stream_with_rate_limit("gemini", self.model_name, lambda: self.client.models.generate_content_stream(
             model=self.model_name,
             contents=messages,
             config=types.GenerateContentConfig(
                 system_instruction=self.system_prompt,
-                temperature=0.2,
+                temperature=self.temperature,
                 tools=tools,
+                tool_config=None if allow_tools else types.ToolConfig(
+                    function_calling_config=types.FunctionCallingConfig(mode="NONE")),
                 safety_settings=self.safety_settings,
             ),
-        )
+        ))
 
     def handle_tool_calls(self, function_calls):
+        with span("manager.tool_calls", calls=len(function_calls)):
+            yield from self._handle_tool_calls(function_calls)
+
+    def _handle_tool_calls(self, function_calls):
         parts = []
         i = 0
         for function_call in function_calls:
@@ -152,8 +198,18 @@ class GeminiManager:
             }
             try:
                 self.input_tokens += len(repr(function_call).split())
-                toolResponse = self.toolsLoader.runTool(
-                    function_call.name, function_call.args)
+                for toolResponse in self.toolsLoader.streamTool(
+                        function_call.name, function_call.args):
+                    if toolResponse.get("status") == "streaming":
+                        yield {
+                            "role": "assistant",
+                            "content": f"{toolResponse.get('output') or ''}",
+                            "metadata": {
+                                "title": title,
+                                "id": i,
+                                "status": "pending",
+                            }
+                        }
             except Exception as e:
                 logger.warning(f"Error running tool: {e}")
                 toolResponse = {
@@ -259,7 +315,7 @@ class GeminiManager:
                         role = "model"
                         content = message.get("content", "")
                         if content.strip() == "":
-                            print("Empty message received: ", message)
+                            logger.debug(f"Empty message received: {message}")
                             continue
                         parts = [types.Part.from_text(
                             text=content)]
@@ -298,7 +354,19 @@ class GeminiManager:
                 results.append(raw_memories[idx.item()])
         return results
 
-    def run(self, messages):
+    def get_session_rounds(self, session_id="default"):
+        with self._session_rounds_lock:
+            return self.session_rounds.get(session_id, 0)
+
+    def _set_session_rounds(self, session_id, rounds):
+        with self._session_rounds_lock:
+            self.session_rounds[session_id] = rounds
+            self.session_rounds.move_to_end(session_id)
+            while len(self.session_rounds) > MAX_TRACKED_SESSIONS:
+                self.session_rounds.popitem(last=False)
+
+    def run(self, messages, session_id="default"):
+        self.sync_modes()
         try:
             if self.check_mode(Mode.ENABLE_MEMORY) and len(messages) > 0:
                 memories = self.get_k_memories(
@@ -316,19 +384,103 @@ class GeminiManager:
                     yield messages
         except Exception as e:
             pass
-        yield from self.invoke_manager(messages)
-        print("Tokens used: Input: {}, Output: {}".format(
-            self.input_tokens, self.output_tokens))
+        yield from self.invoke_manager(messages, session_id)
+
+    def invoke_manager(self, messages, session_id="default"):
+        with span("manager.turn", model=self.model_name), track_session(session_id):
+            return (yield from self._invoke_manager(messages, session_id))
+
+    def _invoke_manager(self, messages, session_id="default"):
+        turn = TurnScheduler(max_rounds=self.max_rounds,
+                             max_seconds=self.max_turn_seconds,
+                             max_tokens=self.max_turn_tokens)
+        while True:
+            limit_reason = turn.exhausted_reason()
+            if limit_reason is not None:
+                logger.warning(
+                    f"Session {session_id} hit the turn limit: {limit_reason}")
+                messages.append({
+                    "role": "assistant",
+                    "content": f"Turn limit reached: {limit_reason}. Forcing a final answer.",
+                    "metadata": {"title": "Turn limit reached", "status": "done"}
+                })
+                yield messages
+            turn.start_round()
+            self._set_session_rounds(session_id, turn.rounds)
+            messages, function_calls = yield from self.invoke_manager_round(
+                messages, limit_reason, turn)
+            if function_calls is None:
+                return messages
 
-    def invoke_manager(self, messages):
+            # A forced final round never runs tools, so the turn always ends here
+            if len(function_calls) == 0 or limit_reason is not None:
+                yield messages
+                return messages
+
+            for call in self.handle_tool_calls(function_calls):
+                yield messages + [call]
+                if (call.get("role") == "tool"
+                        or (call.get("role") == "assistant" and call.get("metadata", {}).get("status") == "done")):
+                    messages.append(call)
+
+    def get_cache_key(self, chat_history, allow_tools=True):
+        """
+        The chat history and the tools on offer, which decide the model's reply.
+        Budget and usage figures in tool outputs change from run to run, so
+        they are masked.
+        """
+        tools = [tool.inputSchema["name"] for tool in self.toolsLoader.toolsImported] \
+            if allow_tools else ["no-tools"]
+        return json.dumps([[mask_volatile(content.model_dump(mode="json", exclude_none=True))
+                            for content in chat_history], sorted(tools)])
+
+    def invoke_manager_round(self, messages, limit_reason=None, turn=None):
+        """
+        Runs one generation round. Returns the updated messages and the function
+        calls requested by the model, or None for the calls if generation failed.
+        The round's tokens are added to the turn's budget.
+        """
+        # Scheduled per round rather than per turn, so a long turn running
+        # tools and agents does not hold a slot the whole time
+        with span("manager.generate", model=self.model_name) as round_span, \
+                get_scheduler("manager").slot():
+            result = yield from self._invoke_manager_round(messages, limit_reason)
+        if turn is not None:
+            turn.add_tokens(round_span.attributes.get("total_tokens", 0))
+        # Summed on the enclosing manager.turn span, for the tokens per turn
+        add_to_span("input_tokens", round_span.attributes.get("input_tokens", 0))
+        add_to_span("output_tokens", round_span.attributes.get("output_tokens", 0))
+        return result
+
+    def _invoke_manager_round(self, messages, limit_reason=None):
         chat_history = self.format_chat_history(messages)
+        if limit_reason is not None:
+            chat_history.append(types.Content(
+                role="user",
+                parts=[types.Part.from_text(
+                    text=FORCE_FINAL_ANSWER_PROMPT.format(reason=limit_reason))]
+            ))
         logger.debug(f"Chat history: {chat_history}")
+        started = time.monotonic()
+        input_tokens = 0
         try:
-            response_stream = self.generate_response(chat_history)
+            cache_key = self.get_cache_key(chat_history, allow_tools=limit_reason is None)
+            response_stream = self.response_cache.get_stream(
+                self.model_name, self.system_prompt, cache_key, self.temperature,
+                parse=types.GenerateContentResponse.model_validate)
+            cached = response_stream is not None
+            if not cached:
+                input_tokens = self.count_input_tokens(chat_history)
+                response_stream = self.response_cache.record_stream(
+                    self.model_name, self.system_prompt, cache_key, self.temperature,
+                    self.generate_response(chat_history, allow_tools=limit_reason is None),
+                    serialize=lambda chunk: chunk.model_dump(mode="json", exclude_none=True))
             full_text = ""  # Accumulate the text from the stream
             function_calls = []
             function_call_requests = []
+            usage_metadata = None
             for chunk in response_stream:
+                usage_metadata = chunk.usage_metadata or usage_metadata
                 if chunk.text:
                     full_text += chunk.text
                     if full_text.strip() != "":
@@ -337,8 +489,9 @@ class GeminiManager:
                             "content": full_text
                         }]
                     else:
-                        print("Empty chunk received")
-                        print(chunk)
+                        logger.debug(f"Empty chunk received: {chunk}")
+                if limit_reason is not None:
+                    continue
                 for candidate in chunk.candidates:
                     if candidate.content and candidate.content.parts:
                         has_function_call = False
@@ -356,17 +509,39 @@ class GeminiManager:
                     "role": "assistant",
                     "content": full_text,
                 })
-                self.output_tokens += len(full_text.split())
-                self.budget_manager.add_to_expense_budget(
-                    len(full_text.split()) * 0.40/1000000  # Assuming $0.40 per million tokens
-                )
+                if not cached:
+                    self.output_tokens += len(full_text.split())
+                    self.budget_manager.add_to_expense_budget(
+                        len(full_text.split()) * 0.40/1000000  # Assuming $0.40 per million tokens
+                    )
             if function_call_requests:
                 messages = messages + function_call_requests
+            output_tokens = len(full_text.split())
+            cost = 0 if cached else (input_tokens * 0.10 + output_tokens * 0.40)/1000000
+            self.usage_ledger.record(model=self.model_name,
+                                     input_tokens=input_tokens,
+                                     output_tokens=output_tokens,
+                                     cost=cost,
+                                     latency=time.monotonic() - started,
+                                     status="cached" if cached else "success")
+            # The tokens of this response alone, counted towards the turn's token limit
+            total_tokens = (getattr(usage_metadata, "prompt_token_count", None) or input_tokens) \
+                + (getattr(usage_metadata, "candidates_token_count", None) or output_tokens)
+            set_span_attributes(input_tokens=input_tokens, output_tokens=output_tokens,
+                                total_tokens=total_tokens, cost=cost, cached=cached,
+                                function_calls=len(function_calls))
             yield messages
         except Exception as e:
+            self.usage_ledger.record(model=self.model_name,
+                                     input_tokens=input_tokens,
+                                     cost=input_tokens * 0.10/1000000,
+                                     latency=time.monotonic() - started,
+                                     status="error")
+            set_span_attributes(status="error", input_tokens=input_tokens,
+                                total_tokens=input_tokens,
+                                cost=input_tokens * 0.10/1000000, error=str(e))
             traceback.print_exc(file=sys.stdout)
-            print(messages)
-            print(chat_history)
+            logger.debug(f"Messages: {messages}\nChat history: {chat_history}")
             messages.append({
                 "role": "assistant",
                 "content": f"Error generating response: {str(e)}",
@@ -378,7 +553,7 @@ class GeminiManager:
             })
             logger.error(f"Error generating response{e}")
             yield messages
-            return messages
+            return messages, None
 
         # Check if any text was received
         if len(full_text.strip()) == 0 and len(function_calls) == 0:
@@ -387,13 +562,4 @@ class GeminiManager:
                 "content": "No response from the model.",
                 "metadata": {"title": "No response from the model."}
             })
-
-        if function_calls and len(function_calls) > 0:
-            for call in self.handle_tool_calls(function_calls):
-                yield messages + [call]
-                if (call.get("role") == "tool"
-                        or (call.get("role") == "assistant" and call.get("metadata", {}).get("status") == "done")):
-                    messages.append(call)
-            yield from self.invoke_manager(messages)
-        else:
-            yield messages
+        return messages, function_calls
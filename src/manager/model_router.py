@@ -0,0 +1,166 @@
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from src.manager.budget_manager import BudgetManager
+from src.manager.usage_ledger import UsageLedger
+from src.manager.utils.singleton import singleton
+
+# Models of similar quality on other providers, in order of preference, used
+# to hedge slow calls and to fail over when a provider errors
+EQUIVALENT_MODELS = {
+    "gemini-2.5-flash-preview-05-20": ["groq-qwen-qwq-32b"],
+    "gemini-2.0-flash": ["groq-qwen-qwq-32b"],
+    "gemini-1.5-flash-8b": ["lambda-hermes3-8b"],
+    "groq-qwen-qwq-32b": ["gemini-2.5-flash-preview-05-20"],
+    "lambda-hermes3-8b": ["gemini-1.5-flash-8b"],
+}
+
+
+class ModelStats():
+    """Exponentially weighted estimates for one base model"""
+
+    def __init__(self, alpha: float, window: int):
+        self.alpha = alpha
+        self.calls = 0
+        self.latency = None
+        self.tokens_per_second = None
+        self.error_rate = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def _ewma(self, current, value):
+        return value if current is None else (1 - self.alpha) * current + self.alpha * value
+
+    def observe(self, latency: float, output_tokens: int, success: bool):
+        self.calls += 1
+        self.error_rate = self._ewma(self.error_rate if self.calls > 1 else None,
+                                     0.0 if success else 1.0)
+        if not success:
+            return
+        self.latency = self._ewma(self.latency, latency)
+        self.latencies.append(latency)
+        if latency > 0 and output_tokens:
+            self.tokens_per_second = self._ewma(self.tokens_per_second,
+                                                output_tokens / latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return self.latency
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "latency_ewma_s": self.latency,
+            "latency_p95_s": self.percentile(0.95),
+            "tokens_per_second": self.tokens_per_second,
+            "error_rate": self.error_rate,
+        }
+
+
+@singleton
+class ModelRouter():
+    """
+    Keeps online latency, throughput and error rate estimates for every base
+    model from real agent calls, and picks the cheapest model that meets a
+    latency target within the remaining budget. Estimates start from the
+    totals in the usage ledger so they survive restarts.
+    """
+    alpha: float = 0.2
+    window: int = 200
+    max_error_rate: float = 0.25
+
+    def __init__(self):
+        self.budget_manager = BudgetManager()
+        self.usage_ledger = UsageLedger()
+        self._stats: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def _get_stats(self, base_model: str) -> ModelStats:
+        stats = self._stats.get(base_model)
+        if stats is None:
+            stats = ModelStats(self.alpha, self.window)
+            # Only calls that reached the model, as observe() only sees those
+            totals = self.usage_ledger.get_model_calls(base_model)
+            if totals["calls"]:
+                stats.calls = totals["calls"]
+                stats.error_rate = totals["errors"] / totals["calls"]
+                if totals["calls"] > totals["errors"]:
+                    stats.latency = totals["latency_avg"]
+                    if totals["latency_total"] > 0:
+                        stats.tokens_per_second = totals["output_tokens"] / totals["latency_total"]
+            self._stats[base_model] = stats
+        return stats
+
+    def observe(self, base_model: str, latency: float,
+                output_tokens: int = 0, success: bool = True) -> None:
+        with self._lock:
+            self._get_stats(base_model).observe(latency, output_tokens, success)
+
+    def get_stats(self, base_model: str) -> dict:
+        with self._lock:
+            return self._get_stats(base_model).as_dict()
+
+    def get_p95_latency(self, base_model: str, min_calls: int = 1) -> Optional[float]:
+        """p95 latency of successful calls, or None with fewer than min_calls measurements"""
+        with self._lock:
+            stats = self._get_stats(base_model)
+            if len(stats.latencies) < min_calls:
+                return None
+            return stats.percentile(0.95)
+
+    def get_equivalent_models(self, base_model: str) -> list:
+        return list(EQUIVALENT_MODELS.get(base_model, []))
+
+    def estimate_cost(self, costs: dict, input_tokens: int, output_tokens: int) -> float:
+        return (costs.get("create_expense_cost", 0)
+                + costs.get("invoke_expense_cost", 0) * input_tokens / 1000000
+                + costs.get("output_expense_cost", 0) * output_tokens / 1000000)
+
+    def recommend(self, model_costs: Dict[str, dict],
+                  latency_slo: Optional[float] = None,
+                  input_tokens: int = 2000,
+                  output_tokens: int = 1000) -> dict:
+        """
+        Returns the cheapest affordable model whose p95 latency meets the SLO.
+        Models without measurements are only chosen when no measured model
+        meets it, and the fastest affordable model is the last resort.
+        """
+        candidates = []
+        for base_model, costs in model_costs.items():
+            stats = self.get_stats(base_model)
+            expense = self.estimate_cost(costs, input_tokens, output_tokens)
+            resource = costs.get("create_resource_cost", 0) + costs.get("invoke_resource_cost", 0)
+            if not self.budget_manager.can_spend_expense(expense) \
+                    or not self.budget_manager.can_spend_resource(resource):
+                continue
+            if stats["calls"] and stats["error_rate"] > self.max_error_rate:
+                continue
+            candidates.append((base_model, expense, stats))
+
+        if not candidates:
+            return {"base_model": None,
+                    "reason": "No model fits in the remaining budget"}
+
+        def meets_slo(stats):
+            return latency_slo is None or (stats["latency_p95_s"] is not None
+                                           and stats["latency_p95_s"] <= latency_slo)
+
+        measured = [c for c in candidates if c[2]["latency_p95_s"] is not None and meets_slo(c[2])]
+        if measured:
+            base_model, expense, _ = min(measured, key=lambda c: c[1])
+            reason = "Cheapest model that meets the latency target"
+        else:
+            unmeasured = [c for c in candidates if c[2]["latency_p95_s"] is None]
+            if unmeasured:
+                base_model, expense, _ = min(unmeasured, key=lambda c: c[1])
+                reason = "No measured model meets the latency target, trying an unmeasured model"
+            else:
+                base_model, expense, _ = min(candidates, key=lambda c: c[2]["latency_p95_s"])
+                reason = "No model meets the latency target, using the fastest affordable model"
+        return {"base_model": base_model,
+                "estimated_expense": expense,
+                "latency_slo_s": latency_slo,
+                "reason": reason}
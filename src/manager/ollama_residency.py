@@ -0,0 +1,237 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+import psutil
+import torch
+
+from src.manager.budget_manager import BudgetManager
+from src.manager.utils.provider_clients import get_ollama_client
+from src.manager.utils.singleton import singleton
+from src.manager.utils.streamlit_interface import output_assistant_response
+
+GB = 1024 ** 3
+
+
+@singleton
+class OllamaResidencyManager():
+    """
+    Decides which local models stay loaded in Ollama.
+
+    Loaded models are tracked least recently used first against a share of the
+    memory that BudgetManager measured. Before a model runs, older unpinned
+    models are unloaded until it fits. On CPU-only machines requests are also
+    batched per model: queued prompts for the loaded model are served before
+    switching to another model, so agents on different base models do not
+    force a reload on every call.
+    """
+    memory_fraction: float = 0.6
+    min_free_gb: float = 1.0
+    default_model_gb: float = 4.0
+    keep_alive: str = "5m"
+    hot_calls: int = 3
+    hot_window: float = 600
+    max_batch: int = 8
+    list_cache_seconds: float = 30
+    ps_cache_seconds: float = 5
+
+    def __init__(self):
+        self.budget_manager = BudgetManager()
+        self.capacity_bytes = self.budget_manager.get_total_memory_gb() * \
+            self.memory_fraction * GB
+        # Without a GPU only one model can run at a time without thrashing
+        self.exclusive = not torch.cuda.is_available()
+        self.max_parallel = int(os.getenv("OLLAMA_NUM_PARALLEL", "1"))
+
+        self._resident = OrderedDict()  # model -> size in bytes, LRU first
+        self._sizes = {}  # last measured size of every model seen loaded
+        self._pinned = set()
+        self._recent_calls = {}  # model -> deque of call times
+        self._resident_checked = 0
+        self._existing_models = set()
+        self._existing_checked = 0
+        self._lock = threading.Lock()
+
+        self._cond = threading.Condition()
+        self._waiting = OrderedDict()  # model -> waiting requests, oldest model first
+        self._active_model = None
+        self._active_count = 0
+        self._batch_served = 0
+
+    # Model existence -------------------------------------------------
+
+    def model_exists(self, model: str) -> bool:
+        with self._lock:
+            if time.monotonic() - self._existing_checked > self.list_cache_seconds:
+                self._existing_models = {
+                    m.model for m in get_ollama_client().list().models}
+                self._existing_checked = time.monotonic()
+            return model in self._existing_models or f"{model}:latest" in self._existing_models
+
+    def invalidate(self, model: str = None):
+        """Called after creating or deleting a model so the cached listings are refreshed"""
+        with self._lock:
+            self._existing_checked = 0
+            self._resident_checked = 0
+            if model is not None:
+                self._resident.pop(self._normalize(model), None)
+                self._pinned.discard(self._normalize(model))
+
+    # Residency -------------------------------------------------------
+
+    def _normalize(self, model: str) -> str:
+        return model if ":" in model else f"{model}:latest"
+
+    def _refresh_resident(self):
+        if time.monotonic() - self._resident_checked < self.ps_cache_seconds:
+            return
+        try:
+            loaded = {m.model: m.size for m in get_ollama_client().ps().models}
+        except Exception as e:
+            # Keep deciding on the last known residency until Ollama answers again
+            output_assistant_response(f"Error listing loaded local models: {e}")
+            return
+        self._sizes.update(loaded)
+        # Keep our LRU order for models that are still loaded
+        resident = OrderedDict((m, loaded[m]) for m in self._resident if m in loaded)
+        for model, size in loaded.items():
+            if model not in resident:
+                resident[model] = size
+                resident.move_to_end(model, last=False)
+        self._resident = resident
+        self._resident_checked = time.monotonic()
+
+    def pin(self, model: str):
+        with self._lock:
+            self._pinned.add(self._normalize(model))
+
+    def unpin(self, model: str):
+        with self._lock:
+            self._pinned.discard(self._normalize(model))
+
+    def is_hot(self, model: str) -> bool:
+        calls = self._recent_calls.get(self._normalize(model))
+        if not calls:
+            return False
+        while calls and time.monotonic() - calls[0] > self.hot_window:
+            calls.popleft()
+        return len(calls) >= self.hot_calls
+
+    def keep_alive_for(self, model: str):
+        """Pinned and frequently used models stay loaded until this manager unloads them"""
+        model = self._normalize(model)
+        if model in self._pinned or self.is_hot(model):
+            return -1
+        return self.keep_alive
+
+    def _under_pressure(self, needed: int) -> bool:
+        if sum(self._resident.values()) + needed > self.capacity_bytes:
+            return True
+        return psutil.virtual_memory().available < self.min_free_gb * GB
+
+    def ensure_resident(self, model: str):
+        model = self._normalize(model)
+        evicted = []
+        with self._lock:
+            self._recent_calls.setdefault(
+                model, deque(maxlen=self.hot_calls * 4)).append(time.monotonic())
+            self._refresh_resident()
+            if model in self._resident:
+                self._resident.move_to_end(model)
+                return
+            needed = self._sizes.get(model, self.default_model_gb * GB)
+            for candidate in list(self._resident):
+                if not self._under_pressure(needed):
+                    break
+                if candidate in self._pinned:
+                    continue
+                evicted.append(candidate)
+                del self._resident[candidate]
+            self._resident[model] = needed
+        for candidate in evicted:
+            output_assistant_response(f"Unloading local model {candidate} to make room for {model}")
+            try:
+                get_ollama_client().generate(model=candidate, keep_alive=0)
+            except Exception as e:
+                output_assistant_response(f"Error unloading model {candidate}: {e}")
+
+    # Per-model batching ----------------------------------------------
+
+    def _others_waiting(self, model: str) -> bool:
+        return any(m != model for m in self._waiting)
+
+    def _can_run(self, model: str) -> bool:
+        if self._active_model is None:
+            return next(iter(self._waiting)) == model
+        if self._active_model != model or self._active_count >= self.max_parallel:
+            return False
+        return self._batch_served < self.max_batch or not self._others_waiting(model)
+
+    def acquire(self, model: str):
+        if self.exclusive:
+            with self._cond:
+                self._waiting[model] = self._waiting.get(model, 0) + 1
+                while not self._can_run(model):
+                    self._cond.wait()
+                self._waiting[model] -= 1
+                if self._waiting[model] == 0:
+                    del self._waiting[model]
+                self._active_model = model
+                self._active_count += 1
+                self._batch_served += 1
+        try:
+            self.ensure_resident(model)
+        except BaseException:
+            self.release(model)
+            raise
+
+    def release(self, model: str):
+        if not self.exclusive:
+            return
+        with self._cond:
+            self._active_count -= 1
+            if self._active_count == 0:
+                batch_done = self._batch_served >= self.max_batch and self._others_waiting(model)
+                if model not in self._waiting or batch_done:
+                    if model in self._waiting:
+                        # Let the other models go first
+                        self._waiting.move_to_end(model)
+                    self._active_model = None
+                    self._batch_served = 0
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, model: str):
+        self.acquire(model)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    @asynccontextmanager
+    async def async_slot(self, model: str):
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.acquire, model))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The thread still takes the slot, give it back once it has
+            acquiring.add_done_callback(
+                lambda task: task.cancelled() or task.exception() or self.release(model))
+            raise
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                "capacity_gb": round(self.capacity_bytes / GB, 2),
+                "resident": {model: round(size / GB, 2) for model, size in self._resident.items()},
+                "pinned": sorted(self._pinned),
+                "queued": dict(self._waiting),
+                "active_model": self._active_model,
+            }
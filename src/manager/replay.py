@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from src.manager.utils.volatile import mask_volatile
+
+# live: call the providers, record: call them and save every call,
+# replay: answer from the saved calls without network or API keys
+PROVIDER_MODE = os.getenv("HASHIRU_PROVIDER_MODE", "live")
+REPLAY_FILE = os.getenv("HASHIRU_REPLAY_FILE", "./tests/fixtures/provider_calls.jsonl")
+# "recorded" replays the measured latencies, a number of seconds replaces them
+REPLAY_LATENCY = os.getenv("HASHIRU_REPLAY_LATENCY", "recorded")
+REPLAY_LATENCY_SCALE = float(os.getenv("HASHIRU_REPLAY_LATENCY_SCALE", "1"))
+
+
+class ReplayMiss(Exception):
+    pass
+
+
+class ReplayedError(Exception):
+    """A recorded provider error. Keeps the status code, so rate limiting reacts as it did live"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _to_jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, dict):
+        return {str(k): _to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+
+def _serialize(value) -> dict:
+    cls = type(value)
+    return {"type": f"{cls.__module__}:{cls.__qualname__}", "data": _to_jsonable(value)}
+
+
+def _deserialize(entry: dict):
+    module, _, name = entry["type"].partition(":")
+    try:
+        cls = importlib.import_module(module)
+        for part in name.split("."):
+            cls = getattr(cls, part)
+    except (ImportError, AttributeError):
+        return entry["data"]
+    if hasattr(cls, "model_validate"):
+        return cls.model_validate(entry["data"])
+    return entry["data"]
+
+
+def call_key(provider: str, method: str, args, kwargs) -> str:
+    # The async clients answer the same requests as the sync ones
+    method = method[len("aio."):] if method.startswith("aio.") else method
+    # Run-specific values such as the remaining budget in tool outputs would never match
+    request = json.dumps([provider, method, mask_volatile(_to_jsonable(args)),
+                          mask_volatile(_to_jsonable(kwargs))], sort_keys=True)
+    return hashlib.sha256(request.encode("utf8")).hexdigest()
+
+
+class ReplayStore():
+    """
+    Provider calls saved as JSONL, one call per line. Identical requests are
+    answered with their recorded responses in order, starting over once
+    they run out.
+    """
+
+    def __init__(self, path: str = REPLAY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._calls: Dict[str, List[dict]] = {}
+        self._next: Dict[str, int] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        call = json.loads(line)
+                        self._calls.setdefault(call["key"], []).append(call)
+
+    def append(self, call: dict) -> None:
+        with self._lock:
+            self._calls.setdefault(call["key"], []).append(call)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(call) + "\n")
+
+    def lookup(self, key: str, method: str) -> dict:
+        with self._lock:
+            calls = self._calls.get(key)
+            if not calls:
+                raise ReplayMiss(f"No recorded provider call matches this {method} request")
+            index = self._next.get(key, 0)
+            self._next[key] = index + 1
+            return calls[index % len(calls)]
+
+
+_store: Optional[ReplayStore] = None
+_store_lock = threading.Lock()
+
+
+def get_replay_store() -> ReplayStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReplayStore()
+        return _store
+
+
+def _delay(recorded: float) -> float:
+    if REPLAY_LATENCY == "recorded":
+        return recorded * REPLAY_LATENCY_SCALE
+    return float(REPLAY_LATENCY)
+
+
+class RecordingProxy():
+    """Passes every call through to the real client and saves it"""
+
+    def __init__(self, target, provider: str, path: str = ""):
+        self._target = target
+        self._provider = provider
+        self._path = path
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if value is None or isinstance(value, (str, int, float, bool, dict, list, tuple)):
+            return value
+        path = f"{self._path}.{name}" if self._path else name
+        return RecordingProxy(value, self._provider, path)
+
+    def _save(self, key, started, **call):
+        get_replay_store().append({"key": key, "provider": self._provider,
+                                   "method": self._path,
+                                   "latency": time.monotonic() - started, **call})
+
+    def _save_error(self, key, started, error):
+        status = getattr(error, "status_code", None) or getattr(error, "code", None)
+        self._save(key, started, error={"message": str(error),
+                                        "status_code": status if isinstance(status, int) else None})
+
+    def _record_stream(self, key, started, stream):
+        chunks, offsets = [], []
+        try:
+            for chunk in stream:
+                offsets.append(time.monotonic() - started)
+                chunks.append(_serialize(chunk))
+                yield chunk
+        except GeneratorExit:
+            # Stopped early by the caller, e.g. when the budget ran out
+            self._save(key, started, stream=chunks, offsets=offsets)
+            raise
+        except Exception as e:
+            self._save_error(key, started, e)
+            raise
+        self._save(key, started, stream=chunks, offsets=offsets)
+
+    async def _record_async(self, key, started, awaitable):
+        try:
+            result = await awaitable
+        except Exception as e:
+            self._save_error(key, started, e)
+            raise
+        self._save(key, started, response=_serialize(result))
+        return result
+
+    def __call__(self, *args, **kwargs):
+        key = call_key(self._provider, self._path, args, kwargs)
+        started = time.monotonic()
+        try:
+            result = self._target(*args, **kwargs)
+        except Exception as e:
+            self._save_error(key, started, e)
+            raise
+        if inspect.isawaitable(result):
+            return self._record_async(key, started, result)
+        if inspect.isgenerator(result) or (hasattr(result, "__next__") and not hasattr(result, "model_dump")):
+            return self._record_stream(key, started, result)
+        self._save(key, started, response=_serialize(result))
+        return result
+
+
+class ReplayClient():
+    """Stands in for a provider client and answers from the recorded calls"""
+
+    def __init__(self, provider: str, is_async: bool = False, path: str = ""):
+        self._provider = provider
+        self._is_async = is_async
+        self._path = path
+
+    def __getattr__(self, name):
+        path = f"{self._path}.{name}" if self._path else name
+        return ReplayClient(self._provider, self._is_async or name == "aio", path)
+
+    def _stream(self, call):
+        started = time.monotonic()
+        for chunk, offset in zip(call["stream"], call["offsets"]):
+            wait = _delay(offset) - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+            yield _deserialize(chunk)
+
+    def _result(self, call):
+        if "error" in call:
+            raise ReplayedError(call["error"]["message"], call["error"]["status_code"])
+        if "stream" in call:
+            return self._stream(call)
+        return _deserialize(call["response"])
+
+    async def _replay_async(self, call):
+        await asyncio.sleep(_delay(call["latency"]))
+        return self._result(call)
+
+    def __call__(self, *args, **kwargs):
+        call = get_replay_store().lookup(call_key(self._provider, self._path, args, kwargs),
+                                         self._path)
+        if self._is_async:
+            return self._replay_async(call)
+        if "stream" not in call:
+            time.sleep(_delay(call["latency"]))
+        return self._result(call)
+
+
+def requires_api_keys() -> bool:
+    """Replay answers every call from the recording, so agents need no provider keys"""
+    return PROVIDER_MODE != "replay"
+
+
+def wrap_client(provider: str, factory, is_async: bool = False):
+    """Creates a provider client for the configured mode; replay never creates the real one"""
+    if PROVIDER_MODE == "replay":
+        return ReplayClient(provider, is_async)
+    if PROVIDER_MODE == "record":
+        return RecordingProxy(factory(), provider)
+    return factory()
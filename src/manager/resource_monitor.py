@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psutil
+import torch
+
+from src.manager.utils.singleton import singleton
+
+MB = 1024 ** 2
+# The resource budget counts 100 units per 16 GB of memory
+MB_PER_RESOURCE_UNIT = 16 * 1024 / 100
+
+
+@singleton
+class ResourceMonitor():
+    """
+    Samples the memory, CPU and VRAM actually used by this process and its
+    children in a background thread, attributes usage to individual tool and
+    agent invocations, and admits new work only when the measured headroom
+    can take it.
+    """
+    interval: float = 1.0
+    history_size: int = 3600
+    safety_margin_mb: float = 512
+    # Weight of the newest call in the expected memory of a tool or agent
+    decay: float = 0.3
+
+    def __init__(self):
+        self.process = psutil.Process(os.getpid())
+        self._children = {}
+        self._samples = deque(maxlen=self.history_size)
+        self._stats = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self.process.cpu_percent(None)
+        self._samples.append(self.sample())
+        threading.Thread(target=self._run, name="hashiru-resource-monitor",
+                         daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                sample = self.sample()
+            except Exception:
+                continue
+            with self._lock:
+                self._samples.append(sample)
+
+    def _children_usage(self, with_cpu: bool = True):
+        rss = 0
+        cpu = 0.0
+        alive = {}
+        for child in self.process.children(recursive=True):
+            try:
+                # Reuse Process objects so cpu_percent measures since the last sample
+                child = self._children.get(child.pid, child)
+                rss += child.memory_info().rss
+                if with_cpu:
+                    cpu += child.cpu_percent(None)
+                alive[child.pid] = child
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        self._children = alive
+        return rss, cpu
+
+    def _vram_mb(self):
+        if not torch.cuda.is_available():
+            return 0.0
+        try:
+            GPUtil = __import__("GPUtil")
+            return float(sum(gpu.memoryUsed for gpu in GPUtil.getGPUs()))
+        except Exception:
+            return torch.cuda.memory_allocated() / MB
+
+    def sample(self, with_cpu: bool = True) -> dict:
+        """
+        Current usage of this process and its children. The CPU share is only
+        measured by the sampling thread, since every reading restarts its interval.
+        """
+        children_rss, children_cpu = self._children_usage(with_cpu)
+        memory = psutil.virtual_memory()
+        return {
+            "time": time.time(),
+            "rss_mb": (self.process.memory_info().rss + children_rss) / MB,
+            "cpu_percent": self.process.cpu_percent(None) + children_cpu if with_cpu else None,
+            "vram_mb": self._vram_mb(),
+            "system_available_mb": memory.available / MB,
+        }
+
+    def latest(self) -> dict:
+        with self._lock:
+            return dict(self._samples[-1])
+
+    def get_time_series(self, seconds: float = None) -> list:
+        with self._lock:
+            samples = list(self._samples)
+        if seconds is not None:
+            samples = [s for s in samples if s["time"] >= time.time() - seconds]
+        return samples
+
+    def get_attribution(self) -> dict:
+        with self._lock:
+            return {f"{kind}:{name}": dict(stats) for (kind, name), stats in self._stats.items()}
+
+    def expected_usage_mb(self, kind: str, name: str, declared_units: float = 0) -> float:
+        """Decaying average of earlier calls, or the declared resource cost before any call"""
+        stats = self._stats.get((kind, name))
+        if stats is not None and stats["calls"] > 0:
+            return stats["expected_memory_mb"]
+        return (declared_units or 0) * MB_PER_RESOURCE_UNIT
+
+    def has_headroom(self, required_mb: float) -> bool:
+        with self._lock:
+            reserved = sum(self._active.values())
+        available = psutil.virtual_memory().available / MB
+        return available - reserved - self.safety_margin_mb >= required_mb
+
+    def admit(self, kind: str, name: str, declared_units: float = 0) -> None:
+        required = self.expected_usage_mb(kind, name, declared_units)
+        if not self.has_headroom(required):
+            raise Exception(f"Not enough free memory to run {kind} {name}: "
+                            f"it is expected to need {required:.0f} MB")
+
+    @contextmanager
+    def track(self, kind: str, name: str, declared_units: float = 0):
+        """Measures one invocation and adds it to the per tool/agent statistics"""
+        key = (kind, name)
+        token = object()
+        expected = self.expected_usage_mb(kind, name, declared_units)
+        start = self.sample(with_cpu=False)
+        with self._lock:
+            self._active[token] = expected
+        try:
+            yield
+        finally:
+            end = self.sample(with_cpu=False)
+            with self._lock:
+                del self._active[token]
+                during = [s for s in self._samples if s["time"] >= start["time"]] + [end]
+                # Only this process and its children, so other programs and
+                # models loaded outside of HASHIRU are not charged to the call
+                peak_memory = max(max(s["rss_mb"] for s in during) - start["rss_mb"], 0)
+                stats = self._stats.setdefault(key, {
+                    "calls": 0,
+                    "total_seconds": 0.0,
+                    "peak_memory_mb": 0.0,
+                    "peak_vram_mb": 0.0,
+                    "last_memory_mb": 0.0,
+                    "expected_memory_mb": peak_memory,
+                })
+                stats["calls"] += 1
+                stats["total_seconds"] += end["time"] - start["time"]
+                stats["last_memory_mb"] = peak_memory
+                stats["expected_memory_mb"] += self.decay * (peak_memory - stats["expected_memory_mb"])
+                stats["peak_memory_mb"] = max(stats["peak_memory_mb"], peak_memory)
+                stats["peak_vram_mb"] = max(stats["peak_vram_mb"],
+                                            max(s["vram_mb"] for s in during) - start["vram_mb"])
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from src.manager.utils.singleton import singleton
+from src.manager.utils.metrics import CACHE_REQUESTS
+
+RESPONSE_CACHE_DB_PATH = os.getenv("HASHIRU_RESPONSE_CACHE_DB", "./src/models/response_cache.db")
+
+
+def _hash(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf8")).hexdigest()
+
+
+@singleton
+class ResponseCache():
+    """
+    Opt-in on-disk cache of agent answers and manager turns, so that reruns
+    of the same prompts are served locally.
+
+    Entries are keyed by a hash of the model, system prompt, conversation
+    context and prompt. Only deterministic (temperature 0) calls are cached,
+    and enabling the cache switches the manager and agents to temperature 0.
+    With the semantic tier enabled, an agent prompt that misses the exact
+    key can still hit an entry for the same model, system prompt and
+    context whose prompt embedding is close enough. The least recently
+    used entries are evicted once the cache grows past its size limit.
+    """
+    is_enabled: bool = os.getenv("HASHIRU_RESPONSE_CACHE", "0") == "1"
+    is_semantic_enabled: bool = os.getenv("HASHIRU_RESPONSE_CACHE_SEMANTIC", "0") == "1"
+    max_bytes: int = int(float(os.getenv("HASHIRU_RESPONSE_CACHE_MB", "256")) * 1024 ** 2)
+    similarity_threshold: float = 0.97
+    embedding_model: str = "all-MiniLM-L6-v2"
+
+    def __init__(self, db_path: str = RESPONSE_CACHE_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._encoder = None
+        self._encoder_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "key TEXT PRIMARY KEY, scope TEXT NOT NULL, value TEXT NOT NULL, "
+                         "embedding BLOB, size INTEGER NOT NULL, "
+                         "last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_scope ON entries (scope)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self._local.conn = conn
+        return conn
+
+    def set_enabled(self, status: bool) -> None:
+        self.is_enabled = status
+
+    def get_temperature(self, default: Optional[float] = None) -> Optional[float]:
+        """Temperature to generate with: 0 while caching, so cached answers are reproducible"""
+        return 0.0 if self.is_enabled else default
+
+    def _is_cacheable(self, temperature: Optional[float]) -> bool:
+        return self.is_enabled and temperature == 0
+
+    def _encode(self, text: str) -> np.ndarray:
+        with self._encoder_lock:
+            if self._encoder is None:
+                from sentence_transformers import SentenceTransformer
+                self._encoder = SentenceTransformer(self.embedding_model, device="cpu")
+            return self._encoder.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def _touch(self, conn, key: str) -> None:
+        conn.execute("UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                     (time.time(), key))
+
+    def _lookup(self, key: str, scope: str, text: Optional[str] = None):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._touch(conn, key)
+            return json.loads(row[0])
+        if text is None or not self.is_semantic_enabled:
+            return None
+        rows = conn.execute("SELECT key, embedding, value FROM entries "
+                            "WHERE scope = ? AND embedding IS NOT NULL", (scope,)).fetchall()
+        if not rows:
+            return None
+        embeddings = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        similarities = embeddings @ self._encode(text)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        self._touch(conn, rows[best][0])
+        return json.loads(rows[best][2])
+
+    def _store(self, key: str, scope: str, value, text: Optional[str] = None) -> None:
+        serialized = json.dumps(value)
+        embedding = None
+        if text is not None and self.is_semantic_enabled:
+            embedding = self._encode(text).tobytes()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO entries (key, scope, value, embedding, size, last_used) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, scope, serialized, embedding,
+                          len(serialized) + len(embedding or b""), time.time()))
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn) -> None:
+        while conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] > self.max_bytes:
+            conn.execute("DELETE FROM entries WHERE key IN "
+                         "(SELECT key FROM entries ORDER BY last_used LIMIT 32)")
+
+    def get_response(self, model: str, system_prompt: str, prompt: str,
+                     context: str = "", temperature: Optional[float] = None) -> Optional[str]:
+        if not self._is_cacheable(temperature):
+            return None
+        scope = _hash(model, system_prompt, context)
+        response = self._lookup(_hash(scope, prompt), scope, prompt)
+        CACHE_REQUESTS.inc(cache="agent", result="miss" if response is None else "hit")
+        return response
+
+    def put_response(self, model: str, system_prompt: str, prompt: str, response: str,
+                     context: str = "", temperature: Optional[float] = None) -> None:
+        if not self._is_cacheable(temperature) or not response:
+            return
+        scope = _hash(model, system_prompt, context)
+        self._store(_hash(scope, prompt), scope, response, prompt)
+
+    def get_stream(self, model: str, system_prompt: str, contents: str,
+                   temperature: Optional[float], parse: Callable) -> Optional[List]:
+        """Returns the chunks of a cached streamed response, rebuilt with parse"""
+        if not self._is_cacheable(temperature):
+            return None
+        scope = _hash(model, system_prompt)
+        chunks = self._lookup(_hash(scope, contents), scope)
+        CACHE_REQUESTS.inc(cache="manager", result="miss" if chunks is None else "hit")
+        return None if chunks is None else [parse(chunk) for chunk in chunks]
+
+    def record_stream(self, model: str, system_prompt: str, contents: str,
+                      temperature: Optional[float], stream, serialize: Callable):
+        """Passes a stream through, caching its chunks once it completes"""
+        if not self._is_cacheable(temperature):
+            yield from stream
+            return
+        chunks = []
+        for chunk in stream:
+            chunks.append(serialize(chunk))
+            yield chunk
+        scope = _hash(model, system_prompt)
+        self._store(_hash(scope, contents), scope, chunks)
+
+    def get_status(self) -> dict:
+        if not self.is_enabled:
+            return {"enabled": False}
+        entries, size, hits = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM entries").fetchone()
+        return {"enabled": True, "semantic": self.is_semantic_enabled,
+                "entries": entries, "size_mb": round(size / 1024 ** 2, 2), "hits": hits}
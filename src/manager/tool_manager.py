@@ -1,14 +1,19 @@
 import importlib
 import importlib.util
 import os
+import time
 import types
+from contextlib import contextmanager
 from typing import List
 import pip
 from google.genai import types
 
 from src.manager.budget_manager import BudgetManager
+from src.manager.resource_monitor import ResourceMonitor
+from src.manager.usage_ledger import UsageLedger
 from src.manager.utils.singleton import singleton
 from src.manager.utils.suppress_outputs import suppress_output
+from src.manager.utils.tracing import span
 from src.tools.default_tools.tool_deletor import ToolDeletor
 from src.manager.utils.streamlit_interface import output_assistant_response
 
@@ -51,10 +56,22 @@ class Tool:
     def run(self, query):
         return self.tool.run(**query)
 
+    def stream(self, query):
+        """
+        Yields partial results marked with status "streaming", followed by the
+        final result. Tools without a stream method yield their run result.
+        """
+        if hasattr(self.tool, "stream"):
+            yield from self.tool.stream(**query)
+        else:
+            yield self.tool.run(**query)
+
 @singleton
 class ToolManager:
     toolsImported: List[Tool] = []
     budget_manager: BudgetManager = BudgetManager()
+    resource_monitor: ResourceMonitor = ResourceMonitor()
+    usage_ledger: UsageLedger = UsageLedger()
     is_creation_enabled: bool = True
     is_invocation_enabled: bool = True
 
@@ -99,7 +116,7 @@ class ToolManager:
                         self.budget_manager.add_to_resource_budget(toolObj.create_expense_cost)
         self.toolsImported = newToolsImported
 
-    def runTool(self, toolName, query):
+    def _get_invocable_tool(self, toolName):
         if not self.is_invocation_enabled:
             raise Exception("Tool invocation mode is disabled")
         if toolName == "ToolCreator":
@@ -111,15 +128,61 @@ class ToolManager:
                 if tool.invoke_resource_cost is not None:
                     if not self.budget_manager.can_spend_resource(tool.invoke_resource_cost):
                         raise Exception("No resource budget remaining")
-                if tool.invoke_expense_cost is not None:
-                    self.budget_manager.add_to_resource_budget(tool.invoke_expense_cost)
-                return tool.run(query)
+                return tool
         self._output_budgets()
+        return None
+
+    def _tool_not_found(self, toolName):
         return {
             "status": "error",
             "message": f"Tool {toolName} not found",
             "output": None
         }
+
+    @contextmanager
+    def _invocation(self, tool):
+        """
+        Holds the tool's invoke resource cost while it runs, measures what it
+        actually used and records the call in the usage ledger. The expense is
+        reserved up front and only spent if the tool succeeds.
+        """
+        resource_cost = tool.invoke_resource_cost or 0
+        self.resource_monitor.admit("tool", tool.name, resource_cost)
+        expense = self.budget_manager.reserve_expense(tool.invoke_expense_cost or 0)
+        reservation = None
+        status = "error"
+        started = time.monotonic()
+        try:
+            reservation = self.budget_manager.reserve_resource(resource_cost)
+            with span("tool", tool=tool.name, cost=tool.invoke_expense_cost or 0), \
+                    self.resource_monitor.track("tool", tool.name, resource_cost):
+                yield
+            status = "success"
+        finally:
+            self.budget_manager.release_reservation(reservation)
+            if status == "success":
+                self.budget_manager.commit_reservation(expense)
+            else:
+                self.budget_manager.release_reservation(expense)
+            self.usage_ledger.record(tool=tool.name,
+                                     cost=tool.invoke_expense_cost or 0,
+                                     latency=time.monotonic() - started,
+                                     status=status)
+
+    def runTool(self, toolName, query):
+        tool = self._get_invocable_tool(toolName)
+        if tool is None:
+            return self._tool_not_found(toolName)
+        with self._invocation(tool):
+            return tool.run(query)
+
+    def streamTool(self, toolName, query):
+        tool = self._get_invocable_tool(toolName)
+        if tool is None:
+            yield self._tool_not_found(toolName)
+            return
+        with self._invocation(tool):
+            yield from tool.stream(query)
     
 
     def getTools(self):
@@ -131,7 +194,8 @@ class ToolManager:
             for prop, value in tool.inputSchema["parameters"]["properties"].items():
                 properties[prop] = types.Schema(
                     type=value["type"],
-                    description=value["description"]
+                    description=value["description"],
+                    items=types.Schema(type=value["items"]["type"]) if "items" in value else None
                 )
             parameters.properties = properties
             parameters.required = tool.inputSchema["parameters"].get("required", [])
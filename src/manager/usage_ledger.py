@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from src.manager.utils.request_context import get_request_context
+from src.manager.utils.singleton import singleton
+
+USAGE_DB_PATH = os.getenv("HASHIRU_USAGE_DB", "./src/models/usage.db")
+
+# Bucket name -> width in seconds, 0 being the all-time total
+BUCKETS = {"all": 0, "hour": 3600, "day": 86400}
+DIMENSIONS = ("all", "user", "session", "agent", "tool", "model")
+
+_USAGE_FIELDS = ("calls", "errors", "input_tokens", "output_tokens",
+                 "cost", "latency_total", "latency_max")
+
+
+@singleton
+class UsageLedger():
+    """
+    Append-only record of every manager, agent and tool call with its tokens,
+    cost and latency, attributed to the user and session of the request.
+
+    Each event also updates per user, session, agent, tool and model rollups
+    for all time, hourly and daily buckets in the same transaction, so totals
+    are read with a single primary key lookup instead of scanning events.
+    """
+
+    def __init__(self, db_path: str = USAGE_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS usage_events ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL NOT NULL, "
+                     "user_id TEXT, session_id TEXT, agent TEXT, tool TEXT, model TEXT, "
+                     "input_tokens INTEGER, output_tokens INTEGER, cost REAL, "
+                     "latency REAL, status TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS usage_rollups ("
+                     "dimension TEXT NOT NULL, key TEXT NOT NULL, "
+                     "bucket TEXT NOT NULL, bucket_start INTEGER NOT NULL, "
+                     "calls INTEGER NOT NULL, errors INTEGER NOT NULL, "
+                     "input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+                     "cost REAL NOT NULL, latency_total REAL NOT NULL, "
+                     "latency_max REAL NOT NULL, "
+                     "PRIMARY KEY (dimension, key, bucket, bucket_start))")
+        conn.execute("CREATE INDEX IF NOT EXISTS usage_events_model "
+                     "ON usage_events (model, status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, agent: Optional[str] = None, tool: Optional[str] = None,
+               model: Optional[str] = None, input_tokens: int = 0,
+               output_tokens: int = 0, cost: float = 0, latency: float = 0,
+               status: str = "success") -> None:
+        user_id, session_id = get_request_context()
+        now = time.time()
+        keys = {"all": "*", "user": user_id, "session": session_id,
+                "agent": agent, "tool": tool, "model": model}
+        error = 1 if status == "error" else 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO usage_events (time, user_id, session_id, agent, tool, "
+                         "model, input_tokens, output_tokens, cost, latency, status) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (now, user_id, session_id, agent, tool, model,
+                          input_tokens, output_tokens, cost, latency, status))
+            for dimension in DIMENSIONS:
+                if keys[dimension] is None:
+                    continue
+                for bucket, width in BUCKETS.items():
+                    bucket_start = int(now // width * width) if width else 0
+                    conn.execute(
+                        "INSERT INTO usage_rollups VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (dimension, key, bucket, bucket_start) DO UPDATE SET "
+                        "calls = calls + 1, errors = errors + excluded.errors, "
+                        "input_tokens = input_tokens + excluded.input_tokens, "
+                        "output_tokens = output_tokens + excluded.output_tokens, "
+                        "cost = cost + excluded.cost, "
+                        "latency_total = latency_total + excluded.latency_total, "
+                        "latency_max = MAX(latency_max, excluded.latency_max)",
+                        (dimension, keys[dimension], bucket, bucket_start, error,
+                         input_tokens, output_tokens, cost, latency, latency))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _as_dict(self, row) -> dict:
+        usage = dict(zip(_USAGE_FIELDS, row))
+        usage["latency_avg"] = usage["latency_total"] / usage["calls"] if usage["calls"] else 0
+        return usage
+
+    def get_totals(self, dimension: str = "all", key: str = "*") -> dict:
+        row = self._connect().execute(
+            f"SELECT {', '.join(_USAGE_FIELDS)} FROM usage_rollups "
+            "WHERE dimension = ? AND key = ? AND bucket = 'all' AND bucket_start = 0",
+            (dimension, key)).fetchone()
+        return self._as_dict(row or (0,) * len(_USAGE_FIELDS))
+
+    def get_model_calls(self, model: str, statuses=("success", "error")) -> dict:
+        """
+        Totals of the model's calls with the given statuses, e.g. leaving out
+        cache hits, which took no time and cost nothing
+        """
+        placeholders = ", ".join("?" for _ in statuses)
+        row = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(status = 'error'), 0), "
+            "COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0), "
+            "COALESCE(SUM(cost), 0), COALESCE(SUM(latency), 0), COALESCE(MAX(latency), 0) "
+            f"FROM usage_events WHERE model = ? AND status IN ({placeholders})",
+            (model, *statuses)).fetchone()
+        return self._as_dict(row)
+
+    def get_rollups(self, dimension: str = "all", key: str = "*",
+                    bucket: str = "hour", since: float = 0) -> List[dict]:
+        rows = self._connect().execute(
+            f"SELECT bucket_start, {', '.join(_USAGE_FIELDS)} FROM usage_rollups "
+            "WHERE dimension = ? AND key = ? AND bucket = ? AND bucket_start >= ? "
+            "ORDER BY bucket_start",
+            (dimension, key, bucket, int(since))).fetchall()
+        return [dict(self._as_dict(row[1:]), bucket_start=row[0]) for row in rows]
+
+    def get_keys(self, dimension: str) -> List[str]:
+        rows = self._connect().execute(
+            "SELECT key FROM usage_rollups WHERE dimension = ? AND bucket = 'all' "
+            "ORDER BY cost DESC", (dimension,)).fetchall()
+        return [row[0] for row in rows]
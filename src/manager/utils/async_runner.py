@@ -0,0 +1,30 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the process-wide event loop used for async provider calls. It runs
+    in a daemon thread so that sync code (tools, Gradio handlers) can schedule
+    coroutines on it and async clients keep their connections between calls.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever,
+                             name="hashiru-async-loop",
+                             daemon=True).start()
+    return _loop
+
+
+def submit_async(coro) -> Future:
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+
+
+def run_async(coro):
+    return submit_async(coro).result()
@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from src.manager.utils.request_context import get_request_context, get_request_priority
+from src.manager.utils.tracing import add_to_span
+
+# Slots and slots per user for every scheduled stage, per server process.
+# Override with HASHIRU_SCHEDULER_<POOL>="<slots>:<slots per user>".
+POOL_LIMITS = {
+    "manager": (8, 2),
+    "agent": (16, 4),
+}
+DEFAULT_LIMITS = (8, 2)
+# Slots of every pool that batch work cannot take, so chats start at once under batch load
+INTERACTIVE_RESERVE = int(os.getenv("HASHIRU_SCHEDULER_INTERACTIVE_RESERVE", "2"))
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+def _user_weights() -> Dict[str, float]:
+    """HASHIRU_SCHEDULER_WEIGHTS="alice@example.com=2,benchmark=0.5", 1 for everyone else"""
+    weights = {}
+    for entry in os.getenv("HASHIRU_SCHEDULER_WEIGHTS", "").split(","):
+        user, _, weight = entry.strip().rpartition("=")
+        if user:
+            weights[user] = float(weight)
+    return weights
+
+
+class _Ticket():
+    def __init__(self, user: str, priority: str, finish: float, seq: int):
+        self.user = user
+        self.priority = priority
+        self.finish = finish
+        self.seq = seq
+        self.granted = False
+        self.enqueued = time.monotonic()
+
+
+class FairScheduler():
+    """
+    Admits calls into a fixed number of slots. Interactive calls go before
+    batch calls, and batch calls leave `reserve` slots free for interactive
+    ones. Within a class, users share the slots by weighted fair queuing
+    (each call's virtual finish time advances the user's clock by
+    1/weight), and no user holds more than `user_limit` slots at once.
+    """
+
+    def __init__(self, name: str, slots: int, user_limit: int, reserve: int = INTERACTIVE_RESERVE,
+                 weights: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.slots = max(1, slots)
+        self.user_limit = max(1, user_limit)
+        self.reserve = min(max(0, reserve), self.slots - 1)
+        self.weights = weights if weights is not None else _user_weights()
+        self.in_flight = 0
+        self.in_flight_by_class = {priority: 0 for priority in PRIORITIES}
+        self.in_flight_by_user: Dict[str, int] = {}
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.wait_total = {priority: 0.0 for priority in PRIORITIES}
+        self._queue: List[_Ticket] = []
+        self._virtual_time = 0.0
+        self._user_finish: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _eligible(self, ticket: _Ticket) -> bool:
+        if self.in_flight_by_user.get(ticket.user, 0) >= self.user_limit:
+            return False
+        if ticket.priority == BATCH:
+            return self.in_flight < self.slots - self.reserve
+        return self.in_flight < self.slots
+
+    def _dispatch(self) -> None:
+        """Grants free slots to the waiting calls that are next in line"""
+        while self._queue and self.in_flight < self.slots:
+            eligible = [ticket for ticket in self._queue if self._eligible(ticket)]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (PRIORITIES.index(t.priority), t.finish, t.seq))
+            self._queue.remove(ticket)
+            ticket.granted = True
+            self._virtual_time = max(self._virtual_time, ticket.finish)
+            self.in_flight += 1
+            self.in_flight_by_class[ticket.priority] += 1
+            self.in_flight_by_user[ticket.user] = self.in_flight_by_user.get(ticket.user, 0) + 1
+            self.admitted[ticket.priority] += 1
+            self.wait_total[ticket.priority] += time.monotonic() - ticket.enqueued
+        self._cond.notify_all()
+
+    def _enqueue(self, user: str, priority: str) -> _Ticket:
+        if priority not in PRIORITIES:
+            priority = INTERACTIVE
+        with self._cond:
+            start = max(self._virtual_time, self._user_finish.get(user, 0.0))
+            finish = start + 1 / self.weights.get(user, 1.0)
+            self._user_finish[user] = finish
+            ticket = _Ticket(user, priority, finish, next(self._seq))
+            self._queue.append(ticket)
+            self._dispatch()
+            return ticket
+
+    def _abandon(self, ticket: _Ticket) -> None:
+        with self._cond:
+            if ticket.granted:
+                self._release(ticket)
+            else:
+                self._queue.remove(ticket)
+
+    def _release(self, ticket: _Ticket) -> None:
+        self.in_flight -= 1
+        self.in_flight_by_class[ticket.priority] -= 1
+        self.in_flight_by_user[ticket.user] -= 1
+        if self.in_flight_by_user[ticket.user] == 0:
+            del self.in_flight_by_user[ticket.user]
+        self._dispatch()
+
+    def release(self, ticket: _Ticket) -> None:
+        with self._cond:
+            self._release(ticket)
+
+    def acquire(self, user: str, priority: str) -> _Ticket:
+        ticket = self._enqueue(user, priority)
+        try:
+            with self._cond:
+                while not ticket.granted:
+                    self._cond.wait()
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        add_to_span("queue_wait_s", time.monotonic() - ticket.enqueued)
+        return ticket
+
+    async def acquire_async(self, user: str, priority: str) -> _Ticket:
+        ticket = self._enqueue(user, priority)
+        try:
+            while not ticket.granted:
+                await asyncio.sleep(0.02)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        add_to_span("queue_wait_s", time.monotonic() - ticket.enqueued)
+        return ticket
+
+    @contextmanager
+    def slot(self):
+        """Holds a slot for the current request's user and priority"""
+        user, _ = get_request_context()
+        ticket = self.acquire(user, get_request_priority())
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def slot_async(self):
+        user, _ = get_request_context()
+        ticket = await self.acquire_async(user, get_request_priority())
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def get_status(self) -> dict:
+        with self._cond:
+            queued = {priority: 0 for priority in PRIORITIES}
+            queued_by_user: Dict[str, int] = {}
+            now = time.monotonic()
+            oldest = 0.0
+            for ticket in self._queue:
+                queued[ticket.priority] += 1
+                queued_by_user[ticket.user] = queued_by_user.get(ticket.user, 0) + 1
+                oldest = max(oldest, now - ticket.enqueued)
+            return {
+                "slots": self.slots,
+                "user_limit": self.user_limit,
+                "interactive_reserve": self.reserve,
+                "in_flight": dict(self.in_flight_by_class),
+                "queued": queued,
+                "in_flight_by_user": dict(self.in_flight_by_user),
+                "queued_by_user": queued_by_user,
+                "oldest_wait_s": round(oldest, 3),
+                "admitted": dict(self.admitted),
+                "mean_wait_s": {priority: round(self.wait_total[priority] / self.admitted[priority], 4)
+                                if self.admitted[priority] else 0.0 for priority in PRIORITIES},
+            }
+
+
+_schedulers: Dict[str, FairScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def _pool_limits(pool: str) -> Tuple[int, int]:
+    override = os.getenv(f"HASHIRU_SCHEDULER_{pool.upper()}")
+    if override:
+        slots, _, user_limit = override.partition(":")
+        default_slots, default_user_limit = POOL_LIMITS.get(pool, DEFAULT_LIMITS)
+        return int(slots or default_slots), int(user_limit or default_user_limit)
+    return POOL_LIMITS.get(pool, DEFAULT_LIMITS)
+
+
+def get_scheduler(pool: str) -> FairScheduler:
+    """Returns the process-wide scheduler of the "manager" or "agent" stage"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(pool)
+        if scheduler is None:
+            scheduler = FairScheduler(pool, *_pool_limits(pool))
+            _schedulers[pool] = scheduler
+        return scheduler
+
+
+def get_scheduler_status() -> dict:
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {pool: scheduler.get_status() for pool, scheduler in schedulers.items()}
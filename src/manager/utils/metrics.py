@@ -0,0 +1,213 @@
+import bisect
+import math
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds, from a cache hit to a long multi-agent turn
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+
+_registry: List["Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric():
+    """A metric family with a fixed set of label names, rendered in the Prometheus text format"""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Sequence[str], Sequence, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labelnames, labelvalues, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, self.labelnames, key, value) for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    """A value that is set directly, or read from a function when scraped"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._function: Optional[Callable] = None
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable) -> None:
+        """function() returns the value, or a dict of label value tuples to values"""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception:
+                # A failing source leaves the gauge out of this scrape
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [(self.name, self.labelnames, key, value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count in every bucket (the last one being +Inf), sum
+        self._values: Dict[Tuple, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        labelnames = self.labelnames + ("le",)
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labelnames, key + (_format_value(bound),),
+                                cumulative))
+            samples.append((f"{self.name}_sum", self.labelnames, key, total))
+            samples.append((f"{self.name}_count", self.labelnames, key, cumulative))
+        return samples
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+MANAGER_TURN_SECONDS = Histogram(
+    "hashiru_manager_turn_seconds", "Time to answer one chat turn, tools and agents included",
+    ["status"])
+MANAGER_TURN_TOKENS = Histogram(
+    "hashiru_manager_turn_tokens", "Manager model tokens used by one chat turn",
+    ["direction"], buckets=TOKEN_BUCKETS)
+MANAGER_GENERATE_SECONDS = Histogram(
+    "hashiru_manager_generate_seconds", "Time of one manager model generation round",
+    ["status"])
+TOOL_SECONDS = Histogram(
+    "hashiru_tool_seconds", "Tool run time", ["tool", "status"])
+AGENT_SECONDS = Histogram(
+    "hashiru_agent_call_seconds", "Agent call time per model", ["model", "status"])
+QUEUE_WAIT_SECONDS = Histogram(
+    "hashiru_scheduler_wait_seconds", "Time calls waited for a scheduler slot", ["stage"])
+CACHE_REQUESTS = Counter(
+    "hashiru_cache_requests_total", "Response cache lookups", ["cache", "result"])
+ACTIVE_SESSIONS = Gauge(
+    "hashiru_active_sessions", "Sessions with a chat turn or job being answered")
+
+_active_sessions: Dict[str, int] = {}
+_active_lock = threading.Lock()
+
+
+@contextmanager
+def track_session(session_id: str):
+    """Counts the session as active while the enclosed turn runs"""
+    with _active_lock:
+        _active_sessions[session_id] = _active_sessions.get(session_id, 0) + 1
+        ACTIVE_SESSIONS.set(len(_active_sessions))
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active_sessions[session_id] -= 1
+            if _active_sessions[session_id] == 0:
+                del _active_sessions[session_id]
+            ACTIVE_SESSIONS.set(len(_active_sessions))
+
+
+def observe_span(span: dict) -> None:
+    """Feeds a finished trace span into the latency and token histograms"""
+    name = span["name"]
+    status = span.get("status", "success")
+    if name == "manager.turn":
+        MANAGER_TURN_SECONDS.observe(span["duration_s"], status=status)
+        MANAGER_TURN_TOKENS.observe(span.get("input_tokens", 0), direction="input")
+        MANAGER_TURN_TOKENS.observe(span.get("output_tokens", 0), direction="output")
+    elif name == "manager.generate":
+        MANAGER_GENERATE_SECONDS.observe(span["duration_s"], status=status)
+        if "queue_wait_s" in span:
+            QUEUE_WAIT_SECONDS.observe(span["queue_wait_s"], stage="manager")
+    elif name == "tool":
+        TOOL_SECONDS.observe(span["duration_s"], tool=span.get("tool"), status=status)
+    elif name == "agent.call":
+        AGENT_SECONDS.observe(span["duration_s"], model=span.get("model"), status=status)
+    elif name == "ask_agent" and "queue_wait_s" in span:
+        # Agent calls wait for their slot before the agent.call span starts
+        QUEUE_WAIT_SECONDS.observe(span["queue_wait_s"], stage="agent")
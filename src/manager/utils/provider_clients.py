@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import ollama
+from dotenv import load_dotenv
+from google import genai
+from groq import Groq, AsyncGroq
+from openai import OpenAI, AsyncOpenAI
+from src.manager.replay import wrap_client
+
+# Loaded once here instead of once per agent
+load_dotenv()
+
+# Every client goes through wrap_client, so HASHIRU_PROVIDER_MODE=record/replay
+# (src/manager/replay.py) covers all providers
+
+# Retries are left to the shared rate limiter, which sees every 429 and adapts
+_SDK_RETRIES = 0
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(key, factory):
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def _loop_key(is_async: bool):
+    # Async clients hold connections bound to the loop that opened them
+    if not is_async:
+        return None
+    return id(asyncio.get_running_loop())
+
+
+def get_gemini_client(api_key: str, is_async: bool = False):
+    """Shared Gemini client for an API key. The async variant is `client.aio`."""
+    client = _get_client(("gemini", api_key, _loop_key(is_async)),
+                         lambda: wrap_client("gemini", lambda: genai.Client(api_key=api_key)))
+    return client.aio if is_async else client
+
+
+def get_groq_client(api_key: str, is_async: bool = False):
+    if is_async:
+        return _get_client(("groq", api_key, _loop_key(True)),
+                           lambda: wrap_client("groq", lambda: AsyncGroq(api_key=api_key, max_retries=_SDK_RETRIES),
+                                               is_async=True))
+    return _get_client(("groq", api_key, None),
+                       lambda: wrap_client("groq", lambda: Groq(api_key=api_key, max_retries=_SDK_RETRIES)))
+
+
+def get_openai_client(api_key: str, base_url: str = None, is_async: bool = False):
+    if is_async:
+        return _get_client(("openai", api_key, base_url, _loop_key(True)),
+                           lambda: wrap_client("openai", lambda: AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                                                             max_retries=_SDK_RETRIES),
+                                               is_async=True))
+    return _get_client(("openai", api_key, base_url, None),
+                       lambda: wrap_client("openai", lambda: OpenAI(api_key=api_key, base_url=base_url,
+                                                                    max_retries=_SDK_RETRIES)))
+
+
+def get_ollama_client(is_async: bool = False):
+    if is_async:
+        return _get_client(("ollama", _loop_key(True)),
+                           lambda: wrap_client("ollama", ollama.AsyncClient, is_async=True))
+    return _get_client(("ollama", None), lambda: wrap_client("ollama", ollama.Client))
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+from src.manager.utils.tracing import add_to_span
+
+# Requests per minute and maximum concurrent requests for each provider.
+# Override with HASHIRU_RATE_LIMIT_<PROVIDER>="<rpm>:<concurrency>".
+PROVIDER_LIMITS = {
+    "gemini": (60, 8),
+    "groq": (30, 4),
+    "lambda": (60, 8),
+}
+DEFAULT_LIMITS = (60, 4)
+
+SUCCESS = "success"
+THROTTLED = "throttled"
+ERROR = "error"
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for attribute in ("status_code", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+    except Exception:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def classify_error(error: Exception) -> Tuple[str, Optional[float]]:
+    """Rate limits and overloaded servers are throttling, anything else is a plain error"""
+    status = _status_code(error)
+    if status == 429 or (status is not None and 500 <= status < 600):
+        return THROTTLED, _retry_after(error)
+    return ERROR, None
+
+
+class AdaptiveRateLimiter():
+    """
+    Token bucket for the provider's request rate combined with an AIMD
+    concurrency window: every successful call widens the window by
+    1/window, every throttled call halves it and pauses the bucket until
+    the provider's Retry-After (or an exponential backoff) has passed.
+    """
+    max_backoff: float = 60
+
+    def __init__(self, requests_per_minute: float, max_concurrency: int):
+        self.rate = requests_per_minute / 60
+        self.burst = max(1, max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.window = float(max_concurrency)
+        self.tokens = float(self.burst)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.consecutive_throttles = 0
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _try_acquire(self) -> Optional[float]:
+        """Takes a slot and returns None, or returns how long to wait before trying again"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= int(self.window):
+            return 0.05
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return None
+
+    def acquire(self) -> None:
+        started = time.monotonic()
+        with self._cond:
+            while (wait := self._try_acquire()) is not None:
+                self._cond.wait(timeout=wait)
+        add_to_span("rate_limit_wait_s", time.monotonic() - started)
+
+    async def acquire_async(self) -> None:
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                wait = self._try_acquire()
+            if wait is None:
+                add_to_span("rate_limit_wait_s", time.monotonic() - started)
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, outcome: str, retry_after: Optional[float] = None) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == SUCCESS:
+                self.consecutive_throttles = 0
+                self.window = min(self.max_concurrency, self.window + 1 / self.window)
+            elif outcome == THROTTLED:
+                self.consecutive_throttles += 1
+                self.window = max(1.0, self.window / 2)
+                if retry_after is None:
+                    retry_after = min(self.max_backoff, 2 ** (self.consecutive_throttles - 1))
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
+
+    def get_status(self) -> dict:
+        with self._cond:
+            return {
+                "concurrency_window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "blocked_for_s": max(0.0, round(self.blocked_until - time.monotonic(), 2)),
+            }
+
+
+_limiters: Dict[Tuple[str, str], AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _provider_limits(provider: str) -> Tuple[float, int]:
+    override = os.getenv(f"HASHIRU_RATE_LIMIT_{provider.upper()}")
+    if override:
+        rpm, _, concurrency = override.partition(":")
+        default_rpm, default_concurrency = PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS)
+        return float(rpm or default_rpm), int(concurrency or default_concurrency)
+    return PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS)
+
+
+def get_rate_limiter(provider: str, model: str) -> AdaptiveRateLimiter:
+    """Returns the process-wide limiter for a provider and model"""
+    with _limiters_lock:
+        limiter = _limiters.get((provider, model))
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(*_provider_limits(provider))
+            _limiters[(provider, model)] = limiter
+        return limiter
+
+
+def get_rate_limiter_status() -> dict:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {f"{provider}:{model}": limiter.get_status()
+            for (provider, model), limiter in limiters.items()}
+
+
+def call_with_rate_limit(provider: str, model: str, fn, max_retries: int = 5):
+    """Calls fn() under the limiter, retrying throttled calls once the limiter allows"""
+    limiter = get_rate_limiter(provider, model)
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        outcome, retry_after = SUCCESS, None
+        try:
+            return fn()
+        except Exception as e:
+            outcome, retry_after = classify_error(e)
+            if outcome != THROTTLED or attempt == max_retries:
+                raise
+            add_to_span("retries", 1)
+        finally:
+            limiter.release(outcome, retry_after)
+
+
+async def call_with_rate_limit_async(provider: str, model: str, fn, max_retries: int = 5):
+    """Async variant of call_with_rate_limit, fn returns the awaitable to run"""
+    limiter = get_rate_limiter(provider, model)
+    for attempt in range(max_retries + 1):
+        await limiter.acquire_async()
+        outcome, retry_after = SUCCESS, None
+        try:
+            return await fn()
+        except Exception as e:
+            outcome, retry_after = classify_error(e)
+            if outcome != THROTTLED or attempt == max_retries:
+                raise
+            add_to_span("retries", 1)
+        finally:
+            limiter.release(outcome, retry_after)
+
+
+def stream_with_rate_limit(provider: str, model: str, fn, max_retries: int = 5):
+    """
+    Iterates the stream returned by fn() while holding a concurrency slot.
+    A throttled stream is only retried if nothing was yielded yet.
+    """
+    limiter = get_rate_limiter(provider, model)
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        outcome, retry_after = SUCCESS, None
+        started = False
+        try:
+            stream = fn()
+            try:
+                for chunk in stream:
+                    started = True
+                    yield chunk
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+            return
+        except Exception as e:
+            outcome, retry_after = classify_error(e)
+            if outcome != THROTTLED or started or attempt == max_retries:
+                raise
+            add_to_span("retries", 1)
+        finally:
+            limiter.release(outcome, retry_after)
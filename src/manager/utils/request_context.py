@@ -0,0 +1,38 @@
+import contextvars
+
+_current_user = contextvars.ContextVar("hashiru_user", default="anonymous")
+_current_session = contextvars.ContextVar("hashiru_session", default="default")
+# "interactive" for chats, "batch" for queued jobs such as benchmark reviews
+_current_priority = contextvars.ContextVar("hashiru_priority", default="interactive")
+
+
+def set_request_context(user_id: str, session_id: str, priority: str = "interactive") -> None:
+    _current_user.set(user_id)
+    _current_session.set(session_id)
+    _current_priority.set(priority)
+
+
+def get_request_context():
+    """Returns (user_id, session_id) of the request being handled"""
+    return _current_user.get(), _current_session.get()
+
+
+def get_request_priority() -> str:
+    return _current_priority.get()
+
+
+def bind_request_context(generator, user_id: str, session_id: str,
+                         priority: str = "interactive"):
+    """
+    Runs every step of a generator in one context that carries the given user,
+    session and priority. Gradio may resume a generator on a different worker
+    thread, so setting the variables once from inside it would not stick.
+    """
+    context = contextvars.copy_context()
+    context.run(set_request_context, user_id, session_id, priority)
+    while True:
+        try:
+            item = context.run(next, generator)
+        except StopIteration as e:
+            return e.value
+        yield item
@@ -0,0 +1,168 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable
+
+# file: one JSON file per key with a file lock, sqlite: one shared database,
+# redis: any Redis-compatible server, for workers on several machines
+STATE_BACKEND = os.getenv("HASHIRU_STATE_BACKEND", "file")
+STATE_DIR = os.getenv("HASHIRU_STATE_DIR", "./src/data")
+STATE_DB_PATH = os.getenv("HASHIRU_STATE_DB", "./src/models/state.db")
+REDIS_URL = os.getenv("HASHIRU_REDIS_URL", "redis://localhost:6379/0")
+
+
+class FileStateStore():
+    """
+    Keeps every key in <directory>/<key>.json. Updates hold an exclusive
+    lock on a sidecar lock file and replace the JSON file atomically, so
+    processes on one machine never see a half-written value.
+    """
+
+    def __init__(self, directory: str = STATE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    @contextmanager
+    def _locked(self, key: str):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self._path(key) + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, key: str, default: Any) -> Any:
+        try:
+            with open(self._path(key), "r", encoding="utf8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def _write(self, key: str, value: Any) -> None:
+        temporary = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf8") as f:
+            json.dump(value, f, indent=4)
+        os.replace(temporary, self._path(key))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._read(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        with self._locked(key):
+            self._write(key, value)
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = None) -> Any:
+        """Atomically replaces the value with fn(value) and returns the new value"""
+        with self._locked(key):
+            value = fn(self._read(key, default))
+            self._write(key, value)
+            return value
+
+
+class SQLiteStateStore():
+    """Keeps every key as a JSON row in one SQLite database shared by the workers"""
+
+    def __init__(self, db_path: str = STATE_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().execute("CREATE TABLE IF NOT EXISTS state ("
+                                "key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, conn, key: str, default: Any) -> Any:
+        row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._read(self._connect(), key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        self.update(key, lambda _: value)
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = None) -> Any:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = fn(self._read(conn, key, default))
+            conn.execute("INSERT OR REPLACE INTO state (key, value, updated) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), time.time()))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+
+class RedisStateStore():
+    """
+    Keeps every key as JSON in a Redis-compatible server. Updates are
+    optimistic transactions that retry when another worker wrote the key
+    in between.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "hashiru:"):
+        # Only needed for this backend: pip install redis
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._watch_error = redis.WatchError
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.client.get(self.prefix + key)
+        return default if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        self.client.set(self.prefix + key, json.dumps(value))
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = None) -> Any:
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    current = pipe.get(name)
+                    value = fn(default if current is None else json.loads(current))
+                    pipe.multi()
+                    pipe.set(name, json.dumps(value))
+                    pipe.execute()
+                    return value
+                except self._watch_error:
+                    continue
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """The process-wide store for state that all workers share, picked by HASHIRU_STATE_BACKEND"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STATE_BACKEND == "redis":
+                _store = RedisStateStore()
+            elif STATE_BACKEND == "sqlite":
+                _store = SQLiteStateStore()
+            elif STATE_BACKEND == "file":
+                _store = FileStateStore()
+            else:
+                raise ValueError(f"Unknown state backend {STATE_BACKEND}")
+        return _store
@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from src.manager.utils.metrics import observe_span
+from src.manager.utils.request_context import get_request_context
+
+MAX_SESSIONS = 1000
+MAX_SPANS_PER_SESSION = 10000
+
+_current_span = contextvars.ContextVar("hashiru_span", default=None)
+_traces: "OrderedDict[str, deque]" = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+class Span():
+    """One timed stage of handling a request, with its tokens, cost and status"""
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent_id = parent.id if parent is not None else None
+        self.status = "success"
+        self.attributes = attributes
+        self.start = time.time()
+        self._started = time.monotonic()
+
+    def set(self, status: Optional[str] = None, **attributes) -> None:
+        if status is not None:
+            self.status = status
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount: float) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_s": time.monotonic() - self._started,
+            "status": self.status,
+            **self.attributes,
+        }
+
+
+def _record(session_id: str, span: Span) -> None:
+    record = span.as_dict()
+    observe_span(record)
+    with _traces_lock:
+        spans = _traces.get(session_id)
+        if spans is None:
+            spans = _traces[session_id] = deque(maxlen=MAX_SPANS_PER_SESSION)
+            while len(_traces) > MAX_SESSIONS:
+                _traces.popitem(last=False)
+        spans.append(record)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the enclosed block as a child of the current span. Spans are
+    collected per session and can be fetched with get_trace/pop_trace.
+    """
+    _, session_id = get_request_context()
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except (asyncio.CancelledError, GeneratorExit):
+        current.status = "cancelled"
+        raise
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # A generator closed from another context, its own context is gone anyway
+            pass
+        _record(session_id, current)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_span_attributes(**attributes) -> None:
+    """Sets attributes (and the status) of the current span, if there is one"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def add_to_span(key: str, amount: float) -> None:
+    """Adds to a counter of the current span, if there is one"""
+    current = _current_span.get()
+    if current is not None:
+        current.add(key, amount)
+
+
+def get_trace(session_id: str) -> List[dict]:
+    with _traces_lock:
+        return list(_traces.get(session_id, []))
+
+
+def pop_trace(session_id: str) -> List[dict]:
+    """Returns the spans of a session and forgets them"""
+    with _traces_lock:
+        return list(_traces.pop(session_id, []))
+
+
+def _percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def summarize_spans(spans: List[dict]) -> Dict[str, dict]:
+    """Count, p50/p95 latency, tokens, cost and retries of the spans of every stage"""
+    stages: Dict[str, List[dict]] = {}
+    for s in spans:
+        stages.setdefault(s["name"], []).append(s)
+    summary = {}
+    for name, stage in stages.items():
+        durations = sorted(s["duration_s"] for s in stage)
+        summary[name] = {
+            "count": len(stage),
+            "errors": sum(1 for s in stage if s.get("status") == "error"),
+            "p50_s": _percentile(durations, 0.5),
+            "p95_s": _percentile(durations, 0.95),
+            "total_s": sum(durations),
+            "input_tokens": sum(s.get("input_tokens", 0) for s in stage),
+            "output_tokens": sum(s.get("output_tokens", 0) for s in stage),
+            "cost": sum(s.get("cost", 0) for s in stage),
+            "retries": sum(s.get("retries", 0) for s in stage),
+            "rate_limit_wait_s": sum(s.get("rate_limit_wait_s", 0) for s in stage),
+            "queue_wait_s": sum(s.get("queue_wait_s", 0) for s in stage),
+        }
+    return summary
@@ -0,0 +1,44 @@
+import time
+
+FORCE_FINAL_ANSWER_PROMPT = (
+    "The limit for this turn has been reached ({reason}). "
+    "Do not call any more tools. Using only the information gathered so far, "
+    "give your final answer now."
+)
+
+
+class TurnScheduler():
+    """
+    Bounds a single manager turn (one user message and all the tool rounds it
+    triggers) by number of rounds, wall-clock time and tokens.
+    """
+
+    def __init__(self, max_rounds: int = 40,
+                 max_seconds: float = 1800,
+                 max_tokens: int = 3000000):
+        self.max_rounds = max_rounds
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.start_time = time.monotonic()
+        self.rounds = 0
+        # Counted from this turn's own responses, so concurrent sessions do not add to it
+        self.tokens = 0
+
+    def start_round(self):
+        self.rounds += 1
+
+    def add_tokens(self, tokens: int):
+        self.tokens += tokens
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def exhausted_reason(self):
+        """Returns why the turn must end, or None if another tool round is allowed."""
+        if self.max_rounds is not None and self.rounds >= self.max_rounds:
+            return f"{self.rounds} of {self.max_rounds} rounds used"
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            return f"{self.elapsed():.0f}s of {self.max_seconds}s used"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return f"{self.tokens} of {self.max_tokens} tokens used"
+        return None
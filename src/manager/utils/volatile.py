@@ -0,0 +1,24 @@
+import os
+import re
+
+# Values that differ from run to run although the request means the same:
+# the remaining budget and measured usage in tool outputs (GetBudget,
+# AskAgent, ...) and generated ids such as the unique Ollama model ids.
+# They are masked before a request is hashed for the replay store or the
+# response cache, so reruns still match.
+VOLATILE_KEYS = re.compile(os.getenv(
+    "HASHIRU_VOLATILE_KEYS",
+    r"budget|expense|cost|usage|measured|memory_mb|latency|elapsed|timestamp"), re.IGNORECASE)
+VOLATILE_IDS = re.compile(r"\b[0-9a-f]{32}\b|(?<=-)[0-9a-f]{12}\b")
+
+
+def mask_volatile(value):
+    """A copy of JSON-like data with the volatile values replaced by placeholders"""
+    if isinstance(value, dict):
+        return {k: "<volatile>" if VOLATILE_KEYS.search(str(k)) else mask_volatile(v)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [mask_volatile(v) for v in value]
+    if isinstance(value, str):
+        return VOLATILE_IDS.sub("<id>", value)
+    return value
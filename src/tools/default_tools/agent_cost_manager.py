@@ -1,3 +1,5 @@
+from src.manager.model_router import ModelRouter
+
 __all__ = ['AgentCostManager']
 
 
@@ -6,10 +8,19 @@ class AgentCostManager():
 
     inputSchema = {
         "name": "AgentCostManager",
-        "description": "Retrieves the cost of creating and invoking an agent. Also includes the strengths of each model. Please make sure to use this before creating an agent.",
+        "description": "Retrieves the cost of creating and invoking an agent. Also includes the strengths of each model, their measured latency, throughput and error rate, and the recommended model for a latency target. Please make sure to use this before creating an agent.",
         "parameters": {
             "type": "object",
-            "properties": {},
+            "properties": {
+                "latency_slo_seconds": {
+                    "type": "number",
+                    "description": "Optional latency target for one agent call, in seconds. The recommendation is the cheapest model whose measured p95 latency meets it.",
+                },
+                "expected_output_tokens": {
+                    "type": "integer",
+                    "description": "Optional expected length of each answer in tokens, used to estimate the cost of a call. Defaults to 1000.",
+                },
+            },
             "required": [],
         }
     }
@@ -84,8 +95,20 @@ class AgentCostManager():
         return self.costs
 
     def run(self, **kwargs):
+        router = ModelRouter()
+        models = {
+            base_model: dict(costs, measured=router.get_stats(base_model))
+            for base_model, costs in self.costs.items()
+        }
+        recommendation = router.recommend(
+            self.costs,
+            latency_slo=kwargs.get("latency_slo_seconds"),
+            output_tokens=int(kwargs.get("expected_output_tokens") or 1000))
         return {
             "status": "success",
             "message": "Cost of creating and invoking an agent",
-            "output": self.costs,
+            "output": {
+                "models": models,
+                "recommendation": recommendation,
+            },
         }
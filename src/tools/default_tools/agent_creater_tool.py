@@ -1,5 +1,6 @@
-from src.manager.agent_manager import AgentManager
+from src.manager.agent_manager import AgentManager, GeminiAgent
 from src.tools.default_tools.agent_cost_manager import AgentCostManager
+from src.manager.model_router import ModelRouter
 __all__ = ['AgentCreator']
 
 class AgentCreator():
@@ -19,7 +20,11 @@ class AgentCreator():
                 },
                 "base_model": {
                     "type": "string",
-                    "description": "A base model from which the new agent mode is to be created. Check the available models using the AgentCostManager tool.",
+                    "description": "A base model from which the new agent mode is to be created. Check the available models using the AgentCostManager tool. Use 'auto' to pick the cheapest model that meets the latency target within the remaining budget.",
+                },
+                "latency_slo_seconds": {
+                    "type": "number",
+                    "description": "Optional latency target for one call of the agent, in seconds. Only used when base_model is 'auto'.",
                 },
                 "system_prompt": {
                     "type": "string",
@@ -29,6 +34,18 @@ class AgentCreator():
                     "type": "string",
                     "description": "Description of the agent. This is a string that describes the agent and its capabilities. It should be a single line description.",
                 },
+                "max_history_turns": {
+                    "type": "integer",
+                    "description": "Optional number of earlier question and answer turns a Gemini agent keeps per conversation.",
+                },
+                "summarize_old_turns": {
+                    "type": "boolean",
+                    "description": "Optional. If true, a Gemini agent summarizes the turns that no longer fit its history instead of forgetting them. Summaries are charged like questions.",
+                },
+                "max_conversations": {
+                    "type": "integer",
+                    "description": "Optional number of conversations a Gemini agent remembers at once.",
+                },
             },
             "required": ["agent_name", "base_model", "system_prompt", "description"],
         }
@@ -45,6 +62,16 @@ class AgentCreator():
         system_prompt = kwargs.get("system_prompt")
         description = kwargs.get("description")
         model_costs = AgentCostManager().get_costs()
+        if base_model == "auto":
+            recommendation = ModelRouter().recommend(
+                model_costs, latency_slo=kwargs.get("latency_slo_seconds"))
+            if recommendation["base_model"] is None:
+                return {
+                    "status": "error",
+                    "message": recommendation["reason"],
+                    "output": None
+                }
+            base_model = recommendation["base_model"]
         if base_model not in model_costs:
             return {
                 "status": "error",
@@ -57,6 +84,9 @@ class AgentCreator():
         invoke_expense_cost = model_costs[base_model].get("invoke_expense_cost", 0)
         output_expense_cost = model_costs[base_model].get("output_expense_cost", 0)
 
+        conversation_settings = {key: kwargs[key] for key in GeminiAgent.conversation_settings
+                                 if kwargs.get(key) is not None}
+
         agent_manager = AgentManager()
         try:
             _, remaining_resource_budget, remaining_expense_budget = agent_manager.create_agent(
@@ -68,7 +98,8 @@ class AgentCreator():
                 invoke_resource_cost=invoke_resource_cost,
                 create_expense_cost=create_expense_cost,
                 invoke_expense_cost=invoke_expense_cost,
-                output_expense_cost=output_expense_cost
+                output_expense_cost=output_expense_cost,
+                **conversation_settings
             )
         except ValueError as e:
             return {
@@ -79,7 +110,7 @@ class AgentCreator():
         
         return {
             "status": "success",
-            "message": "Agent successfully created",
+            "message": f"Agent successfully created with base model {base_model}",
             "remaining_resource_budget": remaining_resource_budget,
             "remaining_expense_budget": remaining_expense_budget
         }
\ No newline at end of file
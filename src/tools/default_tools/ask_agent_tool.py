@@ -22,6 +22,14 @@ class AskAgent():
                 "prompt": {
                     "type": "string",
                     "description": "This is the prompt that will be used to ask the agent a question. It should be a string that describes the question to be asked.",
+                },
+                "conversation_id": {
+                    "type": "string",
+                    "description": "Optional name of the task this question belongs to, e.g. the paper ID. The agent only remembers earlier questions from the same conversation.",
+                },
+                "reset_conversation": {
+                    "type": "boolean",
+                    "description": "If true, the agent forgets the conversation before answering. Use it when starting a new task with an existing agent.",
                 }
             },
             "required": ["agent_name", "prompt"],
@@ -29,14 +37,17 @@ class AskAgent():
     }
 
     def run(self, **kwargs):
-        print("Asking agent a question")
-
         agent_name = kwargs.get("agent_name")
         prompt = kwargs.get("prompt")
+        conversation_id = kwargs.get("conversation_id")
+        reset_conversation = bool(kwargs.get("reset_conversation", False))
         agent_manger = AgentManager()
 
         try:
-            agent_response, remaining_resource_budget, remaining_expense_budget = agent_manger.ask_agent(agent_name=agent_name, prompt=prompt)
+            agent_response, remaining_resource_budget, remaining_expense_budget = agent_manger.ask_agent(
+                agent_name=agent_name, prompt=prompt,
+                conversation_id=conversation_id,
+                reset_conversation=reset_conversation)
         except ValueError as e:
             return {
                 "status": "error",
@@ -44,11 +55,48 @@ class AskAgent():
                 "output": None
             }
 
-        print("Agent response", agent_response)
         return {
             "status": "success",
             "message": "Agent has replied to the given prompt",
             "output": agent_response,
+            "usage": agent_manger.get_agent(agent_name).get_last_usage(),
             "remaining_resource_budget": remaining_resource_budget,
             "remaining_expense_budget": remaining_expense_budget
         }
+
+    def stream(self, **kwargs):
+        agent_name = kwargs.get("agent_name")
+        prompt = kwargs.get("prompt")
+        conversation_id = kwargs.get("conversation_id")
+        reset_conversation = bool(kwargs.get("reset_conversation", False))
+        agent_manger = AgentManager()
+
+        agent_response = ""
+        truncated = False
+        try:
+            for agent_response, truncated in agent_manger.stream_ask_agent(
+                    agent_name=agent_name, prompt=prompt,
+                    conversation_id=conversation_id,
+                    reset_conversation=reset_conversation):
+                yield {
+                    "status": "streaming",
+                    "message": "Agent is replying",
+                    "output": agent_response,
+                }
+        except ValueError as e:
+            yield {
+                "status": "error",
+                "message": f"Error occurred: {str(e)}",
+                "output": None
+            }
+            return
+
+        yield {
+            "status": "success",
+            "message": "Agent reply was cut short because the expense budget ran out" if truncated
+            else "Agent has replied to the given prompt",
+            "output": agent_response,
+            "usage": agent_manger.get_agent(agent_name).get_last_usage(),
+            "remaining_resource_budget": agent_manger.budget_manager.get_current_remaining_resource_budget(),
+            "remaining_expense_budget": agent_manger.budget_manager.get_current_remaining_expense_budget()
+        }
@@ -0,0 +1,96 @@
+from src.manager.agent_manager import AgentManager
+
+__all__ = ['AskAgents']
+
+
+class AskAgents():
+    dependencies = ["ollama==0.4.7",
+                    "pydantic==2.11.1",
+                    "pydantic_core==2.33.0"]
+
+    inputSchema = {
+        "name": "AskAgents",
+        "description": "Asks several AI agents at the same time and gets all their responses in one call. Use this instead of calling AskAgent repeatedly, e.g. to send a paper to all reviewer agents. The agents must be created using the AgentCreator tool before using this tool.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "agent_names": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Names of the AI agents that are to be asked. Each agent can only appear once.",
+                },
+                "prompt": {
+                    "type": "string",
+                    "description": "The prompt sent to every agent. Required unless 'prompts' is given.",
+                },
+                "prompts": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Optional per-agent prompts, in the same order as 'agent_names'. Overrides 'prompt'.",
+                },
+            },
+            "required": ["agent_names"],
+        }
+    }
+
+    def run(self, **kwargs):
+        agent_names = list(kwargs.get("agent_names") or [])
+        prompt = kwargs.get("prompt")
+        prompts = kwargs.get("prompts")
+
+        if not agent_names:
+            return {
+                "status": "error",
+                "message": "At least one agent name is required",
+                "output": None
+            }
+        if prompts:
+            prompts = list(prompts)
+            if len(prompts) != len(agent_names):
+                return {
+                    "status": "error",
+                    "message": "'prompts' must have one entry per agent in 'agent_names'",
+                    "output": None
+                }
+        elif prompt:
+            prompts = [prompt] * len(agent_names)
+        else:
+            return {
+                "status": "error",
+                "message": "Either 'prompt' or 'prompts' is required",
+                "output": None
+            }
+
+        agent_manger = AgentManager()
+        responses = []
+        try:
+            # Responses are collected in the order the agents finish
+            for agent_name, agent_response, error in agent_manger.ask_agents(list(zip(agent_names, prompts))):
+                if error is None:
+                    responses.append({
+                        "agent_name": agent_name,
+                        "status": "success",
+                        "output": agent_response,
+                    })
+                else:
+                    responses.append({
+                        "agent_name": agent_name,
+                        "status": "error",
+                        "output": error,
+                    })
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": f"Error occurred: {str(e)}",
+                "output": None
+            }
+
+        failed = [response["agent_name"] for response in responses if response["status"] == "error"]
+        return {
+            "status": "success" if len(failed) < len(responses) else "error",
+            "message": "Agents have replied to the given prompts" if not failed
+            else f"Some agents failed to reply: {', '.join(failed)}",
+            "output": responses,
+            "remaining_resource_budget": agent_manger.budget_manager.get_current_remaining_resource_budget(),
+            "remaining_expense_budget": agent_manger.budget_manager.get_current_remaining_expense_budget()
+        }
@@ -2,6 +2,9 @@
 __all__ = ['GetBudget']
 
 from src.manager.budget_manager import BudgetManager
+from src.manager.resource_monitor import ResourceMonitor
+from src.manager.usage_ledger import UsageLedger
+from src.manager.utils.request_context import get_request_context
 
 
 class GetBudget():
@@ -27,6 +30,11 @@ class GetBudget():
         total_expense_budget = budget_manager.get_total_expense_budget()
         current_expense = budget_manager.get_current_expense()
         current_remaining_expense_budget = budget_manager.get_total_expense_budget() - budget_manager.get_current_expense()
+
+        measured_usage = ResourceMonitor().latest()
+
+        usage_ledger = UsageLedger()
+        user_id, session_id = get_request_context()
         return {
             "status": "success",
             "message": "Budget retrieved successfully",
@@ -37,6 +45,13 @@ class GetBudget():
                 "total_expense_budget": total_expense_budget,
                 "current_expense": current_expense,
                 "current_remaining_expense_budget": current_remaining_expense_budget,
+                "measured_memory_mb": round(measured_usage["rss_mb"]),
+                "measured_cpu_percent": measured_usage["cpu_percent"],
+                "measured_vram_mb": round(measured_usage["vram_mb"]),
+                "system_available_memory_mb": round(measured_usage["system_available_mb"]),
+                "usage_this_session": usage_ledger.get_totals("session", session_id),
+                "usage_this_user": usage_ledger.get_totals("user", user_id),
+                "usage_all_time": usage_ledger.get_totals(),
             }
         }
         
\ No newline at end of file
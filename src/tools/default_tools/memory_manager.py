@@ -1,8 +1,7 @@
 
 __all__ = ['MemoryManager']
 
-import json
-import os
+from src.manager.utils.shared_state import get_state_store
 
 
 class MemoryManager():
@@ -33,21 +32,11 @@ class MemoryManager():
     }
     
     def get_memories(self):
-        # load the memory from src/data/memory.json
-        try:
-            with open("src/data/memory.json", "r") as f:
-                memory_list = json.load(f)
-        except FileNotFoundError:
-            memory_list = []
-        except json.JSONDecodeError:
-            memory_list = []
-        return memory_list
+        # Shared by all workers, src/data/memory.json with the default file backend
+        return get_state_store().get("memory", [])
 
     def update_memories(self, memories):
-        os.makedirs("src/data", exist_ok=True)
-            # Save the memory to src/data/memory.json
-        with open("src/data/memory.json", "w") as f:
-            json.dump(memories, f, indent=4)
+        get_state_store().set("memory", memories)
 
 
 
@@ -70,19 +59,23 @@ class MemoryManager():
                     "message": "Memory and key are required for add_memory action",
                     "output": None
                 }
-            # check if the key already exists
-            for mem in memories:
-                if mem["key"] == key:
-                    return {
-                        "status": "error",
-                        "message": f"Memory with key {key} already exists",
-                        "output": None
-                    }
-            memories.append({
-                "key": key,
-                "memory": memory
-            })
-            self.update_memories(memories)
+            def add(memories):
+                # check if the key already exists
+                if any(mem["key"] == key for mem in memories):
+                    raise KeyError(key)
+                return memories + [{
+                    "key": key,
+                    "memory": memory
+                }]
+            try:
+                # One atomic update, so concurrent workers cannot drop each other's memories
+                get_state_store().update("memory", add, [])
+            except KeyError:
+                return {
+                    "status": "error",
+                    "message": f"Memory with key {key} already exists",
+                    "output": None
+                }
             return {
                 "status": "success",
                 "message": "Memory created successfully",
@@ -95,18 +88,21 @@ class MemoryManager():
                     "message": "Key is required for delete_memory action",
                     "output": None
                 }
-            # check if the key exists
-            for mem in memories:
-                if mem["key"] == key:
-                    memories.remove(mem)
-                    self.update_memories(memories)
-                    return {
-                        "status": "success",
-                        "message": "Memory deleted successfully",
-                        "output": None
-                    }
+            def delete(memories):
+                # check if the key exists
+                if not any(mem["key"] == key for mem in memories):
+                    raise KeyError(key)
+                return [mem for mem in memories if mem["key"] != key]
+            try:
+                get_state_store().update("memory", delete, [])
+            except KeyError:
+                return {
+                    "status": "error",
+                    "message": f"Memory with key {key} not found",
+                    "output": None
+                }
             return {
-                "status": "error",
-                "message": f"Memory with key {key} not found",
+                "status": "success",
+                "message": "Memory deleted successfully",
                 "output": None
             }
\ No newline at end of file
@@ -1,3 +1,40 @@
+import os
+import sys
+import time
+import secrets
+import argparse
 import subprocess
 
-subprocess.run("uvicorn app:app --host 0.0.0.0 --port 7860", shell=True)
\ No newline at end of file
+parser = argparse.ArgumentParser("Start the HASHIRU server.")
+parser.add_argument("--host", type=str, default="0.0.0.0")
+parser.add_argument("--port", type=int, default=7860)
+parser.add_argument("--workers", "-w", type=int, default=1,
+                    help="Worker processes, each listening on its own port from --port on")
+args = parser.parse_args()
+
+if args.workers <= 1:
+    subprocess.run(f"uvicorn app:app --host {args.host} --port {args.port}", shell=True)
+    sys.exit(0)
+
+# The workers share the budget, memories and modes through these backends;
+# agents, usage and the response cache are already in SQLite files
+env = dict(os.environ)
+env["HASHIRU_WORKERS"] = str(args.workers)
+env.setdefault("HASHIRU_BUDGET_DB", "./src/models/budget.db")
+# Every worker has to accept the session cookies of the others
+env.setdefault("SESSION_SECRET_KEY", secrets.token_hex(32))
+
+ports = [args.port + i for i in range(args.workers)]
+workers = [subprocess.Popen(["uvicorn", "app:app", "--host", args.host, "--port", str(port)], env=env)
+           for port in ports]
+print(f"Started {args.workers} workers on ports {ports[0]}-{ports[-1]}. "
+      "Gradio keeps its queue in each process, so put them behind a proxy with sticky sessions.")
+try:
+    while all(worker.poll() is None for worker in workers):
+        time.sleep(1)
+finally:
+    for worker in workers:
+        if worker.poll() is None:
+            worker.terminate()
+    for worker in workers:
+        worker.wait()
@@ -0,0 +1,258 @@
+import os
+import re
+import json
+import glob
+import time
+import hashlib
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DECISION_RE = re.compile(r"FINAL DECISION\W*\s*(accept|reject)", re.IGNORECASE)
+PAPER_COLUMNS = ["run", "paper_id", "ground_truth", "decision", "elapsed_time",
+                 "followups", "cost", "input_tokens", "output_tokens", "agents"]
+REVIEW_COLUMNS = ["run", "paper_id", "response", "agent_review"]
+CONFIG_COLUMNS = ["config_id", "base_model", "description", "system_prompt",
+                  "create_resource_cost", "invoke_resource_cost", "create_expense_cost",
+                  "invoke_expense_cost", "output_expense_cost"]
+# Fixed column types, so the files of all runs read as one dataset
+FLOAT_COLUMNS = ["elapsed_time", "followups", "cost", "input_tokens", "output_tokens",
+                 "create_resource_cost", "invoke_resource_cost", "create_expense_cost",
+                 "invoke_expense_cost", "output_expense_cost"]
+# Rows per Parquet row group, the most a conversion holds in memory
+BATCH_ROWS = 500
+
+
+def _schema(columns):
+    return pa.schema([(c, pa.float64() if c in FLOAT_COLUMNS
+                       else pa.list_(pa.string()) if c == "agents" else pa.string())
+                      for c in columns])
+
+
+class _TableWriter():
+    """
+    Writes rows to a Parquet file one row group at a time. The file only
+    replaces an earlier conversion once it is complete, until then it is
+    hidden from datasets by its leading dot.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+        self.schema = _schema(columns)
+        self.rows = []
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def parse_decision(text):
+    """
+    Last "FINAL DECISION: Accept/Reject" in a review, or None.
+    """
+    matches = DECISION_RE.findall(text or "")
+    return matches[-1].capitalize() if matches else None
+
+
+def _config_id(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf8")).hexdigest()[:16]
+
+
+def _trace_totals(result):
+    """
+    Tokens and cost of the model and agent calls in a record's trace.
+    """
+    spans = [s for s in result.get("trace", [])
+             if s.get("name") in ("manager.generate", "agent.call")]
+    return (sum(s.get("cost", 0) for s in spans) if spans else np.nan,
+            sum(s.get("input_tokens", 0) for s in spans) if spans else np.nan,
+            sum(s.get("output_tokens", 0) for s in spans) if spans else np.nan)
+
+
+def convert_run(jsonl_path, out_dir):
+    """
+    Streams one results file into Parquet tables under out_dir:
+    papers/<run>.parquet with one row per paper, agent_configs/<run>.parquet
+    with each distinct reviewer agent configuration once, and
+    reviews/<run>.parquet with the chat histories. The paper text in the
+    prompt is dropped, since it is already in the benchmark CSV. Records are
+    read line by line and written BATCH_ROWS at a time.
+    """
+    run = os.path.splitext(os.path.basename(jsonl_path))[0]
+    papers = _TableWriter(os.path.join(out_dir, "papers", f"{run}.parquet"), PAPER_COLUMNS)
+    reviews = _TableWriter(os.path.join(out_dir, "reviews", f"{run}.parquet"), REVIEW_COLUMNS)
+    configs = {}
+    count = 0
+    with open(jsonl_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Cut off by a crash, the benchmark reruns these papers
+                continue
+            agents = []
+            for name, config in (result.get("reviewer_agents") or {}).items():
+                config_id = _config_id(config)
+                configs.setdefault(config_id, {"config_id": config_id, **config})
+                agents.append(f"{name}={config_id}")
+            cost, input_tokens, output_tokens = _trace_totals(result)
+            count += 1
+            papers.add({
+                "run": run,
+                "paper_id": str(result["paper_id"]),
+                "ground_truth": result.get("ground_truth"),
+                "decision": parse_decision(result.get("response_history")),
+                "elapsed_time": result.get("elapsed_time"),
+                "followups": result.get("followups", np.nan),
+                "cost": cost,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "agents": agents,
+            })
+            reviews.add({
+                "run": run,
+                "paper_id": str(result["paper_id"]),
+                "response": result.get("response_history"),
+                "agent_review": json.dumps(result.get("agent_review")),
+            })
+
+    # Distinct configurations are few, so they are written in one go
+    agent_configs = _TableWriter(os.path.join(out_dir, "agent_configs", f"{run}.parquet"),
+                                 CONFIG_COLUMNS)
+    for config in configs.values():
+        agent_configs.add(config)
+    agent_configs.close()
+    reviews.close()
+    # Written last, as its time stamp marks the run as converted
+    papers.close()
+    return count
+
+
+def convert_results(results_dir="results", out_dir="results/parquet"):
+    """
+    Converts every results file that changed since its last conversion.
+    """
+    converted = 0
+    for jsonl_path in sorted(glob.glob(os.path.join(results_dir, "*.jsonl"))):
+        run = os.path.splitext(os.path.basename(jsonl_path))[0]
+        parquet_path = os.path.join(out_dir, "papers", f"{run}.parquet")
+        if os.path.exists(parquet_path) \
+                and os.path.getmtime(parquet_path) >= os.path.getmtime(jsonl_path):
+            continue
+        convert_run(jsonl_path, out_dir)
+        converted += 1
+    return converted
+
+
+def _load(out_dir, table, columns):
+    """Reads the columns of a table's files batch by batch, without the other columns"""
+    dataset = ds.dataset(os.path.join(out_dir, table), format="parquet", schema=_schema(columns))
+    batches = dataset.to_batches(columns=columns, batch_size=BATCH_ROWS * 10)
+    return pa.Table.from_batches(batches, schema=_schema(columns)).to_pandas()
+
+
+def load_papers(out_dir="results/parquet"):
+    return _load(out_dir, "papers", PAPER_COLUMNS)
+
+
+def load_agent_configs(out_dir="results/parquet"):
+    configs = _load(out_dir, "agent_configs", CONFIG_COLUMNS)
+    return configs.drop_duplicates("config_id").set_index("config_id")
+
+
+def _distribution(values):
+    values = values.dropna()
+    if values.empty:
+        return {"mean": None, "p50": None, "p95": None, "total": None}
+    return {"mean": float(values.mean()),
+            "p50": float(values.quantile(0.5)),
+            "p95": float(values.quantile(0.95)),
+            "total": float(values.sum())}
+
+
+def summarize(papers):
+    """
+    Accept/reject accuracy, latency and cost per run and over all runs.
+    """
+    papers = papers.assign(
+        truth=np.where(papers["ground_truth"].fillna("").str.startswith("Accept"), "Accept", "Reject"),
+        decided=papers["decision"].notna())
+    papers["correct"] = papers["decided"] & (papers["decision"] == papers["truth"])
+    accepted = papers["truth"] == "Accept"
+
+    def stats(group):
+        decided = group["decided"].sum()
+        return {
+            "papers": int(len(group)),
+            "decided": int(decided),
+            "accuracy": float(group["correct"].sum() / decided) if decided else None,
+            "accept_recall": float(group.loc[group["truth"] == "Accept", "correct"].mean())
+            if (group["truth"] == "Accept").any() else None,
+            "reject_recall": float(group.loc[group["truth"] == "Reject", "correct"].mean())
+            if (group["truth"] == "Reject").any() else None,
+            "latency_s": _distribution(group["elapsed_time"]),
+            "cost": _distribution(group["cost"]),
+        }
+
+    return {
+        "all": {**stats(papers),
+                "ground_truth_accept_rate": float(accepted.mean()),
+                "predicted_accept_rate": float((papers["decision"] == "Accept").mean())},
+        "runs": {run: stats(group) for run, group in papers.groupby("run", sort=True)},
+    }
+
+
+def agent_model_counts(papers, configs):
+    """
+    How many reviewer agents of every base model the runs created.
+    """
+    agents = papers["agents"].explode().dropna()
+    config_ids = agents.str.split("=", n=1).str[1]
+    return configs.loc[config_ids, "base_model"].value_counts().to_dict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Summarize paper-review benchmark results.")
+    parser.add_argument("--results_dir", "-d", type=str, default="results")
+    parser.add_argument("--parquet_dir", "-p", type=str, default=None,
+                        help="Where the columnar copy is kept, <results_dir>/parquet by default")
+    parser.add_argument("--output", "-o", type=str, default=None,
+                        help="Also write the summary to this JSON file")
+    args = parser.parse_args()
+    parquet_dir = args.parquet_dir or os.path.join(args.results_dir, "parquet")
+
+    start = time.time()
+    converted = convert_results(args.results_dir, parquet_dir)
+    print(f"Converted {converted} results files in {time.time() - start:.2f}s")
+
+    start = time.time()
+    papers = load_papers(parquet_dir)
+    summary = summarize(papers)
+    summary["agent_models"] = agent_model_counts(papers, load_agent_configs(parquet_dir))
+    print(f"Summarized {len(papers)} papers in {time.time() - start:.3f}s")
+    print(json.dumps(summary["all"], indent=2))
+    for run, stats in summary["runs"].items():
+        accuracy = "n/a" if stats["accuracy"] is None else f"{stats['accuracy']:.2%}"
+        print(f"  {run:<45} papers={stats['papers']:<4} accuracy={accuracy:<7} "
+              f"p50={stats['latency_s']['p50'] or 0:.0f}s")
+    print(f"Reviewer agents by model: {summary['agent_models']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
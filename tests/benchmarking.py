@@ -1,25 +1,35 @@
 import os
+import sys
 import json
 import random
 import time
+import queue
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from tqdm import tqdm
 import pandas as pd
 import argparse
 from gradio_client import Client
-from google import genai
 from google.genai import types
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.manager.utils.provider_clients import get_gemini_client
+from src.manager.utils.rate_limiter import call_with_rate_limit
+from src.manager.utils.tracing import summarize_spans
+
 API_KEY = os.getenv("API_KEY", "")
+DEFAULT_URL = "http://127.0.0.1:7860/"
 random.seed(12345)
 
 
-def get_client(model_name: str):
+def get_client(model_name: str, url: str = DEFAULT_URL):
     """
     Initialize and return a client based on model_name.
     """
     if model_name == "hashiru":
-        client = Client("http://127.0.0.1:7860/")
+        client = Client(url)
         client.predict(
             modeIndexes=[
                 "ENABLE_AGENT_CREATION",
@@ -35,7 +45,8 @@ def get_client(model_name: str):
         return client
 
     elif model_name == "flash2.0":
-        return genai.Client(api_key=API_KEY)
+        # Shared client, so HASHIRU_PROVIDER_MODE=record/replay applies here too
+        return get_gemini_client(API_KEY)
 
     else:
         raise ValueError(f"Unsupported model: {model_name}")
@@ -44,7 +55,7 @@ def get_client(model_name: str):
 def call_api(client, model_name: str, prompt: str, history=None, tries=0):
     """
     Send prompt (and optional history) to the appropriate API and return response content and updated history.
-    Retries up to 3 times on error.
+    Retries up to 3 times on error; rate limits are handled by the shared limiter.
     """
     if tries > 3:
         print("Error: too many tries")
@@ -70,19 +81,19 @@ def call_api(client, model_name: str, prompt: str, history=None, tries=0):
             ]
         ]
         try:
-            gen_output = client.models.generate_content(
+            # Rate limits are waited out by the limiter, at the pace the API allows
+            gen_output = call_with_rate_limit("gemini", "gemini-2.0-flash", lambda: client.models.generate_content(
                 model="gemini-2.0-flash",
                 contents=prompt,
                 config=types.GenerateContentConfig(
                     temperature=0.2,
                     safety_settings=safety_settings,
                 ),
-            )
+            ))
             content = gen_output.text
             new_history = history
 
         except Exception as e:
-            time.sleep(60)
             return call_api(client, model_name, prompt, history, tries + 1)
     else:
         content, new_history = "", history
@@ -92,6 +103,24 @@ def call_api(client, model_name: str, prompt: str, history=None, tries=0):
     return content, new_history
 
 
+def call_job(client, prompt, history=None, poll_interval=5.0):
+    """
+    Sends prompt to HASHIRU's job queue and polls until the job finishes, so
+    no connection is held open while it answers. Returns the response
+    content, the updated history and the job's trace.
+    """
+    job_id = client.predict(prompt, json.dumps(history or []), api_name="/submit_job")
+    while True:
+        job = json.loads(client.predict(job_id, api_name="/job_status"))
+        if job["status"] in ("done", "error", "cancelled", "not_found"):
+            break
+        time.sleep(poll_interval)
+    if job["status"] != "done":
+        raise RuntimeError(f"Job {job_id} {job['status']}: {job.get('error')}")
+    history = job["output"] or []
+    return _extract_from_history(history), history, job["trace"]
+
+
 def _extract_from_history(history):
     """
     Helper to pull the last assistant content from chat history.
@@ -107,6 +136,163 @@ def _extract_from_history(history):
     return ""
 
 
+class ResultWriter():
+    """
+    Appends results to one JSONL file from a single thread. Workers only
+    enqueue, and the file is flushed every flush_every results or
+    flush_interval seconds, so a crash loses at most one batch.
+    """
+
+    def __init__(self, path, flush_every=10, flush_interval=30.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, result):
+        self._queue.put(json.dumps(result) + "\n")
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        pending = 0
+        last_flush = time.time()
+        with open(self.path, "a", buffering=1024 * 1024) as fo:
+            while True:
+                try:
+                    line = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    line = ""
+                if line is None:
+                    break
+                if line:
+                    fo.write(line)
+                    pending += 1
+                if pending and (pending >= self.flush_every
+                                or time.time() - last_flush >= self.flush_interval):
+                    fo.flush()
+                    os.fsync(fo.fileno())
+                    pending = 0
+                    last_flush = time.time()
+            fo.flush()
+            os.fsync(fo.fileno())
+
+
+def fetch_trace(client, model_name):
+    """
+    Pops the spans HASHIRU recorded for this client's session, so each call
+    returns the spans since the previous one.
+    """
+    if model_name != "hashiru":
+        return []
+    try:
+        return json.loads(client.predict(api_name="/get_trace"))
+    except Exception as e:
+        print(f"Could not fetch the trace: {e}")
+        return []
+
+
+def agents_from_trace(trace):
+    """The agents that answered in a traced review, with the models they ran on"""
+    return {span["agent"]: {"base_model": span.get("model")} for span in trace
+            if span["name"] in ("ask_agent", "agent.call") and span.get("agent")}
+
+
+def summarize_run(out_file):
+    """
+    p50/p95 latency, tokens and cost per stage over every paper in a results
+    file, with the whole review of a paper as the "paper" stage.
+    """
+    spans = []
+    with open(out_file) as f:
+        for line in f:
+            result = json.loads(line)
+            spans.extend(result.get("trace", []))
+            spans.append({"name": "paper", "duration_s": result["elapsed_time"]})
+    return summarize_spans(spans)
+
+
+def load_checkpoint(out_file):
+    """
+    Returns the IDs of the papers already in a results file. A last line cut
+    off by a crash is removed, so appending continues on a clean line.
+    """
+    completed = set()
+    if not os.path.exists(out_file):
+        return completed
+    with open(out_file, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            print(f"Dropping an incomplete last line from {out_file}")
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            completed.add(str(json.loads(line)["paper_id"]))
+        except (ValueError, KeyError):
+            continue
+    return completed
+
+
+def review_paper(client, model_name, row, id_col, text_col, max_followups, use_jobs=False):
+    """
+    Reviews one paper, re-prompting for a missing final decision. With
+    use_jobs every prompt is answered as a HASHIRU job instead of a chat call.
+    """
+    paper_id = row[id_col]
+    title = row.get("Title", "")
+    iter_start = time.time()
+    prompt = (
+        "Review the following paper for International Conference on Learning Representations (ICLR) 2023. "
+        "Remember you need to make 3 reviewer agents for each paper. "
+        "GIVE A FINAL DECISION in the form of \"FINAL DECISION: <Accept/Reject>\". "
+        f"The paper title is: {title}\n\n" + row[text_col]
+    )
+
+    trace = []
+
+    def ask(text, history):
+        if use_jobs:
+            content, history, job_trace = call_job(client, text, history)
+            trace.extend(job_trace)
+            return content, history
+        return call_api(client, model_name, text, history)
+
+    # Drop spans left over from an earlier paper that failed
+    fetch_trace(client, model_name)
+    history = []
+    content, history = ask(prompt, history)
+
+    # ensure final decision, but give up after max_followups re-prompts
+    followups = 0
+    while "FINAL DECISION" not in content.upper() and followups < max_followups:
+        followups += 1
+        content, history = ask(
+            "Please finish the review and give the FINAL DECISION line.",
+            history
+        )
+
+    elapsed_time = time.time() - iter_start
+    if not use_jobs:
+        trace = fetch_trace(client, model_name)
+    return {
+        "paper_id": paper_id,
+        "prompt": prompt,
+        "agent_review": history,
+        "ground_truth": row.get("Decision"),
+        "response_history": content,
+        "elapsed_time": elapsed_time,
+        "followups": followups,
+        "reviewer_agents": agents_from_trace(trace),
+        "trace": trace,
+        "stages": summarize_spans(trace)
+    }
+
+
 def benchmark_paper_reviews(
     csv_path,
     model_name,
@@ -114,10 +300,21 @@ def benchmark_paper_reviews(
     text_col="concatenated_text",
     num_samples=None,
     offset=0,
-    output_dir="results"
+    output_dir="results",
+    max_followups=3,
+    urls=(DEFAULT_URL,),
+    workers=1,
+    output_file=None,
+    use_jobs=False
 ):
     """
     Benchmark agent performance on paper reviews and write JSONL with prompt repetition.
+
+    Papers are reviewed by a pool of workers spread round-robin over the
+    HASHIRU instances in urls. Passing the output_file of an earlier run
+    resumes it: papers already in the file are skipped. With use_jobs the
+    papers are submitted to HASHIRU's job queue, so throughput is set by its
+    job workers rather than by open connections.
     """
     df = pd.read_csv(csv_path, sep="|")
     if offset or num_samples:
@@ -125,59 +322,67 @@ def benchmark_paper_reviews(
         df = df.iloc[offset:end].reset_index(drop=True)
 
     os.makedirs(output_dir, exist_ok=True)
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    out_file = os.path.join(output_dir, f"paper_review_{model_name}_{ts}.jsonl")
-    print(f"Results will be written to {out_file}")
+    if output_file is None:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_file = os.path.join(output_dir, f"paper_review_{model_name}_{ts}.jsonl")
+    completed = load_checkpoint(output_file)
+    rows = [row for _, row in df.iterrows() if str(row[id_col]) not in completed]
+    print(f"Results will be written to {output_file}")
+    print(f"{len(df) - len(rows)} of {len(df)} papers already reviewed, {len(rows)} to go")
+
+    # One client per worker thread, each bound to the next instance
+    local = threading.local()
+    next_url = itertools.cycle(urls)
+    url_lock = threading.Lock()
 
-    client = get_client(model_name)
+    def worker_client():
+        if not hasattr(local, "client"):
+            with url_lock:
+                url = next(next_url)
+            local.client = get_client(model_name, url)
+        return local.client
+
+    def run(row):
+        return review_paper(worker_client(), model_name, row,
+                            id_col, text_col, max_followups, use_jobs)
+
+    writer = ResultWriter(output_file)
     results = []
+    failed = 0
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                tqdm(total=len(rows), smoothing=0.1) as progress:
+            futures = {executor.submit(run, row): row[id_col] for row in rows}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Not written, so a resumed run retries the paper
+                    failed += 1
+                    tqdm.write(f"Error reviewing ID={futures[future]}: {e}")
+                else:
+                    writer.write(result)
+                    results.append(result)
+                progress.update(1)
+                progress.set_postfix(
+                    papers_per_hour=f"{len(results) * 3600 / (time.time() - start):.1f}",
+                    failed=failed)
+    finally:
+        writer.close()
 
-    for idx, row in tqdm(df.iterrows(), total=len(df)):
-        paper_id = row[id_col]
-        title = row.get("Title", "")
-        iter_start = time.time()
-        prompt = (
-            "Review the following paper for International Conference on Learning Representations (ICLR) 2023. "
-            "Remember you need to make 3 reviewer agents for each paper. "
-            "GIVE A FINAL DECISION in the form of \"FINAL DECISION: <Accept/Reject>\". "
-            f"The paper title is: {title}\n\n" + row[text_col]
-        )
+    elapsed = time.time() - start
+    print(f"Benchmark complete: {len(results)} papers in {elapsed / 3600:.2f}h "
+          f"({len(results) * 3600 / max(elapsed, 1e-9):.1f} papers/h), {failed} failed.")
 
-        print(f"[{idx+1}/{len(df)}] Reviewing ID={paper_id}")
-        history = []
-        content, history = call_api(client, model_name, prompt, history)
-
-        # ensure final decision
-        while "FINAL DECISION" not in content.upper():
-            time.sleep(5)
-            content, history = call_api(
-                client,
-                model_name,
-                "Please finish the review and give the FINAL DECISION line.",
-                history
-            )
-
-        elapsed_time = time.time() - iter_start
-        # Read src/models/models.json
-        with open("src/models/models.json", "r") as f:
-            reviewer_agents_data = json.load(f)
-        result = {
-            "paper_id": paper_id,
-            "prompt": prompt,
-            "agent_review": history,
-            "ground_truth": row.get("Decision"),
-            "response_history": content,
-            "elapsed_time": elapsed_time,
-            "reviewer_agents": reviewer_agents_data
-        }
-
-        with open(out_file, "a") as fo:
-            fo.write(json.dumps(result) + "\n")
-
-        results.append(result)
-        time.sleep(5)
-
-    print("Benchmark complete.")
+    summary = summarize_run(output_file)
+    summary_file = os.path.splitext(output_file)[0] + "_summary.json"
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"Per-stage summary written to {summary_file}")
+    for stage, stats in sorted(summary.items()):
+        print(f"  {stage:<20} n={stats['count']:<6} p50={stats['p50_s']:.2f}s "
+              f"p95={stats['p95_s']:.2f}s cost=${stats['cost']:.4f}")
     return results
 
 
@@ -188,12 +393,29 @@ if __name__ == "__main__":
     parser.add_argument("--offset", "-o", type=int, default=0)
     parser.add_argument("--num_samples", "-n", type=int, help="Number of papers to sample", default=None)
     parser.add_argument("--output_dir", "-d", type=str, default="results")
+    parser.add_argument("--output_file", "-f", type=str, default=None,
+                        help="Results file of an earlier run to resume; reviewed papers are skipped")
+    parser.add_argument("--max_followups", type=int, default=3,
+                        help="Maximum number of re-prompts for a missing FINAL DECISION")
+    parser.add_argument("--urls", "-u", type=str, nargs="+", default=[DEFAULT_URL],
+                        help="HASHIRU instances to spread the workers over")
+    parser.add_argument("--workers", "-w", type=int, default=1,
+                        help="Number of papers reviewed at the same time")
+    parser.add_argument("--jobs", action="store_true",
+                        help="Submit the reviews to HASHIRU's job queue and poll for the results")
     args = parser.parse_args()
+    if args.jobs and args.model != "hashiru":
+        parser.error("--jobs needs --model hashiru")
 
     benchmark_paper_reviews(
         csv_path=args.csv,
         model_name=args.model,
         num_samples=args.num_samples,
         offset=args.offset,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        max_followups=args.max_followups,
+        urls=args.urls,
+        workers=args.workers,
+        output_file=args.output_file,
+        use_jobs=args.jobs
     )
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import numpy as np
+import psutil
+from concurrent.futures import ThreadPoolExecutor
+from gradio_client import Client
+
+DEFAULT_URL = "http://127.0.0.1:7860/"
+DEFAULT_PROMPTS = [
+    "Summarize the main contributions of transformer models in two sentences.",
+    "What are the trade-offs between local and cloud language models?",
+    "Give three tips for writing a clear paper abstract.",
+    "Explain what a budget-aware agent orchestrator does.",
+]
+DEFAULT_SEED = 12345
+
+
+def start_server(url, replay_file=None, concurrency=None):
+    """
+    Starts `app.py --no-auth` and waits until it answers. With a replay file
+    the server answers from recorded provider calls, so no API keys or
+    network are needed.
+    """
+    env = dict(os.environ)
+    if replay_file:
+        env["HASHIRU_PROVIDER_MODE"] = "replay"
+        env["HASHIRU_REPLAY_FILE"] = replay_file
+    if concurrency:
+        env["HASHIRU_CHAT_CONCURRENCY"] = str(concurrency)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen([sys.executable, "app.py", "--no-auth"], cwd=root, env=env)
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited while starting")
+        try:
+            Client(url, verbose=False)
+            return server
+        except Exception:
+            time.sleep(2)
+    server.terminate()
+    raise RuntimeError("The server did not start within 5 minutes")
+
+
+class MemorySampler():
+    """
+    Samples the RSS of the server process and its children in the background.
+    """
+
+    def __init__(self, pid, interval=0.5):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def rss_mb(self):
+        processes = [self.process] + self.process.children(recursive=True)
+        rss = 0
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return rss / 1024 ** 2
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(self.rss_mb())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self.baseline = self.rss_mb()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return max(self.samples, default=self.baseline)
+
+
+def _has_answer(output):
+    """
+    Whether a streamed chat update already holds assistant text. Progress
+    messages of running tools are not an answer.
+    """
+    response = output[0] if isinstance(output, (list, tuple)) else output
+    if isinstance(response, dict):
+        if (response.get("metadata") or {}).get("status") == "pending":
+            return False
+        response = response.get("content")
+    return isinstance(response, str) and response.strip() != ""
+
+
+def run_session(url, prompts, turns, start_at, seed=DEFAULT_SEED):
+    """
+    One synthetic user: a chat session sending `turns` messages in a row,
+    each waiting for the previous answer. Returns one record per message.
+    The prompts are picked with `seed`, so every run sends the same ones.
+    """
+    rng = random.Random(seed)
+    client = Client(url, verbose=False)
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    history = []
+    records = []
+    for _ in range(turns):
+        prompt = rng.choice(prompts)
+        started = time.time()
+        first_token = None
+        record = {"session": client.session_hash, "start": started}
+        try:
+            job = client.submit({"text": prompt, "files": []}, history, api_name="/chat")
+            for output in job:
+                if first_token is None and _has_answer(output):
+                    first_token = time.time()
+            _, history = job.result()
+            record["status"] = "success"
+        except Exception as e:
+            record.update(status="error", error=str(e))
+        record["latency_s"] = time.time() - started
+        record["ttft_s"] = first_token - started if first_token is not None else None
+        records.append(record)
+    return records
+
+
+def _percentiles(values):
+    values = np.array([v for v in values if v is not None], dtype=float)
+    if values.size == 0:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(values.max())}
+
+
+def load_test(url=DEFAULT_URL, users=8, turns=3, ramp_up=0.0, prompts=DEFAULT_PROMPTS,
+              server_pid=None, seed=DEFAULT_SEED):
+    """
+    Drives `users` concurrent chat sessions against one instance and reports
+    throughput, time to first token, latency percentiles and, when the server
+    runs on this machine, its memory per session.
+    """
+    sampler = MemorySampler(server_pid) if server_pid else None
+    if sampler:
+        sampler.start()
+    start = time.time()
+    # Users start ramp_up / users seconds apart
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [executor.submit(run_session, url, prompts, turns,
+                                   start + ramp_up * i / max(users, 1), seed + i)
+                   for i in range(users)]
+        records = [record for future in futures for record in future.result()]
+    elapsed = time.time() - start
+
+    succeeded = [r for r in records if r["status"] == "success"]
+    report = {
+        "users": users,
+        "requests": len(records),
+        "errors": len(records) - len(succeeded),
+        "duration_s": elapsed,
+        "throughput_rps": len(succeeded) / elapsed if elapsed else None,
+        "ttft_s": _percentiles(r["ttft_s"] for r in succeeded),
+        "latency_s": _percentiles(r["latency_s"] for r in succeeded),
+    }
+    if sampler:
+        peak = sampler.stop()
+        report["memory_mb"] = {
+            "baseline": sampler.baseline,
+            "peak": peak,
+            "per_session": (peak - sampler.baseline) / users,
+        }
+    return report, records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Load-test the HASHIRU chat endpoint.")
+    parser.add_argument("--url", "-u", type=str, default=DEFAULT_URL)
+    parser.add_argument("--users", "-n", type=int, nargs="+", default=[8],
+                        help="Concurrent users; several values run one step each")
+    parser.add_argument("--turns", "-t", type=int, default=3,
+                        help="Messages every user sends in its session")
+    parser.add_argument("--ramp_up", type=float, default=0.0,
+                        help="Seconds over which the users start")
+    parser.add_argument("--prompts", type=str, default=None,
+                        help="File with one prompt per line, instead of the built-in prompts")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start `app.py --no-auth` for the test and stop it afterwards")
+    parser.add_argument("--replay_file", type=str, default=None,
+                        help="With --spawn, answer from these recorded provider calls "
+                             "(see HASHIRU_PROVIDER_MODE=record)")
+    parser.add_argument("--server_concurrency", type=int, default=None,
+                        help="With --spawn, chats the server answers at the same time")
+    parser.add_argument("--server_pid", type=int, default=None,
+                        help="PID of a server already running on this machine, to measure its memory")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help="Seed of the prompt choice; user i uses seed + i")
+    parser.add_argument("--output", "-o", type=str, default=None,
+                        help="Write the reports and per-request records to this JSON file")
+    parser.add_argument("--max_p99_latency", type=float, default=None,
+                        help="Exit with an error if any step's p99 latency is above this many seconds")
+    parser.add_argument("--min_throughput", type=float, default=None,
+                        help="Exit with an error if any step answers fewer requests per second")
+    args = parser.parse_args()
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    server = None
+    server_pid = args.server_pid
+    if args.spawn:
+        server = start_server(args.url, args.replay_file,
+                              args.server_concurrency or max(args.users))
+        server_pid = server.pid
+    results = []
+    try:
+        for users in args.users:
+            report, records = load_test(args.url, users, args.turns, args.ramp_up,
+                                        prompts, server_pid, args.seed)
+            print(json.dumps(report, indent=2))
+            results.append({"report": report, "records": records})
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    for result in results:
+        report = result["report"]
+        p99 = report["latency_s"]["p99"]
+        if args.max_p99_latency is not None and (p99 is None or p99 > args.max_p99_latency):
+            print(f"{report['users']} users: p99 latency {p99} s is above {args.max_p99_latency} s")
+            failed = True
+        if args.min_throughput is not None and (report["throughput_rps"] or 0) < args.min_throughput:
+            print(f"{report['users']} users: throughput {report['throughput_rps']} rps "
+                  f"is below {args.min_throughput} rps")
+            failed = True
+    sys.exit(1 if failed else 0)